@@ -0,0 +1,103 @@
+'''
+Measure the start up time of the console scripts defined in setup.py.
+
+For each entry point this reports the wall time of `<script> --help` and the cumulative
+import time of the entry point module as measured by `python -X importtime`, together with
+the slowest top level imports.
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --repeat 5 --top 5 -o startup.json
+'''
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+
+import click
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def console_scripts(setup_path=os.path.join(ROOT, 'setup.py')):
+    with open(setup_path) as f:
+        content = f.read()
+    pattern = re.compile(r"'([\w-]+)\s*=\s*([\w.]+):(\w+)'")
+    return [m.groups() for m in pattern.finditer(content)]
+
+
+def _run(code, *flags):
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get('PYTHONPATH', ''), MPLBACKEND='Agg')
+    return subprocess.run(
+        [sys.executable, *flags, '-c', code], capture_output=True, text=True, env=env, cwd=ROOT
+    )
+
+
+def help_time(name, module, function, repeat=3):
+    '''
+    Best wall time in seconds of calling the entry point with --help in a fresh interpreter.
+    '''
+    code = f'import sys; sys.argv = [{name!r}, "--help"]; from {module} import {function}; {function}()'
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = _run(code)
+        times.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            raise RuntimeError(f'{name} --help failed:\n{result.stderr}')
+    return min(times)
+
+
+def import_times(module):
+    '''
+    Parse the output of `python -X importtime` into a list of (self, cumulative, depth, package)
+    with times in seconds.
+    '''
+    result = _run(f'import {module}', '-X', 'importtime')
+    if result.returncode != 0:
+        raise RuntimeError(f'importing {module} failed:\n{result.stderr}')
+
+    rows = []
+    for line in result.stderr.splitlines():
+        m = re.match(r'import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s+)(\S+)', line)
+        if m:
+            self_us, cumulative_us, indent, package = m.groups()
+            depth = (len(indent) - 1) // 2
+            rows.append((int(self_us) / 1e6, int(cumulative_us) / 1e6, depth, package))
+    return rows
+
+
+@click.command()
+@click.option('--repeat', default=3, help='Number of --help invocations per script, the fastest one is reported')
+@click.option('--top', default=3, help='Number of slowest top level imports to list per script')
+@click.option('-o', '--output', type=click.Path(exists=False), help='Write the results as json')
+def main(repeat, top, output):
+    results = []
+    for name, module, function in console_scripts():
+        rows = import_times(module)
+        total = next(cumulative for _, cumulative, _, package in reversed(rows) if package == module)
+        # third party packages, imported modules of the same package are nested below them
+        packages = [r for r in rows if '.' not in r[3] and r[3] not in sys.stdlib_module_names and r[3] != 'cta_plots']
+        top_level = sorted(packages, key=lambda r: -r[1])[:top]
+
+        result = {
+            'script': name,
+            'module': module,
+            'help_time': help_time(name, module, function, repeat=repeat),
+            'import_time': total,
+            'slowest_imports': {package: cumulative for _, cumulative, _, package in top_level},
+        }
+        results.append(result)
+
+        slowest = ', '.join(f'{p} {t:.3f}s' for p, t in result['slowest_imports'].items())
+        click.echo(f"{name:<28} --help {result['help_time']:.3f}s  import {total:.3f}s  ({slowest})")
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    # pylint: disable=no-value-for-parameter
+    main()
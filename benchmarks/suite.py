@@ -0,0 +1,328 @@
+'''
+Benchmarks for the sensitivity and reconstruction hot paths on synthetic data.
+
+Every benchmark is run for a range of event counts. The best wall time of a few repetitions
+and the peak memory allocated during one call (measured with tracemalloc) are appended,
+together with the current commit, to a JSON history file. The compare command
+reports the changes between two entries of the history and fails on regressions.
+
+    python benchmarks/suite.py run --sizes 10000 100000 1000000
+    python benchmarks/suite.py run -b find_best_cuts -b auc --sizes 10000000
+    python benchmarks/suite.py compare            # last two entries
+    python benchmarks/suite.py compare a1b2c3d HEAD
+
+Synthetic event files are generated with cta_plots.synthetic on first use
+and kept in the data directory.
+'''
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from functools import lru_cache
+
+import click
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DEFAULT_HISTORY = os.path.join(ROOT, 'benchmarks', 'history.json')
+DEFAULT_DATA_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'cta_plots', 'benchmarks')
+DEFAULT_SIZES = (10**4, 10**5, 10**6)
+
+
+@lru_cache(maxsize=None)
+def synthetic_file(data_dir, particle, n, pointlike=False):
+    from cta_plots.synthetic import generate_events
+
+    kind = 'pointlike' if pointlike else 'diffuse'
+    path = os.path.join(data_dir, f'{particle}_{kind}_{n}.h5')
+    if not os.path.exists(path):
+        os.makedirs(data_dir, exist_ok=True)
+        click.echo(f'generating {path}', err=True)
+        generate_events(path + '.tmp', particle=particle, n_events=n, pointlike=pointlike, seed=n)
+        os.rename(path + '.tmp', path)
+    return path
+
+
+@lru_cache(maxsize=1)
+def events(data_dir, n):
+    '''
+    Point-like gammas and background (protons and electrons) with n events each.
+    '''
+    import astropy.units as u
+    from cta_plots import load_signal_events, load_background_events
+
+    gammas, source_alt, source_az = load_signal_events(synthetic_file(data_dir, 'gamma', n, pointlike=True), assumed_obs_time=50 * u.h)
+    background = load_background_events(
+        synthetic_file(data_dir, 'proton', n), synthetic_file(data_dir, 'electron', n // 2 or 1),
+        source_alt, source_az, assumed_obs_time=50 * u.h,
+    )
+    return gammas, background.sample(n, random_state=0) if len(background) > n else background
+
+
+def bench_find_best_cuts(data_dir, n):
+    from cta_plots.sensitivity.optimize import find_best_cuts
+
+    gammas, background = events(data_dir, n)
+    theta_cuts = np.arange(0.01, 0.18, 0.02)
+    prediction_cuts = np.arange(0.3, 1.05, 0.1)
+    multiplicities = np.arange(2, 6)
+    return lambda: find_best_cuts(theta_cuts, prediction_cuts, multiplicities, gammas, background, n_jobs=1)
+
+
+def bench_find_relative_sensitivity(data_dir, n):
+    from cta_plots.sensitivity import find_relative_sensitivity
+
+    rng = np.random.default_rng(0)
+    counts = rng.uniform(10, 1000, size=(n, 2))
+    return lambda: [find_relative_sensitivity(s, b) for s, b in counts]
+
+
+def bench_find_relative_sensitivity_poisson(data_dir, n):
+    from cta_plots.sensitivity import find_relative_sensitivity_poisson
+
+    rng = np.random.default_rng(0)
+    counts = rng.uniform(10, 1000, size=(n, 2))
+    return lambda: [find_relative_sensitivity_poisson(s, b, s, b, N=100) for s, b in counts]
+
+
+def bench_distance_to_point_source(data_dir, n):
+    import astropy.units as u
+    from cta_plots.coordinate_utils import calculate_distance_to_point_source
+
+    _, background = events(data_dir, n)
+    return lambda: calculate_distance_to_point_source(background, source_alt=70 * u.deg, source_az=0 * u.deg)
+
+
+def bench_reweigh(data_dir, n):
+    import astropy.units as u
+    from cta_plots import load_runs
+    from cta_plots.spectrum import MCSpectrum, CosmicRaySpectrum
+
+    path = synthetic_file(data_dir, 'proton', n)
+    mc_spectrum = MCSpectrum.from_cta_runs(load_runs(path))
+    energies = events(data_dir, n)[1].mc_energy.values * u.TeV
+    return lambda: mc_spectrum.reweigh_to_other_spectrum(CosmicRaySpectrum(), energies, t_assumed_obs=50 * u.h)
+
+
+def bench_load_background_events(data_dir, n):
+    import astropy.units as u
+    from cta_plots import load_background_events
+
+    protons, electrons = synthetic_file(data_dir, 'proton', n), synthetic_file(data_dir, 'electron', n // 2 or 1)
+    return lambda: load_background_events(protons, electrons, 70 * u.deg, 0 * u.deg, assumed_obs_time=50 * u.h)
+
+
+def _resolution_inputs(data_dir, n):
+    from cta_plots.binning import make_default_cta_binning
+    from cta_plots.coordinate_utils import calculate_distance_to_true_source_position
+
+    gammas, _ = events(data_dir, n)
+    bins, _, _ = make_default_cta_binning()
+    distance = calculate_distance_to_true_source_position(gammas).value
+    return gammas.mc_energy.values, distance, bins.value
+
+
+def bench_resolution_percentile(data_dir, n):
+    from scipy.stats import binned_statistic
+
+    x, y, bins = _resolution_inputs(data_dir, n)
+    return lambda: binned_statistic(x, y, statistic=lambda y: np.nanpercentile(y, 68), bins=bins)
+
+
+def bench_resolution_bootstrap(data_dir, n):
+    from cta_plots.bootstrap import bootstrap_binned_percentile
+
+    x, y, bins = _resolution_inputs(data_dir, n)
+    return lambda: bootstrap_binned_percentile(x, y, bins, 68, n_bootstrap=20, n_jobs=1)
+
+
+def bench_auc(data_dir, n):
+    from cta_plots.ml.roc import BinnedROC
+
+    gammas, background = events(data_dir, n)
+    s, b = gammas.gamma_prediction_mean.values, background.gamma_prediction_mean.values
+    return lambda: BinnedROC.from_predictions(s, b).auc()
+
+
+def bench_segmented_auc(data_dir, n):
+    from cta_plots.bootstrap import digitize
+    from cta_plots.ml.roc import segmented_auc
+
+    gammas, background = events(data_dir, n)
+    bins = np.logspace(-2, 2, 21)
+    s_codes = np.maximum(digitize(gammas.gamma_energy_prediction_mean.values, bins), 0)
+    b_codes = np.maximum(digitize(background.gamma_energy_prediction_mean.values, bins), 0)
+    s, b = gammas.gamma_prediction_mean.values, background.gamma_prediction_mean.values
+    return lambda: segmented_auc(s, b, s_codes, b_codes)
+
+
+# name -> (setup, divisor of the size). The sensitivity solvers work on summed weights,
+# they are called size / 1000 (size / 10000 with Poisson errors) times instead.
+BENCHMARKS = {
+    'find_best_cuts': (bench_find_best_cuts, 1),
+    'find_relative_sensitivity': (bench_find_relative_sensitivity, 1000),
+    'find_relative_sensitivity_poisson': (bench_find_relative_sensitivity_poisson, 10000),
+    'distance_to_point_source': (bench_distance_to_point_source, 1),
+    'reweigh_to_other_spectrum': (bench_reweigh, 1),
+    'load_background_events': (bench_load_background_events, 1),
+    'resolution_percentile': (bench_resolution_percentile, 1),
+    'resolution_bootstrap': (bench_resolution_bootstrap, 1),
+    'auc': (bench_auc, 1),
+    'segmented_auc': (bench_segmented_auc, 1),
+}
+
+
+def measure(function, repeat=3, max_time=30):
+    '''
+    Best wall time of up to `repeat` calls (fewer if a call takes longer than `max_time` seconds)
+    and the peak traced memory in bytes of one additional call.
+    '''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+        if times[-1] > max_time:
+            break
+
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(times), peak
+
+
+def _git(*args):
+    result = subprocess.run(['git', *args], capture_output=True, text=True, cwd=ROOT)
+    return result.stdout.strip()
+
+
+def current_commit():
+    commit = _git('rev-parse', '--short', 'HEAD')
+    dirty = bool(_git('status', '--porcelain', '--untracked-files=no'))
+    return commit + ('-dirty' if dirty else '')
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def _format_bytes(n):
+    return f'{n / 2**20:.1f} MiB'
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.option('-b', '--benchmark', 'names', multiple=True, type=click.Choice(list(BENCHMARKS)), help='Run only these benchmarks')
+@click.option('-s', '--sizes', multiple=True, type=int, default=DEFAULT_SIZES, show_default=True, help='Event counts to run, up to 1e7')
+@click.option('--repeat', default=3, help='Number of timed calls, the fastest one is reported')
+@click.option('--data_dir', default=DEFAULT_DATA_DIR, type=click.Path(file_okay=False), help='Where synthetic event files are kept')
+@click.option('--history', default=DEFAULT_HISTORY, type=click.Path(dir_okay=False), show_default=True)
+@click.option('--save/--no-save', default=True, help='Append the results to the history')
+def run(names, sizes, repeat, data_dir, history, save):
+    '''
+    Run the benchmarks and append the results to the history.
+    '''
+    results = []
+    for name in names or BENCHMARKS:
+        setup, scale = BENCHMARKS[name]
+        for n in sorted(set(max(size // scale, 1) for size in sizes)):
+            wall_time, peak = measure(setup(data_dir, n), repeat=repeat)
+            results.append({'benchmark': name, 'n': n, 'time': wall_time, 'peak_memory': peak})
+            click.echo(f'{name:<36} {n:>10}  {wall_time:9.4f}s  {_format_bytes(peak):>12}')
+
+    if save:
+        entries = load_history(history)
+        entries.append({
+            'commit': current_commit(),
+            'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'machine': platform.node(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'results': results,
+        })
+        os.makedirs(os.path.dirname(os.path.abspath(history)), exist_ok=True)
+        with open(history, 'w') as f:
+            json.dump(entries, f, indent=1)
+
+
+def _find_entry(entries, commit):
+    # resolve references like HEAD or branch names, the history stores abbreviated hashes
+    full = _git('rev-parse', '--verify', '--quiet', f'{commit}^{{commit}}')
+    matches = [
+        e for e in entries
+        if e['commit'].startswith(commit) or (full and full.startswith(e['commit'].split('-')[0]))
+    ]
+    if not matches:
+        raise click.BadParameter(f'No results for commit {commit} in the history')
+    # the most recent run of that commit
+    return matches[-1]
+
+
+@cli.command()
+@click.argument('base', required=False)
+@click.argument('target', required=False)
+@click.option('--history', default=DEFAULT_HISTORY, type=click.Path(exists=True, dir_okay=False), show_default=True)
+@click.option('-t', '--threshold', default=0.1, show_default=True, help='Relative slowdown (or memory increase) counted as regression')
+@click.option('--min_time', default=0.005, show_default=True, help='Ignore time differences below this many seconds')
+def compare(base, target, history, threshold, min_time):
+    '''
+    Compare the results for the commits BASE and TARGET (the last two entries by default).
+    Exits with status 1 if any benchmark got slower or uses more memory by more than the threshold.
+    '''
+    entries = load_history(history)
+    if target is None and base is None:
+        if len(entries) < 2:
+            raise click.ClickException('Need at least two entries in the history')
+        base_entry, target_entry = entries[-2], entries[-1]
+    else:
+        base_entry = _find_entry(entries, base)
+        target_entry = _find_entry(entries, target) if target else entries[-1]
+
+    click.echo(f"{base_entry['commit']} ({base_entry['date']}) -> {target_entry['commit']} ({target_entry['date']})")
+    base_results = {(r['benchmark'], r['n']): r for r in base_entry['results']}
+
+    regressions = 0
+    for r in target_entry['results']:
+        b = base_results.get((r['benchmark'], r['n']))
+        if b is None:
+            continue
+        time_ratio = r['time'] / b['time']
+        memory_ratio = r['peak_memory'] / max(b['peak_memory'], 1)
+
+        flags = []
+        if time_ratio > 1 + threshold and r['time'] - b['time'] > min_time:
+            flags.append('SLOWER')
+        elif time_ratio < 1 / (1 + threshold) and b['time'] - r['time'] > min_time:
+            flags.append('faster')
+        if memory_ratio > 1 + threshold and r['peak_memory'] - b['peak_memory'] > 2**20:
+            flags.append('MORE MEMORY')
+        regressions += any(f.isupper() for f in flags)
+
+        click.echo(
+            f"{r['benchmark']:<36} {r['n']:>10}  {b['time']:9.4f}s -> {r['time']:9.4f}s ({time_ratio:5.2f}x)"
+            f"  {_format_bytes(b['peak_memory']):>12} -> {_format_bytes(r['peak_memory']):>12}  {' '.join(flags)}"
+        )
+
+    if regressions:
+        click.echo(f'{regressions} regression(s)')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    cli()
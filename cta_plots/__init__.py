@@ -1,25 +1,31 @@
-import astropy.units as u
+import importlib
+
 import numpy as np
-import pandas as pd
 from colorama import Fore
-from fact.io import read_data
-from scipy.interpolate import interp1d
-from scipy.ndimage import gaussian_filter1d
-import h5py
-
-from mpl_toolkits.axes_grid1 import make_axes_locatable
-
 
-from cta_plots.coordinate_utils import calculate_distance_to_point_source
+from cta_plots.profiling import profiled, stage
 
-from . import spectrum
+# Heavy dependencies (pandas, astropy, scipy, fact, h5py, matplotlib) are imported
+# inside the functions that need them so that the command line tools start quickly.
 
 # define these constants to identify electrons and protons in background data
 ELECTRON_TYPE = 1
 PROTON_TYPE = 0
 
 
+def __getattr__(name):
+    # import submodules like cta_plots.spectrum on first access
+    try:
+        return importlib.import_module(f'{__name__}.{name}')
+    except ModuleNotFoundError as e:
+        if e.name != f'{__name__}.{name}':
+            raise
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}') from None
+
+
 def load_data_description(path, data, cuts_path=None):
+    import h5py
+
     particle_dict = {0: 'Gamma', 1: 'Electron', 101: 'Proton'}
     num_array_events = len(data)
 
@@ -51,12 +57,17 @@ def load_data_description(path, data, cuts_path=None):
 
 
 def load_angular_resolution_function(angular_resolution_path, sigma=1):
+    import pandas as pd
+
     df = pd.read_csv(angular_resolution_path)
     f = create_interpolated_function(df.energy_prediction.values, df.angular_resolution, sigma=sigma)
     return f
 
 
 def create_interpolated_function(energies, values, sigma=1):
+    from scipy.interpolate import interp1d
+    from scipy.ndimage import gaussian_filter1d
+
     m = ~np.isnan(values)  # do not use nan values
     if sigma > 0:
         r = gaussian_filter1d(values[m], sigma=sigma)
@@ -68,30 +79,15 @@ def create_interpolated_function(energies, values, sigma=1):
 
 
 
+@profiled('apply cuts')
 def apply_cuts(df, cuts_path, sigma=1, theta_cuts=True, prediction_cuts=True, multiplicity_cuts=True):
-    cuts = pd.read_csv(cuts_path)
-    bin_center = np.sqrt(cuts.e_min * cuts.e_max)
-
-    m = np.ones(len(df)).astype(np.bool)
-    if theta_cuts:
-        source_az = df.mc_az.values * u.deg
-        source_alt = df.mc_alt.values * u.deg
-
-        df['theta'] = (calculate_distance_to_point_source(df, source_alt=source_alt, source_az=source_az).to_value(u.deg))
+    '''
+    The events in `df` passing the optimized cuts in `cuts_path`, see `cta_plots.cuts.CutSet`.
+    This copies the selected rows, use `load_cuts(cuts_path, sigma).mask(df)` to avoid that.
+    '''
+    from cta_plots.cuts import load_cuts
 
-        f_theta = create_interpolated_function(bin_center, cuts.theta_cut, sigma=sigma)
-        m &= df.theta < f_theta(df.theta)
-
-    if prediction_cuts: 
-        f_prediction = create_interpolated_function(bin_center, cuts.prediction_cut, sigma=0)
-        m &= df.gamma_prediction_mean >= f_prediction(df.gamma_energy_prediction_mean)
-
-    if multiplicity_cuts:
-        x0 = cuts.multiplicity.iloc[0]
-        x1 = cuts.multiplicity.iloc[-1]
-        f_mult = interp1d(cuts.e_min, cuts.multiplicity, kind='previous', bounds_error=False, fill_value=(x0, x1))
-        m &= df.num_triggered_telescopes >= f_mult(df.gamma_energy_prediction_mean)
-    
+    m = load_cuts(cuts_path, sigma=sigma).mask(df, theta=theta_cuts, prediction=prediction_cuts, multiplicity=multiplicity_cuts)
     return df[m]
 
 
@@ -109,22 +105,117 @@ DEFAULT_COLUMNS = [
 
 
 def load_runs(path):
+    from fact.io import read_data
+
     return read_data(path, key='runs')
 
 
-def load_signal_events(gammas_path, assumed_obs_time=30 * u.min, columns=DEFAULT_COLUMNS, calculate_weights=True):
+def read_chunked(path, key='array_events', columns=None, chunksize=1000000):
+    '''
+    Iterate over the rows of a group in a h5py style hdf5 file (one dataset per column)
+    and yield DataFrames with at most `chunksize` rows.
+    '''
+    import h5py
+    import pandas as pd
+
+    with h5py.File(path, 'r') as f:
+        group = f.get(key)
+        if group is None:
+            raise IOError('File does not contain group "{}"'.format(key))
+        if columns is None:
+            columns = list(group.keys())
+
+        n_rows = group[columns[0]].shape[0]
+        for start in range(0, n_rows, chunksize):
+            end = min(start + chunksize, n_rows)
+            yield pd.DataFrame({c: group[c][start:end] for c in columns})
+
+
+def preview_selection(energies, fraction, seed=0):
+    '''
+    Select a fraction of the events in every bin of true energy for quick previews.
+    Each bin keeps at least one event, so rare high energy events are not lost entirely.
+
+    The selection only depends on the seed and the order of the events. For the same seed
+    a larger fraction selects a superset of the events of a smaller fraction, so a preview
+    can be refined step by step up to full statistics.
+
+    Parameters
+    ----------
+    energies : array
+        true energies in TeV
+    fraction : float
+        fraction of events to keep in (0, 1]
+    seed : int, optional
+        seed of the random numbers deciding which events are kept
+
+    Returns
+    -------
+    tuple
+        mask of the selected events and the factor by which their weights have to be scaled
+        to preserve the expected rates
+    '''
+    import astropy.units as u
+    from cta_plots.binning import make_default_cta_binning
+    from cta_plots.histogram import digitize
+
+    if not 0 < fraction <= 1:
+        raise ValueError(f'Preview fraction has to be in (0, 1], got {fraction}')
+
+    bin_edges, _, _ = make_default_cta_binning(e_min=0.002 * u.TeV, e_max=2000 * u.TeV, overflow=True)
+    # events outside of the binning (or without energy) are put into their own stratum
+    strata = digitize(np.asarray(energies), bin_edges) + 1
+
+    keys = np.random.default_rng(seed).random(len(strata))
+    order = np.lexsort((keys, strata))
+    sorted_strata = strata[order]
+    rank = np.arange(len(order)) - np.searchsorted(sorted_strata, sorted_strata, side='left')
+
+    n_stratum = np.bincount(strata)[sorted_strata]
+    n_keep = np.maximum(1, np.ceil(fraction * n_stratum))
+
+    mask = np.empty(len(order), dtype=bool)
+    mask[order] = rank < n_keep
+    scale = np.empty(len(order))
+    scale[order] = n_stratum / n_keep
+    return mask, scale[mask]
+
+
+def load_signal_events(
+    gammas_path, assumed_obs_time=None, columns=DEFAULT_COLUMNS, calculate_weights=True, preview=None, seed=0, spectra=None
+):
+    '''
+    Load gammas and weight them to the Crab spectrum (`CrabLogParabola`).
+    For each name in `spectra` (see `cta_plots.spectrum.signal_spectrum`) an additional
+    column `weight_<name>` is added, all computed in one pass.
+    '''
+    import astropy.units as u
+    from fact.io import read_data
+    from cta_plots import spectrum
+    from cta_plots.coordinate_utils import calculate_distance_to_point_source
+
+    if assumed_obs_time is None:
+        assumed_obs_time = 30 * u.min
+
     # crab_spectrum = spectrum.CrabSpectrum()
     crab_spectrum = spectrum.CrabLogParabola()
 
-    gamma_runs = read_data(gammas_path, key='runs')
+    with stage('load gammas') as s:
+        gamma_runs = read_data(gammas_path, key='runs')
+
+        if (gamma_runs.mc_diffuse.std() != 0).any():
+            print(Fore.RED + f'Data given at {gammas_path} contains mix of diffuse and pointlike gammas.')
+            print(Fore.RESET)
+            raise ValueError
+
+        is_diffuse = (gamma_runs.mc_diffuse == 1).all()
+        gammas = read_data(gammas_path, key='array_events', columns=columns)
+        s.n_events = len(gammas)
+
+    if preview:
+        selected, scale = preview_selection(gammas.mc_energy.values, preview, seed=seed)
+        gammas = gammas[selected].reset_index(drop=True)
 
-    if (gamma_runs.mc_diffuse.std() != 0).any():
-        print(Fore.RED + f'Data given at {gammas_path} contains mix of diffuse and pointlike gammas.')
-        print(Fore.RESET)
-        raise ValueError
-    
-    is_diffuse = (gamma_runs.mc_diffuse == 1).all()
-    gammas = read_data(gammas_path, key='array_events', columns=columns)
     mc_production_gamma = spectrum.MCSpectrum.from_cta_runs(gamma_runs)
 
     if (gamma_runs.mc_diffuse == 1).all():
@@ -134,9 +225,10 @@ def load_signal_events(gammas_path, assumed_obs_time=30 * u.min, columns=DEFAULT
         source_az = gammas.mc_az.iloc[0] * u.deg
         source_alt = gammas.mc_alt.iloc[0] * u.deg
 
-    gammas['theta'] = (
-        calculate_distance_to_point_source(gammas, source_alt=source_alt, source_az=source_az).to(u.deg).value
-    )
+    with stage('theta', n_events=len(gammas)):
+        gammas['theta'] = (
+            calculate_distance_to_point_source(gammas, source_alt=source_alt, source_az=source_az).to(u.deg).value
+        )
 
     if calculate_weights:
         if is_diffuse:
@@ -144,46 +236,150 @@ def load_signal_events(gammas_path, assumed_obs_time=30 * u.min, columns=DEFAULT
             print(Fore.RESET)
             raise ValueError
 
-        gammas['weight'] = mc_production_gamma.reweigh_to_other_spectrum(
-            crab_spectrum, gammas.mc_energy.values * u.TeV, t_assumed_obs=assumed_obs_time
-        )
+        with stage('weight', n_events=len(gammas)):
+            gammas['weight'] = mc_production_gamma.reweigh_to_other_spectrum(
+                crab_spectrum, gammas.mc_energy.values * u.TeV, t_assumed_obs=assumed_obs_time
+            )
+            if preview:
+                gammas['weight'] *= scale
+
+        if spectra:
+            with stage('spectra', n_events=len(gammas)):
+                weights = mc_production_gamma.reweigh_to_other_spectra(
+                    [spectrum.signal_spectrum(name) for name in spectra], gammas.mc_energy.values * u.TeV, t_assumed_obs=assumed_obs_time
+                )
+                if preview:
+                    weights *= scale[:, np.newaxis]
+                for name, w in zip(spectra, weights.T):
+                    gammas[weight_column(name)] = w
 
     return gammas, source_alt, source_az
 
 
-def load_background_events(protons_path, electrons_path, source_alt, source_az, assumed_obs_time=50 * u.h, columns=DEFAULT_COLUMNS, return_rate=False):
-    # cosmic_ray_spectrum = spectrum.CosmicRaySpectrumPDG()
-    cosmic_ray_spectrum = spectrum.CosmicRaySpectrum()
-    electron_spectrum = spectrum.CTAElectronSpectrum()
-
-    protons = read_data(protons_path, key='array_events', columns=columns)
-    proton_runs = read_data(protons_path, key='runs')
-    
-    mc_production_proton = spectrum.MCSpectrum.from_cta_runs(proton_runs)
-    protons['weight'] = mc_production_proton.reweigh_to_other_spectrum(
-        cosmic_ray_spectrum, protons.mc_energy.values * u.TeV, t_assumed_obs=assumed_obs_time
-    )
-    protons['theta'] = (
-        calculate_distance_to_point_source(protons, source_alt=source_alt, source_az=source_az)
-        .to(u.deg)
-        .value
-    )
-    protons['type'] = PROTON_TYPE
-    
-    electrons = read_data(electrons_path, key='array_events', columns=columns)
-    electron_runs = read_data(electrons_path, key='runs')
-    
-    mc_production_electrons = spectrum.MCSpectrum.from_cta_runs(electron_runs)
-    electrons['weight'] = mc_production_electrons.reweigh_to_other_spectrum(
-        electron_spectrum, electrons.mc_energy.values * u.TeV, t_assumed_obs=assumed_obs_time
-    )
-    electrons['theta'] = (
-        calculate_distance_to_point_source(electrons, source_alt=source_alt, source_az=source_az)
-        .to(u.deg)
-        .value
-    )
-    electrons['type'] = ELECTRON_TYPE
-    
+def load_diffuse_signal_events(gammas_path, pointing, offset_bins, assumed_obs_time=None, columns=DEFAULT_COLUMNS, spectrum_name='crab'):
+    '''
+    Load diffuse gammas for off-axis studies.
+    Adds the true offset from the pointing position (`offset`) and the distance between
+    reconstructed and true direction (`theta`), both in degree.
+
+    The weights make the events within each ring of true offset given by `offset_bins` equivalent
+    to a point source with the given spectrum at that offset: the simulated flux per solid angle
+    is integrated over the ring (clipped to the view cone). Events outside of the rings get weight 0.
+    '''
+    import astropy.units as u
+    from fact.io import read_data
+    from cta_plots import spectrum
+    from cta_plots.coordinate_utils import angular_distance
+    from cta_plots.histogram import digitize
+
+    if assumed_obs_time is None:
+        assumed_obs_time = 50 * u.h
+    pointing_alt, pointing_az = pointing
+
+    with stage('load gammas') as s:
+        runs = read_data(gammas_path, key='runs')
+        if not (runs.mc_diffuse == 1).all():
+            print(Fore.RED + f'Data given at {gammas_path} is not diffuse.')
+            print(Fore.RESET)
+            raise ValueError
+        gammas = read_data(gammas_path, key='array_events', columns=columns)
+        s.n_events = len(gammas)
+
+    with stage('theta', n_events=len(gammas)):
+        gammas['offset'] = angular_distance(gammas.mc_alt.values, gammas.mc_az.values, pointing_alt, pointing_az)
+        gammas['theta'] = angular_distance(gammas.alt.values, gammas.az.values, gammas.mc_alt.values, gammas.mc_az.values)
+
+    with stage('weight', n_events=len(gammas)):
+        mc_spectrum = spectrum.MCSpectrum.from_cta_runs(runs)
+        cone = np.deg2rad([runs.mc_min_viewcone_radius.iloc[0], runs.mc_max_viewcone_radius.iloc[0]])
+        rings = np.clip(np.deg2rad(offset_bins), *cone)
+        ring_solid_angle = 2 * np.pi * (np.cos(rings[:-1]) - np.cos(rings[1:])) * u.sr
+
+        energies = gammas.mc_energy.values * u.TeV
+        idx = digitize(gammas.offset.values, offset_bins)
+        inside = (idx >= 0) & (ring_solid_angle[idx] > 0)
+        flux_ratio = spectrum.signal_spectrum(spectrum_name).flux(energies[inside]) / mc_spectrum.flux(energies[inside])
+
+        weights = np.zeros(len(gammas))
+        # like MCSpectrum.reweigh_to_other_spectrum, the simulated spectrum is normalized to one second
+        weights[inside] = assumed_obs_time.to_value(u.s) * (flux_ratio / ring_solid_angle[idx[inside]]).to_value(u.dimensionless_unscaled)
+        gammas['weight'] = weights
+
+    return gammas, runs
+
+
+def weight_column(spectrum_name):
+    '''
+    Name of the column holding the event weights for the given signal spectrum.
+    '''
+    return f'weight_{spectrum_name}'
+
+
+def load_background_particle(
+    path, particle, source_alt, source_az, assumed_obs_time=None, columns=DEFAULT_COLUMNS, preview=None, seed=0
+):
+    '''
+    Load the events of one background particle type ('proton' or 'electron'),
+    weighted to the cosmic ray or electron spectrum.
+    Returns the events and the runs table.
+    '''
+    import astropy.units as u
+    from fact.io import read_data
+    from cta_plots import spectrum
+    from cta_plots.coordinate_utils import calculate_distance_to_point_source
+
+    if assumed_obs_time is None:
+        assumed_obs_time = 50 * u.h
+
+    if particle == 'proton':
+        # target_spectrum = spectrum.CosmicRaySpectrumPDG()
+        target_spectrum = spectrum.CosmicRaySpectrum()
+        particle_type = PROTON_TYPE
+    elif particle == 'electron':
+        target_spectrum = spectrum.CTAElectronSpectrum()
+        particle_type = ELECTRON_TYPE
+    else:
+        raise ValueError(f'Unknown background particle {particle}')
+
+    with stage(f'load {particle}s') as s:
+        events = read_data(path, key='array_events', columns=columns)
+        runs = read_data(path, key='runs')
+        s.n_events = len(events)
+
+    if preview:
+        selected, scale = preview_selection(events.mc_energy.values, preview, seed=seed)
+        events = events[selected].reset_index(drop=True)
+
+    mc_production = spectrum.MCSpectrum.from_cta_runs(runs)
+    with stage('weight', n_events=len(events)):
+        events['weight'] = mc_production.reweigh_to_other_spectrum(
+            target_spectrum, events.mc_energy.values * u.TeV, t_assumed_obs=assumed_obs_time
+        )
+        if preview:
+            events['weight'] *= scale
+    with stage('theta', n_events=len(events)):
+        events['theta'] = (
+            calculate_distance_to_point_source(events, source_alt=source_alt, source_az=source_az)
+            .to(u.deg)
+            .value
+        )
+    events['type'] = particle_type
+    return events, runs
+
+
+def load_background_events(
+    protons_path, electrons_path, source_alt, source_az, assumed_obs_time=None, columns=DEFAULT_COLUMNS, return_rate=False, preview=None, seed=0
+):
+    import astropy.units as u
+    import pandas as pd
+
+    if assumed_obs_time is None:
+        assumed_obs_time = 50 * u.h
+
+    options = dict(assumed_obs_time=assumed_obs_time, columns=columns, preview=preview, seed=seed)
+    protons, _ = load_background_particle(protons_path, 'proton', source_alt, source_az, **options)
+    electrons, _ = load_background_particle(electrons_path, 'electron', source_alt, source_az, **options)
+
     background = pd.concat([protons, electrons], sort=False)
     if return_rate:
         event_rate = background['weight'].sum() / assumed_obs_time.to(u.s)
@@ -194,6 +390,8 @@ def load_background_events(protons_path, electrons_path, source_alt, source_az,
 
 
 def add_colorbar_to_figure(im, fig, ax, label=None):
+    from mpl_toolkits.axes_grid1 import make_axes_locatable
+
     divider = make_axes_locatable(ax)
     cax = divider.append_axes('right', size='5%', pad=0.05)
     fig.colorbar(im, cax=cax, orientation='vertical', label=label)
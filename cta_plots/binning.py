@@ -1,28 +1,146 @@
+import functools
+
 import astropy.units as u
 import numpy as np
 
 
+class Binning():
+    '''
+    Immutable set of bin edges, centers and widths.
+
+    Unpacks like the tuples returned by earlier versions of the binning functions,
+
+        bin_edges, bin_centers, bin_widths = make_default_cta_binning()
+
+    and is hashable, so it can be used as a cache key. The arrays are read only.
+    Events are assigned to bins with `digitize` and `split`, which cache the bin index
+    of each event on the event table (see `cta_plots.histogram.bin_indices`).
+    Like np.histogram the bins include their lower edge, the last bin also its upper edge.
+    '''
+    __slots__ = ('edges', 'centers', 'widths', '_key')
+
+    def __init__(self, edges, centers, widths):
+        for name, value in zip(self.__slots__, (edges, centers, widths)):
+            value = value.copy()
+            value.flags.writeable = False
+            object.__setattr__(self, name, value)
+        unit = str(getattr(edges, 'unit', ''))
+        object.__setattr__(self, '_key', (np.asarray(edges).tobytes(), np.asarray(centers).tobytes(), unit))
+
+    @classmethod
+    def from_edges(cls, edges, centering='log'):
+        '''
+        Binning for the given edges. Lists of quantities are converted to a single quantity.
+        '''
+        edges = u.Quantity(edges)
+        return cls(edges, _centers(edges, centering), np.diff(edges))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Binning objects are immutable')
+
+    def __reduce__(self):
+        return (Binning, (self.edges, self.centers, self.widths))
+
+    def __iter__(self):
+        return iter((self.edges, self.centers, self.widths))
+
+    def __len__(self):
+        return 3
+
+    def __getitem__(self, i):
+        return (self.edges, self.centers, self.widths)[i]
+
+    def __hash__(self):
+        return hash(self._key)
+
+    def __eq__(self, other):
+        return isinstance(other, Binning) and self._key == other._key
+
+    def __repr__(self):
+        return f'Binning({self.n_bins} bins from {self.edges[0]:.3g} to {self.edges[-1]:.3g})'
+
+    @property
+    def n_bins(self):
+        return len(self.edges) - 1
+
+    def digitize(self, df, column):
+        '''
+        Bin index of each event in `df[column]`, -1 for events outside of the binning.
+        The column is expected in the unit of the edges.
+        The indices are computed once and cached on the table.
+        '''
+        from cta_plots.histogram import bin_indices
+        return bin_indices(df, column, self.edges)
+
+    def split(self, df, column):
+        '''
+        Yield (bin index, events in bin) for every bin, including empty ones.
+        Replaces `df.groupby(pd.cut(df[column], bins=edges))` and keeps the order of the events.
+        Unlike pd.cut the bins are closed on the left, [a, b), and the last one includes its right edge,
+        like `np.histogram`. Events exactly on an inner edge fall into the upper bin.
+        '''
+        codes = self.digitize(df, column)
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(self.n_bins + 1))
+        for i in range(self.n_bins):
+            yield i, df.iloc[order[bounds[i]:bounds[i + 1]]]
+
+
+def _hashable(value):
+    if hasattr(value, 'unit'):
+        return (_hashable(value.value), str(value.unit))
+    if isinstance(value, np.ndarray):
+        return (value.tobytes(), value.shape)
+    return value
+
+
+def _memoized(f):
+    '''
+    Cache binnings by the (possibly quantity valued) arguments of the function.
+    '''
+    cache = {}
+
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        key = (tuple(_hashable(a) for a in args), tuple(sorted((k, _hashable(v)) for k, v in kwargs.items())))
+        binning = cache.get(key)
+        if binning is None:
+            binning = cache[key] = f(*args, **kwargs)
+        return binning
+
+    wrapper.cache_clear = cache.clear
+    return wrapper
+
+
+def _centers(bin_edges, centering):
+    if centering == 'log':
+        return np.sqrt(bin_edges[:-1] * bin_edges[1:])
+    return 0.5 * (bin_edges[:-1] + bin_edges[1:])
+
+
 def make_energy_bins(energies=None, e_min=None, e_max=None, bins=10, centering='linear'):
     if energies is not None and len(energies) >= 2:
         e_min = min(energies)
         e_max = max(energies)
 
+    return _make_energy_bins(e_min, e_max, bins=bins, centering=centering)
+
+
+@_memoized
+def _make_energy_bins(e_min, e_max, bins=10, centering='linear'):
     unit = e_min.unit
 
     low = np.log10(e_min.value)
     high = np.log10(e_max.value)
     bin_edges = np.logspace(low, high, endpoint=True, num=bins + 1) * unit
 
-    if centering == 'log':
-        bin_centers = np.sqrt(bin_edges[:-1] * bin_edges[1:])
-    else:
-        bin_centers = 0.5 * (bin_edges[:-1] + bin_edges[1:])
-
+    bin_centers = _centers(bin_edges, centering)
     bin_widths = np.diff(bin_edges)
 
-    return bin_edges, bin_centers, bin_widths
+    return Binning(bin_edges, bin_centers, bin_widths)
 
 
+@_memoized
 def make_default_cta_binning(e_min=0.02 * u.TeV, e_max=200 * u.TeV, centering='log', overflow=False, bins_per_decade=5):
 
     bin_edges = np.logspace(np.log10(0.002), np.log10(2000), 6 * bins_per_decade + 1)
@@ -33,18 +151,16 @@ def make_default_cta_binning(e_min=0.02 * u.TeV, e_max=200 * u.TeV, centering='l
         bin_edges = np.append(bin_edges, 10000)
         bin_edges = np.append(0, bin_edges)
 
-    if centering == 'log':
-        bin_centers = np.sqrt(bin_edges[:-1] * bin_edges[1:])
-    else:
-        bin_centers = 0.5 * (bin_edges[:-1] + bin_edges[1:])
+    bin_centers = _centers(bin_edges, centering)
     bin_widths = np.diff(bin_edges)
 
-    return bin_edges * u.TeV, bin_centers * u.TeV, bin_widths * u.TeV
+    return Binning(bin_edges * u.TeV, bin_centers * u.TeV, bin_widths * u.TeV)
 
 
+@_memoized
 def make_energy_bins_per_decade(e_min, e_max, n_bins_per_decade=10, overflow=False, centering='linear'):
     bin_edges = np.logspace(-3, 3, (6 * n_bins_per_decade) + 1)
-    
+
     idx = np.searchsorted(bin_edges, [e_min.to_value(u.TeV), e_max.to_value(u.TeV)])
     bin_edges = bin_edges[idx[0]:idx[1]]
     if overflow:
@@ -53,11 +169,7 @@ def make_energy_bins_per_decade(e_min, e_max, n_bins_per_decade=10, overflow=Fal
 
     bin_edges *= u.TeV
 
-    if centering == 'log':
-        bin_centers = np.sqrt(bin_edges[:-1] * bin_edges[1:])
-    else:
-        bin_centers = 0.5 * (bin_edges[:-1] + bin_edges[1:])
+    bin_centers = _centers(bin_edges, centering)
     bin_widths = np.diff(bin_edges)
 
-    return bin_edges, bin_centers, bin_widths
-
+    return Binning(bin_edges, bin_centers, bin_widths)
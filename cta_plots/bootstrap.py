@@ -0,0 +1,166 @@
+import numpy as np
+
+
+def _evaluate_batch(statistic, seed, n_replicas, sizes, args, kwargs):
+    rng = np.random.default_rng(seed)
+    weights = [rng.poisson(1, size=(n_replicas, n)) for n in sizes]
+    return statistic(*weights, *args, **kwargs)
+
+
+def poisson_bootstrap(statistic, sizes, args=(), kwargs=None, n_bootstrap=100, batch_size=20, n_jobs=4, seed=0):
+    '''
+    Poisson bootstrap of a weighted statistic.
+
+    Instead of resampling the events each replica assigns every event a weight drawn from a Poisson
+    distribution with mean 1. The statistic gets called with a batch of these weights and has to return
+    one result per replica. Batches are distributed over a process pool, each batch
+    draws from its own independent random stream (spawned from `seed`) so results
+    do not depend on the number of jobs.
+
+    Parameters
+    ----------
+    statistic : callable
+        statistic(*weights, *args, **kwargs) where weights contains one array of
+        shape (n_replicas, size) for each entry in sizes. Has to be picklable, i.e. a module level function.
+    sizes : int or tuple of int
+        number of events in each sample, e.g. (n_signal, n_background)
+    n_bootstrap : int, optional
+        total number of replicas
+    batch_size : int, optional
+        number of replicas evaluated in one vectorized call
+    n_jobs : int, optional
+        number of worker processes
+
+    Returns
+    -------
+    array
+        the statistic for all replicas stacked along the first axis
+    '''
+    from joblib import Parallel, delayed
+
+    if np.ndim(sizes) == 0:
+        sizes = (sizes, )
+    if kwargs is None:
+        kwargs = {}
+
+    batches = [min(batch_size, n_bootstrap - start) for start in range(0, n_bootstrap, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(batches))
+
+    op = delayed(_evaluate_batch)
+    results = Parallel(n_jobs=n_jobs)(op(statistic, s, n, sizes, args, kwargs) for s, n in zip(seeds, batches))
+    return np.concatenate(results, axis=0)
+
+
+def confidence_interval(replicas, percentiles=(16, 84)):
+    '''
+    Percentile interval along the replica axis. Ignores NaNs.
+    '''
+    with np.errstate(invalid='ignore'):
+        return np.nanpercentile(replicas, percentiles, axis=0)
+
+
+def digitize(x, bin_edges):
+    '''
+    Bin index for each value using the same convention as scipy.stats.binned_statistic
+    (half open bins, last bin includes the right edge). Values outside the range get -1.
+    '''
+    x = np.asarray(x)
+    idx = np.searchsorted(bin_edges, x, side='right') - 1
+    n_bins = len(bin_edges) - 1
+    idx[x == bin_edges[-1]] = n_bins - 1
+    idx[(idx < 0) | (idx >= n_bins) | np.isnan(x)] = -1
+    return idx
+
+
+def weighted_binned_percentile(bin_codes, values, n_bins, q, weights):
+    '''
+    Percentiles of the values in each bin for many sets of integer weights at once.
+
+    For integer weights the result equals np.percentile (with linear interpolation)
+    of the sample in which every event is repeated according to its weight.
+
+    Parameters
+    ----------
+    bin_codes : array of int
+        bin index of each event as returned by digitize(). Events with negative codes are ignored.
+    values : array
+        values to calculate the percentiles of. NaNs are ignored.
+    n_bins : int
+        number of bins
+    q : float or array
+        percentile(s) between 0 and 100
+    weights : array
+        shape (n_replicas, n_events)
+
+    Returns
+    -------
+    array
+        shape (n_replicas, n_bins) or (n_replicas, n_bins, len(q)) for multiple percentiles.
+        NaN for empty bins.
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    bin_codes = np.asarray(bin_codes)
+    weights = np.atleast_2d(weights)
+    n_replicas = weights.shape[0]
+
+    valid = (bin_codes >= 0) & np.isfinite(values)
+    values, bin_codes, weights = values[valid], bin_codes[valid], weights[:, valid]
+
+    order = np.lexsort((values, bin_codes))
+    values, bin_codes = values[order], bin_codes[order]
+    cumulative = np.cumsum(weights[:, order], axis=1, dtype=np.float64)
+
+    starts = np.searchsorted(bin_codes, np.arange(n_bins), side='left')
+    ends = np.searchsorted(bin_codes, np.arange(n_bins), side='right')
+
+    padded = np.concatenate([np.zeros((n_replicas, 1)), cumulative], axis=1)
+    base = padded[:, starts]
+    total = padded[:, ends] - base
+
+    # offset each replica so all cumulative sums can be searched at once
+    offsets = (np.arange(n_replicas) * (cumulative[:, -1].max() + 1 if cumulative.size else 1))[:, np.newaxis]
+    flat = (cumulative + offsets).ravel()
+
+    def value_at(k):
+        # value of the k-th element (0 based) of the weight-repeated sample
+        j = np.searchsorted(flat, (base + offsets)[..., np.newaxis] + k, side='right')
+        j = j - np.arange(n_replicas)[:, np.newaxis, np.newaxis] * len(values)
+        return values[np.clip(j, 0, len(values) - 1)]
+
+    q = np.atleast_1d(q) / 100
+    h = (total[..., np.newaxis] - 1) * q
+    low = np.floor(h)
+    high = np.minimum(low + 1, np.maximum(total[..., np.newaxis] - 1, 0))
+
+    if len(values) == 0:
+        result = np.full(h.shape, np.nan)
+    else:
+        v_low = value_at(low)
+        v_high = value_at(high)
+        result = v_low + (h - low) * (v_high - v_low)
+        result[total <= 0] = np.nan
+
+    if result.shape[-1] == 1:
+        return result[..., 0]
+    return result
+
+
+def _binned_percentile_statistic(weights, bin_codes, values, n_bins, q):
+    return weighted_binned_percentile(bin_codes, values, n_bins, q, weights)
+
+
+def bootstrap_binned_percentile(x, y, bin_edges, q, n_bootstrap=100, batch_size=20, n_jobs=4, seed=0):
+    '''
+    Poisson bootstrap of the percentile(s) q of y in bins of x.
+    Returns an array of shape (n_bootstrap, n_bins) or (n_bootstrap, n_bins, len(q)).
+    '''
+    bin_codes = digitize(np.asarray(x, dtype=np.float64), np.asarray(bin_edges, dtype=np.float64))
+    return poisson_bootstrap(
+        _binned_percentile_statistic,
+        len(bin_codes),
+        args=(bin_codes, np.asarray(y, dtype=np.float64), len(bin_edges) - 1, q),
+        n_bootstrap=n_bootstrap,
+        batch_size=batch_size,
+        n_jobs=n_jobs,
+        seed=seed,
+    )
@@ -0,0 +1,212 @@
+'''
+Weighted event tables as Parquet files, read back with predicate pushdown.
+
+    cta_plot_to_parquet gammas.h5 protons.h5 electrons.h5 events/ -t 50
+
+writes the output of `load_signal_events` and `load_background_events` (weights and theta included)
+to events/gammas.parquet and events/background.parquet and the runs tables next to them.
+The events are ordered by bin of estimated energy (`bins_per_decade` bins per decade) and by
+gamma_prediction_mean within each bin, so the min/max statistics of the row groups are narrow in both.
+Readers skip all row groups outside of a range of estimated energy or below a prediction threshold
+without reading them:
+
+    gammas, source_alt, source_az = read_signal_events('events/gammas.parquet', energy_range=(1, 10), min_prediction=0.8)
+
+Requires pyarrow (pip install cta_plots[parquet]).
+'''
+import json
+import os
+
+import click
+import numpy as np
+
+from cta_plots.profiling import profile_option, stage
+
+ROW_GROUP_SIZE = 65536
+BINS_PER_DECADE = 10
+METADATA_KEY = b'cta_plots'
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError('Reading and writing parquet files requires pyarrow. Install it with pip install pyarrow.') from None
+    return pa, pq
+
+
+def runs_path(path):
+    '''
+    The file holding the runs table of the events in `path`.
+    '''
+    n, ext = os.path.splitext(path)
+    return f'{n}_runs{ext}'
+
+
+def storage_order(energy, prediction, bins_per_decade=BINS_PER_DECADE):
+    '''
+    Order of the events in the file: by bin of estimated energy, then by prediction.
+    Events without an energy estimate come last.
+    '''
+    edges = np.logspace(-3, 3, 6 * bins_per_decade + 1)
+    # nan energies are sorted behind the last edge
+    codes = np.searchsorted(edges, energy, side='right')
+    return np.lexsort((prediction, codes))
+
+
+def write_events(df, path, runs=None, metadata=None, row_group_size=ROW_GROUP_SIZE, bins_per_decade=BINS_PER_DECADE):
+    '''
+    Write the events in `df` in `storage_order` to a Parquet file at `path`
+    and the `runs` table (if given) to `runs_path(path)`.
+    `metadata` is stored as JSON in the schema and returned by `read_metadata`.
+    '''
+    pa, pq = _import_pyarrow()
+
+    order = storage_order(df.gamma_energy_prediction_mean.values, df.gamma_prediction_mean.values, bins_per_decade=bins_per_decade)
+    table = pa.table({c: df[c].values[order] for c in df.columns})
+
+    metadata = {'bins_per_decade': bins_per_decade, **(metadata or {})}
+    table = table.replace_schema_metadata({METADATA_KEY: json.dumps(metadata).encode()})
+    pq.write_table(table, path, row_group_size=row_group_size)
+
+    if runs is not None:
+        pq.write_table(pa.Table.from_pandas(runs, preserve_index=False), runs_path(path))
+
+
+def _to_tev(value):
+    if value is None or not hasattr(value, 'unit'):
+        return value
+    return value.to_value('TeV')
+
+
+def read_events(path, columns=None, energy_range=None, min_prediction=None):
+    '''
+    Read events written by `write_events`.
+
+    Parameters
+    ----------
+    path : str
+        the Parquet file
+    columns : list of str, optional
+        columns to read, all by default
+    energy_range : tuple, optional
+        (e_low, e_high) in TeV (floats or quantities), selects e_low <= gamma_energy_prediction_mean < e_high.
+        Either limit can be None.
+    min_prediction : float, optional
+        selects gamma_prediction_mean >= min_prediction
+
+    Row groups whose statistics do not overlap the selection are skipped without being read.
+
+    Returns
+    -------
+    pd.DataFrame
+    '''
+    _, pq = _import_pyarrow()
+
+    filters = []
+    if energy_range is not None:
+        e_low, e_high = map(_to_tev, energy_range)
+        if e_low is not None:
+            filters.append(('gamma_energy_prediction_mean', '>=', e_low))
+        if e_high is not None:
+            filters.append(('gamma_energy_prediction_mean', '<', e_high))
+    if min_prediction is not None:
+        filters.append(('gamma_prediction_mean', '>=', min_prediction))
+
+    with stage('read parquet') as s:
+        df = pq.read_table(path, columns=columns, filters=filters or None).to_pandas()
+        s.n_events = len(df)
+    return df
+
+
+def read_metadata(path):
+    _, pq = _import_pyarrow()
+
+    metadata = pq.read_schema(path).metadata or {}
+    return json.loads(metadata.get(METADATA_KEY, b'{}'))
+
+
+def read_runs(path):
+    _, pq = _import_pyarrow()
+
+    return pq.read_table(runs_path(path)).to_pandas()
+
+
+def read_signal_events(path, **kwargs):
+    '''
+    `read_events` returning the source position like `load_signal_events`.
+    '''
+    import astropy.units as u
+
+    metadata = read_metadata(path)
+    return read_events(path, **kwargs), metadata['source_alt'] * u.deg, metadata['source_az'] * u.deg
+
+
+def _degrees(angle):
+    value = angle.to_value('deg')
+    return value.tolist() if np.ndim(value) else float(value)
+
+
+@click.command()
+@profile_option
+@click.argument('gammas_path', type=click.Path(exists=True))
+@click.argument('protons_path', type=click.Path(exists=True))
+@click.argument('electrons_path', type=click.Path(exists=True))
+@click.argument('output_dir', type=click.Path(file_okay=False))
+@click.option('-t', '--t_obs', default=50, help='Observation time in hours')
+@click.option('-s', '--spectrum', 'spectra', multiple=True, help='Additional signal spectrum to store weights for, see cta_plot_sensitivity.')
+@click.option('-c', '--column', 'columns', multiple=True, help='Additional column to read from the input files.')
+@click.option('--row_group_size', default=ROW_GROUP_SIZE)
+def main(gammas_path, protons_path, electrons_path, output_dir, t_obs, spectra, columns, row_group_size):
+    '''
+    Convert gammas, protons and electrons to weighted, theta augmented Parquet files in OUTPUT_DIR.
+    '''
+    import astropy.units as u
+    import pandas as pd
+    from cta_plots import DEFAULT_COLUMNS, ELECTRON_TYPE, PROTON_TYPE, load_background_particle, load_runs, load_signal_events
+    from cta_plots.spectrum import signal_spectrum
+
+    try:
+        _import_pyarrow()
+    except ImportError as e:
+        raise click.ClickException(str(e))
+    for name in spectra:
+        try:
+            signal_spectrum(name)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint='--spectrum')
+
+    columns = DEFAULT_COLUMNS + [c for c in columns if c not in DEFAULT_COLUMNS]
+    t_obs *= u.h
+    os.makedirs(output_dir, exist_ok=True)
+
+    gammas, source_alt, source_az = load_signal_events(gammas_path, assumed_obs_time=t_obs, columns=columns, spectra=spectra)
+    options = dict(assumed_obs_time=t_obs, columns=columns)
+    protons, proton_runs = load_background_particle(protons_path, 'proton', source_alt, source_az, **options)
+    electrons, electron_runs = load_background_particle(electrons_path, 'electron', source_alt, source_az, **options)
+
+    background = pd.concat([protons, electrons], sort=False)
+    background_runs = pd.concat([proton_runs.assign(type=PROTON_TYPE), electron_runs.assign(type=ELECTRON_TYPE)], sort=False)
+
+    metadata = {
+        't_obs': t_obs.to_value(u.h),
+        'source_alt': _degrees(source_alt),
+        'source_az': _degrees(source_az),
+        'spectra': list(spectra),
+    }
+    with stage('write', n_events=len(gammas) + len(background)):
+        write_events(
+            gammas, os.path.join(output_dir, 'gammas.parquet'), runs=load_runs(gammas_path),
+            metadata={**metadata, 'inputs': [os.path.abspath(gammas_path)]}, row_group_size=row_group_size,
+        )
+        write_events(
+            background, os.path.join(output_dir, 'background.parquet'), runs=background_runs,
+            metadata={**metadata, 'inputs': [os.path.abspath(protons_path), os.path.abspath(electrons_path)]},
+            row_group_size=row_group_size,
+        )
+
+
+if __name__ == '__main__':
+    # pylint: disable=no-value-for-parameter
+    main()
@@ -0,0 +1,121 @@
+'''
+Optimized cuts (the csv written by cta_plot_sensitivity) as lookup tables in estimated energy.
+
+    cuts = load_cuts('cuts.csv', sigma=1)
+    selected = cuts.mask(gammas)
+    h = histogram(gammas, 'mc_energy', bins, mask=selected)
+
+The tables are built once per file and sigma. Masks and index arrays select events
+without copying the event table.
+'''
+import os
+
+import numpy as np
+
+# (path, modification time, size, sigma) -> CutSet
+_CUTS_CACHE = {}
+
+
+def _piecewise_linear(nodes, values):
+    '''
+    Start value and slope of the linear interpolation on each segment between the nodes.
+    '''
+    slopes = np.diff(values) / np.diff(nodes)
+    return values[:-1], slopes
+
+
+class CutSet():
+    '''
+    Theta, prediction and multiplicity thresholds as a function of estimated energy.
+
+    Theta and prediction thresholds are interpolated linearly between the bin centers
+    and extrapolated beyond them, like `create_interpolated_function`.
+    The theta thresholds are smoothed with a gaussian filter of width `sigma` (in bins) first.
+    Multiplicity thresholds are constant within each bin of estimated energy.
+    Each threshold is looked up with one `np.searchsorted` over the bin edges or centers.
+    '''
+
+    def __init__(self, e_min, e_max, theta_cut, prediction_cut, multiplicity, sigma=1):
+        from scipy.ndimage import gaussian_filter1d
+
+        self.e_min = np.asarray(e_min, dtype=np.float64)
+        self.e_max = np.asarray(e_max, dtype=np.float64)
+        self.sigma = sigma
+        bin_center = np.sqrt(self.e_min * self.e_max)
+
+        self._linear = {}
+        for name, values, s in [('theta', theta_cut, sigma), ('prediction', prediction_cut, 0)]:
+            values = np.asarray(values, dtype=np.float64)
+            m = ~np.isnan(values)  # do not use nan values
+            nodes, values = bin_center[m], values[m]
+            if s > 0:
+                values = gaussian_filter1d(values, sigma=s)
+            self._linear[name] = (nodes,) + _piecewise_linear(nodes, values)
+
+        # empty bins have nan thresholds which no event passes
+        self._multiplicity = np.asarray(multiplicity, dtype=np.float64)
+
+    @classmethod
+    def from_csv(cls, path, sigma=1):
+        import pandas as pd
+
+        cuts = pd.read_csv(path)
+        return cls(cuts.e_min, cuts.e_max, cuts.theta_cut, cuts.prediction_cut, cuts.multiplicity, sigma=sigma)
+
+    def _interpolate(self, name, energy):
+        nodes, start, slopes = self._linear[name]
+        energy = np.asarray(energy, dtype=np.float64)
+        segment = np.clip(np.searchsorted(nodes, energy, side='right') - 1, 0, len(slopes) - 1)
+        return start[segment] + slopes[segment] * (energy - nodes[segment])
+
+    def theta_cut(self, energy):
+        return self._interpolate('theta', energy)
+
+    def prediction_cut(self, energy):
+        return self._interpolate('prediction', energy)
+
+    def multiplicity(self, energy):
+        energy = np.asarray(energy, dtype=np.float64)
+        i = np.clip(np.searchsorted(self.e_min, energy, side='right') - 1, 0, len(self.e_min) - 1)
+        return np.where(np.isnan(energy), np.nan, self._multiplicity[i])
+
+    def mask(self, df, theta=True, prediction=True, multiplicity=True):
+        '''
+        Boolean mask of the events in `df` passing the cuts at their estimated energy.
+        Uses the `theta` column if present, otherwise the distance between reconstructed and true
+        direction is computed without modifying `df`.
+        '''
+        energy = df.gamma_energy_prediction_mean.values
+        m = np.ones(len(df), dtype=bool)
+        if theta:
+            m &= _theta(df) < self.theta_cut(energy)
+        if prediction:
+            m &= df.gamma_prediction_mean.values >= self.prediction_cut(energy)
+        if multiplicity:
+            m &= df.num_triggered_telescopes.values >= self.multiplicity(energy)
+        return m
+
+    def indices(self, df, **kwargs):
+        '''
+        Positions of the events passing the cuts, see `mask`.
+        '''
+        return np.flatnonzero(self.mask(df, **kwargs))
+
+
+def _theta(df):
+    from cta_plots.coordinate_utils import angular_distance
+
+    if 'theta' in df.columns:
+        return df.theta.values
+    return angular_distance(df.alt.values, df.az.values, df.mc_alt.values, df.mc_az.values)
+
+
+def load_cuts(path, sigma=1):
+    '''
+    The `CutSet` stored in `path`. Built once per file (until it is modified) and sigma.
+    '''
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size, sigma)
+    if key not in _CUTS_CACHE:
+        _CUTS_CACHE[key] = CutSet.from_csv(path, sigma=sigma)
+    return _CUTS_CACHE[key]
@@ -0,0 +1,219 @@
+'''
+Weighted N-dimensional histograms built on np.searchsorted and np.bincount.
+
+The bin index of every event is computed once per column and set of edges and cached
+for the lifetime of the event table, so histogramming the same column again
+(with other weights, in other combinations or after changing cuts on other columns)
+only costs a bincount:
+
+    h = histogram(gammas, ['mc_energy', 'gamma_energy_prediction_mean'], [bins, bins], weights='weight')
+    h.sum_w, h.errors
+
+Chunked input is supported by filling the same `Histogram` repeatedly or via `histogram_chunks`.
+'''
+import hashlib
+import weakref
+
+import numpy as np
+
+# id(table) -> {(column, edges): (fingerprint of the column data, read only bin indices)}
+_INDEX_CACHE = {}
+
+
+def _strip_unit(values, unit=None):
+    if hasattr(values, 'unit'):
+        return values.to_value(unit) if unit is not None else values.value
+    return np.asarray(values)
+
+
+def digitize(values, edges):
+    '''
+    Index of the bin each value falls into. Values outside of the edges and NaNs get -1.
+    Like np.histogram, the last bin includes its right edge.
+    '''
+    values = _strip_unit(values, getattr(edges, 'unit', None))
+    edges = _strip_unit(edges)
+    n_bins = len(edges) - 1
+
+    idx = np.searchsorted(edges, values, side='right') - 1
+    idx[values == edges[-1]] = n_bins - 1
+    idx[(idx < 0) | (idx >= n_bins)] = -1
+    return idx
+
+
+def _table_cache(df):
+    key = id(df)
+    if key not in _INDEX_CACHE:
+        _INDEX_CACHE[key] = {}
+        weakref.finalize(df, _INDEX_CACHE.pop, key, None)
+    return _INDEX_CACHE[key]
+
+
+def _fingerprint(values):
+    '''
+    Identity of the column values: length, dtype and a hash of all values.
+    Hashing is about three times faster than the searchsorted in `digitize`.
+    '''
+    values = np.ascontiguousarray(values)
+    return len(values), values.dtype.str, hashlib.sha1(memoryview(values).cast('B')).digest()
+
+
+def bin_indices(df, column, edges):
+    '''
+    Cached `digitize(df[column], edges)`. The returned array is read only.
+    The cached indices are only reused if the column values are unchanged, including
+    in-place modifications of single values.
+    '''
+    values = df[column].values
+    fingerprint = _fingerprint(values)
+    edges = np.asarray(_strip_unit(edges), dtype=np.float64)
+
+    cache = _table_cache(df)
+    key = (column, edges.tobytes())
+    cached = cache.get(key)
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1]
+
+    idx = digitize(values, edges)
+    idx.setflags(write=False)
+    cache[key] = (fingerprint, idx)
+    return idx
+
+
+def clear_cache(df=None):
+    '''
+    Remove the cached bin indices of one table or of all tables.
+    '''
+    if df is None:
+        for cache in _INDEX_CACHE.values():
+            cache.clear()
+    else:
+        _INDEX_CACHE.get(id(df), {}).clear()
+
+
+class Histogram():
+    '''
+    Histogram with one set of edges per dimension.
+    Keeps the number of entries, the sum of weights and the sum of squared weights per bin.
+    Events outside of the edges in any dimension are counted in `n_outside`.
+    '''
+
+    def __init__(self, *edges):
+        self.edges = edges
+        self._edges = [np.asarray(_strip_unit(e), dtype=np.float64) for e in edges]
+        self.shape = tuple(len(e) - 1 for e in self._edges)
+        self.counts = np.zeros(self.shape, dtype=np.int64)
+        self.sum_w = np.zeros(self.shape)
+        self.sum_w2 = np.zeros(self.shape)
+        self.n_outside = 0
+
+    @property
+    def errors(self):
+        '''
+        Statistical uncertainty of the sum of weights, sqrt(sum of squared weights).
+        '''
+        return np.sqrt(self.sum_w2)
+
+    def fill_indices(self, *indices, weights=None):
+        '''
+        Add events given by their bin index in each dimension, as returned by `digitize`.
+        '''
+        if len(indices) != len(self.shape):
+            raise ValueError(f'Expected {len(self.shape)} index arrays, got {len(indices)}')
+
+        inside = np.ones(len(indices[0]), dtype=bool)
+        for idx in indices:
+            inside &= idx >= 0
+        self.n_outside += int(len(inside) - inside.sum())
+
+        if len(self.shape) == 1:
+            flat = indices[0][inside]
+        else:
+            flat = np.ravel_multi_index(tuple(idx[inside] for idx in indices), self.shape)
+
+        size = int(np.prod(self.shape))
+        counts = np.bincount(flat, minlength=size)
+        self.counts += counts.reshape(self.shape)
+        if weights is None:
+            self.sum_w += counts.reshape(self.shape)
+            self.sum_w2 += counts.reshape(self.shape)
+        else:
+            w = np.asarray(weights, dtype=np.float64)[inside]
+            self.sum_w += np.bincount(flat, weights=w, minlength=size).reshape(self.shape)
+            self.sum_w2 += np.bincount(flat, weights=w**2, minlength=size).reshape(self.shape)
+        return self
+
+    def fill(self, *values, weights=None):
+        '''
+        Add events given by their values in each dimension.
+        '''
+        indices = [digitize(v, e) for v, e in zip(values, self.edges)]
+        return self.fill_indices(*indices, weights=weights)
+
+    def fill_table(self, df, columns, weights=None, mask=None):
+        '''
+        Add the events of a table using the cached bin indices of `columns`.
+        `weights` can be a column name or an array.
+        Only the events selected by `mask` (boolean mask or index array, e.g. from `CutSet.mask`) are added,
+        the table itself is not copied.
+        '''
+        if isinstance(columns, str):
+            columns = [columns]
+        indices = [bin_indices(df, c, e) for c, e in zip(columns, self._edges)]
+        if isinstance(weights, str):
+            weights = df[weights].values
+        if mask is not None:
+            indices = [idx[mask] for idx in indices]
+            weights = np.asarray(weights)[mask] if weights is not None else None
+        return self.fill_indices(*indices, weights=weights)
+
+    def __iadd__(self, other):
+        if other.shape != self.shape or not all(np.array_equal(a, b) for a, b in zip(self._edges, other._edges)):
+            raise ValueError('Cannot add histograms with different binning')
+        self.counts += other.counts
+        self.sum_w += other.sum_w
+        self.sum_w2 += other.sum_w2
+        self.n_outside += other.n_outside
+        return self
+
+
+def _as_list(columns, edges):
+    if isinstance(columns, str):
+        return [columns], [edges]
+    return list(columns), list(edges)
+
+
+def histogram(df, columns, edges, weights=None, mask=None):
+    '''
+    Histogram of one or more columns of an event table.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        the events
+    columns : str or list of str
+        column(s) to histogram
+    edges : array or list of arrays
+        bin edges, one array per column. Quantities are converted to plain arrays.
+    weights : str or array, optional
+        column name or array of event weights
+    mask : array, optional
+        boolean mask or index array of the events to use
+
+    Returns
+    -------
+    Histogram
+    '''
+    columns, edges = _as_list(columns, edges)
+    return Histogram(*edges).fill_table(df, columns, weights=weights, mask=mask)
+
+
+def histogram_chunks(chunks, columns, edges, weights=None):
+    '''
+    Histogram of the events in an iterable of tables, e.g. from a chunked reader.
+    '''
+    columns, edges = _as_list(columns, edges)
+    h = Histogram(*edges)
+    for chunk in chunks:
+        h.fill_table(chunk, columns, weights=weights)
+    return h
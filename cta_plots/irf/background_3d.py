@@ -4,30 +4,33 @@ import matplotlib.ticker as mticker
 from matplotlib.colors import LogNorm
 import numpy as np
 import astropy.units as u
-from gammapy.irf import Background3D
 from scipy.ndimage import gaussian_filter
-from . import _bin_center, _log_data, _log_tick_formatter
+from . import _log_data, _log_tick_formatter
+from .grid import background_map
 
 
-def background_3d_plot(irf_file_path, ax=None, hdu="BACKGROUND"):
-    if not ax:
-        fig = plt.figure(figsize=(10, 7),)
-        ax = fig.add_subplot(111, projection='3d')
-    
-    bkg3d = Background3D.read(irf_file_path, hdu=hdu)
-
-    energy_reco = np.logspace(-2, 2, 20) * u.TeV
-    offset_centers = _bin_center(bkg3d.data.axes[1].bins)
+def background_3d_data(irf_file_path, hdu="BACKGROUND"):
+    detx, dety, data = background_map(irf_file_path, hdu=hdu)
 
-    data = bkg3d.data.data.sum(axis=0).value
-    data = _log_data(data)
+    data = _log_data(data.value.copy())
     
     vmin, vmax = -4, 1.5
     data = np.clip(data, vmin, vmax)
     
-    X, Y = np.meshgrid(offset_centers, offset_centers)
+    X, Y = np.meshgrid(detx.to_value(u.deg), dety.to_value(u.deg))
+    return X, Y, gaussian_filter(data, sigma=0.8)
+
+
+def background_3d_plot(irf_file_path, ax=None, hdu="BACKGROUND", data=None):
+    if not ax:
+        fig = plt.figure(figsize=(10, 7),)
+        ax = fig.add_subplot(111, projection='3d')
+    
+    if data is None:
+        data = background_3d_data(irf_file_path, hdu=hdu)
+    X, Y, Z = data
 
-    X, Y, Z, = X.ravel(), Y.ravel(), gaussian_filter(data, sigma=0.8).ravel()
+    X, Y, Z, = X.ravel(), Y.ravel(), Z.ravel()
     surf = ax.plot_trisurf(X, Y, Z, cmap='viridis', antialiased=True)
 
     ax.zaxis.set_major_locator(mticker.FixedLocator([-4, -3, -2, -1, 0, 1,]))
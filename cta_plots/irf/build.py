@@ -0,0 +1,248 @@
+import astropy.units as u
+import h5py
+import numpy as np
+import pandas as pd
+from astropy.io import fits
+from astropy.table import QTable
+
+from cta_plots import apply_cuts, load_runs
+from cta_plots.coordinate_utils import angular_distance
+from cta_plots.spectrum import MCSpectrum, CosmicRaySpectrum, CTAElectronSpectrum
+
+
+COLUMNS = [
+    'mc_energy',
+    'gamma_energy_prediction_mean',
+    'gamma_prediction_mean',
+    'num_triggered_telescopes',
+    'mc_alt',
+    'mc_az',
+    'alt',
+    'az',
+]
+
+
+def make_irf_binning(bins_per_decade=10, n_offset=6, max_offset=6, n_migra=150, n_rad=100, max_rad=1, n_det=24):
+    '''
+    Default binning for the IRF histograms. Energies in TeV, angles in degree.
+    '''
+    n_energy = int(np.log10(500 / 0.005) * bins_per_decade)
+    return {
+        'energy': np.logspace(np.log10(0.005), np.log10(500), n_energy + 1),
+        'offset': np.linspace(0, max_offset, n_offset + 1),
+        'migra': np.linspace(0.2, 5, n_migra + 1),
+        'rad': np.linspace(0, max_rad, n_rad + 1),
+        'det': np.linspace(-max_offset, max_offset, n_det + 1),
+    }
+
+
+def _count_rows(path, key='array_events'):
+    with h5py.File(path, 'r') as f:
+        group = f.get(key)
+        if group is None:
+            raise IOError('File does not contain group "{}"'.format(key))
+        return group[COLUMNS[0]].shape[0]
+
+
+def _read_rows(path, start, stop, key='array_events'):
+    with h5py.File(path, 'r') as f:
+        group = f[key]
+        return pd.DataFrame({c: group[c][start:stop] for c in COLUMNS})
+
+
+def field_of_view_coordinates(alt, az, pointing_alt, pointing_az):
+    '''
+    Gnomonic projection of the given horizontal coordinates (in degree) into the
+    camera frame centered on the pointing position. Returns detx and dety in degree.
+    '''
+    alt, az = np.deg2rad(alt), np.deg2rad(az)
+    alt0, az0 = np.deg2rad(pointing_alt), np.deg2rad(pointing_az)
+
+    d_az = az - az0
+    cos_c = np.sin(alt0) * np.sin(alt) + np.cos(alt0) * np.cos(alt) * np.cos(d_az)
+    x = np.cos(alt) * np.sin(d_az) / cos_c
+    y = (np.cos(alt0) * np.sin(alt) - np.sin(alt0) * np.cos(alt) * np.cos(d_az)) / cos_c
+    return np.rad2deg(np.arctan(x)), np.rad2deg(np.arctan(y))
+
+
+def _accumulate_gammas(path, start, stop, cuts_path, pointing, binning):
+    df = _read_rows(path, start, stop)
+    df = df.dropna()
+    if cuts_path:
+        df = apply_cuts(df, cuts_path, theta_cuts=False)
+
+    e_true = df.mc_energy.values
+    offset = angular_distance(df.mc_alt.values, df.mc_az.values, *pointing)
+    migra = df.gamma_energy_prediction_mean.values / e_true
+    rad = angular_distance(df.alt.values, df.az.values, df.mc_alt.values, df.mc_az.values)
+
+    offset_bins, energy_bins = binning['offset'], binning['energy']
+    selected, _, _ = np.histogram2d(offset, e_true, bins=[offset_bins, energy_bins])
+    migration, _ = np.histogramdd((offset, migra, e_true), bins=[offset_bins, binning['migra'], energy_bins])
+    psf, _ = np.histogramdd((offset, rad, e_true), bins=[offset_bins, binning['rad'], energy_bins])
+    return selected, migration, psf
+
+
+def _accumulate_background(path, start, stop, cuts_path, pointing, binning, mc_spectrum, spectrum):
+    df = _read_rows(path, start, stop)
+    df = df.dropna()
+    if cuts_path:
+        df = apply_cuts(df, cuts_path, theta_cuts=False)
+
+    # event rate in 1/s
+    weights = mc_spectrum.reweigh_to_other_spectrum(spectrum, df.mc_energy.values * u.TeV, t_assumed_obs=1 * u.s)
+    detx, dety = field_of_view_coordinates(df.alt.values, df.az.values, *pointing)
+
+    bins = [binning['energy'], binning['det'], binning['det']]
+    rate, _ = np.histogramdd((df.gamma_energy_prediction_mean.values, dety, detx), bins=bins, weights=weights)
+    return rate
+
+
+def _accumulate(function, path, chunksize, n_jobs, *args):
+    '''
+    Call function(path, start, stop, *args) for each chunk of rows in a pool of workers
+    and sum the returned histograms. Each worker reads its own rows so that
+    at most n_jobs chunks are held in memory at the same time.
+    '''
+    from joblib import Parallel, delayed
+
+    n_rows = _count_rows(path)
+    slices = [(start, min(start + chunksize, n_rows)) for start in range(0, n_rows, chunksize)]
+
+    total = None
+    results = Parallel(n_jobs=n_jobs, return_as='generator')(
+        delayed(function)(path, start, stop, *args) for start, stop in slices
+    )
+    # partial results are summed as they arrive, only one set of histograms per worker is kept
+    for r in results:
+        total = r if total is None else _add(total, r)
+    return total
+
+
+def _add(a, b):
+    if isinstance(a, tuple):
+        return tuple(x + y for x, y in zip(a, b))
+    return a + b
+
+
+def find_pointing(gammas_path):
+    '''
+    Pointing position (alt, az) in degree estimated from the true source positions of the
+    first chunk of gamma events. For point-like gammas this is the source position,
+    for diffuse gammas the center of the view cone.
+    '''
+    df = _read_rows(gammas_path, 0, 100000)
+    az = np.deg2rad(df.mc_az.values)
+    mean_az = np.rad2deg(np.arctan2(np.sin(az).mean(), np.cos(az).mean())) % 360
+    return df.mc_alt.mean(), mean_az
+
+
+def simulated_events(runs, binning):
+    '''
+    Number of simulated showers in each (offset, energy) bin assuming an isotropic
+    distribution within the view cone. Point-like productions are put in the first offset bin.
+    '''
+    mc_spectrum = MCSpectrum.from_cta_runs(runs)
+    n_energy = mc_spectrum.expected_events_for_bins(binning['energy'] * u.TeV)
+
+    lo, hi = binning['offset'][:-1], binning['offset'][1:]
+    if (runs.mc_diffuse == 1).all():
+        cone_min = runs.mc_min_viewcone_radius.iloc[0]
+        cone_max = runs.mc_max_viewcone_radius.iloc[0]
+        lo, hi = np.clip(lo, cone_min, cone_max), np.clip(hi, cone_min, cone_max)
+        cone = np.cos(np.deg2rad(cone_min)) - np.cos(np.deg2rad(cone_max))
+        fraction = (np.cos(np.deg2rad(lo)) - np.cos(np.deg2rad(hi))) / cone
+    else:
+        fraction = np.zeros(len(lo))
+        fraction[0] = 1
+
+    return fraction[:, np.newaxis] * n_energy[np.newaxis, :], mc_spectrum.generation_area
+
+
+def _edges_columns(name, edges, unit):
+    return {f'{name}_LO': edges[:-1] * unit, f'{name}_HI': edges[1:] * unit}
+
+
+def _to_hdu(name, hduclas2, hduclas4, columns):
+    table = QTable({k: [v] for k, v in columns.items()})
+    hdu = fits.table_to_hdu(table)
+    hdu.name = name
+    hdu.header['HDUCLASS'] = 'GADF'
+    hdu.header['HDUDOC'] = 'https://github.com/open-gamma-ray-astro/gamma-astro-data-formats'
+    hdu.header['HDUVERS'] = '0.2'
+    hdu.header['HDUCLAS1'] = 'RESPONSE'
+    hdu.header['HDUCLAS2'] = hduclas2
+    hdu.header['HDUCLAS3'] = 'FULL-ENCLOSURE'
+    hdu.header['HDUCLAS4'] = hduclas4
+    return hdu
+
+
+def build_irf(gammas_path, protons_path, electrons_path, cuts_path=None, binning=None, pointing=None, chunksize=1000000, n_jobs=4):
+    '''
+    Build full enclosure IRFs in GADF format from DL2 event files.
+
+    Events are streamed in chunks of `chunksize` rows. The chunks are distributed over `n_jobs` workers
+    which fill partial histograms that are summed afterwards.
+    Prediction and multiplicity cuts are applied like in `apply_cuts`. No theta cut is applied.
+
+    Returns
+    -------
+    astropy.io.fits.HDUList
+        with the HDUs EFFECTIVE AREA, ENERGY DISPERSION, PSF and BACKGROUND
+    '''
+    if binning is None:
+        binning = make_irf_binning()
+    if pointing is None:
+        pointing = find_pointing(gammas_path)
+
+    selected, migration, psf = _accumulate(_accumulate_gammas, gammas_path, chunksize, n_jobs, cuts_path, pointing, binning)
+
+    simulated, generation_area = simulated_events(load_runs(gammas_path), binning)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        effective_area = np.nan_to_num(selected / simulated) * generation_area.to_value(u.m**2)
+
+        n_migra = migration.sum(axis=1, keepdims=True)
+        matrix = np.nan_to_num(migration / n_migra / np.diff(binning['migra'])[np.newaxis, :, np.newaxis])
+
+        rad = np.deg2rad(binning['rad'])
+        solid_angle = np.pi * (rad[1:]**2 - rad[:-1]**2)
+        n_psf = psf.sum(axis=1, keepdims=True)
+        rpsf = np.nan_to_num(psf / n_psf / solid_angle[np.newaxis, :, np.newaxis])
+
+    background = 0
+    for path, spectrum in [(protons_path, CosmicRaySpectrum()), (electrons_path, CTAElectronSpectrum())]:
+        mc_spectrum = MCSpectrum.from_cta_runs(load_runs(path))
+        args = (cuts_path, pointing, binning, mc_spectrum, spectrum)
+        background = background + _accumulate(_accumulate_background, path, chunksize, n_jobs, *args)
+
+    energy_width = np.diff((binning['energy'] * u.TeV).to_value(u.MeV))
+    pixel = np.deg2rad(np.diff(binning['det']))
+    pixel_solid_angle = pixel[:, np.newaxis] * pixel[np.newaxis, :]
+    background = background / energy_width[:, np.newaxis, np.newaxis] / pixel_solid_angle[np.newaxis]
+
+    energy = _edges_columns('ENERG', binning['energy'], u.TeV)
+    theta = _edges_columns('THETA', binning['offset'], u.deg)
+
+    hdus = [
+        fits.PrimaryHDU(),
+        _to_hdu('EFFECTIVE AREA', 'EFF_AREA', 'AEFF_2D', {**energy, **theta, 'EFFAREA': effective_area * u.m**2}),
+        _to_hdu('ENERGY DISPERSION', 'EDISP', 'EDISP_2D', {
+            **energy,
+            **_edges_columns('MIGRA', binning['migra'], u.one),
+            **theta,
+            'MATRIX': matrix * u.one,
+        }),
+        _to_hdu('PSF', 'RPSF', 'PSF_TABLE', {
+            **energy,
+            **theta,
+            **_edges_columns('RAD', binning['rad'], u.deg),
+            'RPSF': rpsf / u.sr,
+        }),
+        _to_hdu('BACKGROUND', 'BKG', 'BKG_3D', {
+            **energy,
+            **_edges_columns('DETX', binning['det'], u.deg),
+            **_edges_columns('DETY', binning['det'], u.deg),
+            'BKG': background / (u.MeV * u.s * u.sr),
+        }),
+    ]
+    return fits.HDUList(hdus)
@@ -3,32 +3,31 @@ from mpl_toolkits.mplot3d import Axes3D # needs to be imported prior to matplotl
 import matplotlib.ticker as mticker
 import numpy as np
 import astropy.units as u
-from gammapy.irf import EnergyDispersion2D
 from scipy.ndimage import gaussian_filter
 from . import _log_tick_formatter
+from .grid import energy_dispersion_grid
 
 
-def energy_dispersion_3d_plot(irf_file_path, ax=None, hdu="ENERGY DISPERSION"):
-    if not ax:
-        fig = plt.figure(figsize=(10, 7),)
-        ax = fig.add_subplot(111, projection='3d')
-
-
-    edisp = EnergyDispersion2D.read(irf_file_path, hdu=hdu)
-    energy_reco = np.logspace(-2, 2, 20) * u.TeV
-    offsets = np.linspace(0, 6, 7) * u.deg
-
-    Z = []
-    for offset in offsets:
-        erf = edisp.to_energy_dispersion(offset)
-        zs = erf.get_resolution(energy_reco).value
-        Z.append(zs)
+def energy_dispersion_3d_data(irf_file_path, hdu="ENERGY DISPERSION", n_energy=20, n_offset=7):
+    energy_reco = np.logspace(-2, 2, n_energy) * u.TeV
+    offsets = np.linspace(0, 6, n_offset) * u.deg
 
     X, Y = np.meshgrid(energy_reco, offsets)
-    Z = np.vstack(Z)
+    Z = energy_dispersion_grid(irf_file_path, energy_reco, offsets, hdu=hdu)
     mask = ~np.isfinite(Z)
     Z[mask] = np.nanmean(Z)
     Z = gaussian_filter(Z, sigma=0.8)
+    return X, Y, Z
+
+
+def energy_dispersion_3d_plot(irf_file_path, ax=None, hdu="ENERGY DISPERSION", data=None):
+    if not ax:
+        fig = plt.figure(figsize=(10, 7),)
+        ax = fig.add_subplot(111, projection='3d')
+
+    if data is None:
+        data = energy_dispersion_3d_data(irf_file_path, hdu=hdu)
+    X, Y, Z = data
 
     X, Y, Z = np.log10(X.to_value('TeV')).ravel(), Y.ravel(), Z.ravel()
     ax.plot_trisurf(X, Y, Z, cmap='viridis', vmin=0, vmax=np.nanpercentile(Z, 99), antialiased=True)
@@ -0,0 +1,191 @@
+import os
+from functools import lru_cache
+
+import astropy.units as u
+import numpy as np
+from astropy.table import QTable
+from scipy.interpolate import RegularGridInterpolator
+
+
+@lru_cache(maxsize=None)
+def _read_irf_table(irf_file_path, hdu):
+    table = QTable.read(irf_file_path, hdu=hdu)
+    # GADF stores all data in a single row of array columns. Dimensionless columns come as plain arrays.
+    return {name: _quantity(table[name][0]) for name in table.colnames}
+
+
+def _quantity(value):
+    # astropy does not parse chained divisions like '1/s/MeV/sr' used by older files
+    unit = getattr(value, 'unit', None)
+    if isinstance(unit, u.UnrecognizedUnit):
+        numerator, *denominators = unit.name.split('/')
+        unit = u.Unit(numerator)
+        for d in denominators:
+            unit /= u.Unit(d)
+        return u.Quantity(value.value, unit)
+    return u.Quantity(value)
+
+
+def read_irf_table(irf_file_path, hdu):
+    '''
+    Read a GADF IRF table as a dictionary of quantities (bin edges and data cube).
+    Results are memoized per (path, hdu) and must not be modified in place.
+    '''
+    return _read_irf_table(os.path.abspath(irf_file_path), hdu)
+
+
+def _column(table, *names):
+    '''
+    The first of the given columns present in the table. Older files use other names, e.g. BGD for BKG.
+    '''
+    for name in names:
+        if name in table:
+            return table[name]
+    raise KeyError(f'None of the columns {names} in IRF table with columns {list(table)}')
+
+
+def _centers(table, name, log=False):
+    # true energy is stored as ETRUE_LO/HI instead of ENERG_LO/HI in older files
+    names = [name, 'ETRUE'] if name == 'ENERG' else [name]
+    lo = _column(table, *[f'{n}_LO' for n in names])
+    hi = _column(table, *[f'{n}_HI' for n in names])
+    if log:
+        return np.log10(np.sqrt(lo * hi).to_value(u.TeV))
+    return ((lo + hi) / 2).value
+
+
+def _evaluate(axes, data, *coordinates):
+    '''
+    Multi-linear interpolation of the data cube at all combinations of the given coordinates.
+    Values beyond the outermost bin centers are extrapolated linearly.
+    Returns an array with shape (len(coordinates[0]), ..., len(coordinates[-1])) + the remaining data axes.
+    '''
+    interpolator = RegularGridInterpolator(axes, data, method='linear', bounds_error=False, fill_value=None)
+    mesh = np.meshgrid(*coordinates, indexing='ij')
+    points = np.stack([m.ravel() for m in mesh], axis=-1)
+    values = interpolator(points)
+    return values.reshape(mesh[0].shape + data.shape[len(axes):])
+
+
+def effective_area_grid(irf_file_path, energy, offset, hdu='EFFECTIVE AREA'):
+    '''
+    Effective area on the (offset, energy) mesh as array of shape (len(offset), len(energy)).
+    '''
+    table = read_irf_table(irf_file_path, hdu)
+    # EFFAREA has shape (n_offset, n_energy)
+    axes = (_centers(table, 'THETA'), _centers(table, 'ENERG', log=True))
+    data = table['EFFAREA']
+
+    values = _evaluate(axes, data.value, offset.to_value(u.deg), np.log10(energy.to_value(u.TeV)))
+    return np.clip(values, 0, None) * data.unit
+
+
+def energy_dispersion_grid(irf_file_path, energy, offset, hdu='ENERGY DISPERSION'):
+    '''
+    Energy resolution (standard deviation of the migration E_reco / E_true)
+    on the (offset, energy) mesh as array of shape (len(offset), len(energy)).
+    NaN where the migration distribution is empty.
+    '''
+    table = read_irf_table(irf_file_path, hdu)
+    # MATRIX has shape (n_offset, n_migra, n_energy). Interpolate the energy axis first
+    # so that the migration axis ends up last.
+    matrix = np.moveaxis(table['MATRIX'].value, 1, -1)
+    axes = (_centers(table, 'THETA'), _centers(table, 'ENERG', log=True))
+
+    pdf = _evaluate(axes, matrix, offset.to_value(u.deg), np.log10(energy.to_value(u.TeV)))
+    pdf = np.clip(pdf, 0, None)
+
+    migra = _centers(table, 'MIGRA')
+    counts = pdf * (table['MIGRA_HI'] - table['MIGRA_LO']).value
+    norm = counts.sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = (counts * migra).sum(axis=-1) / norm
+        variance = (counts * migra**2).sum(axis=-1) / norm - mean**2
+    return np.sqrt(np.clip(variance, 0, None))
+
+
+def psf_grid(irf_file_path, energy, offset, fraction=0.68, hdu='PSF'):
+    '''
+    Radius containing the given fraction of the PSF on the (offset, energy) mesh
+    as array of shape (len(offset), len(energy)).
+    Raises a ValueError if the HDU does not exist or is not a PSF table.
+    '''
+    try:
+        table = read_irf_table(irf_file_path, hdu)
+    except KeyError:
+        raise ValueError(f'No HDU {hdu} in {irf_file_path}.') from None
+    if 'RPSF' not in table:
+        raise ValueError(
+            f'HDU {hdu} of {irf_file_path} is not a PSF table (RPSF column), columns: {list(table)}.'
+            ' Parametrized PSFs (e.g. 3-gauss) are not supported.'
+        )
+    # RPSF has shape (n_offset, n_rad, n_energy)
+    rpsf = np.moveaxis(table['RPSF'].to_value(1 / u.sr), 1, -1)
+    axes = (_centers(table, 'THETA'), _centers(table, 'ENERG', log=True))
+
+    pdf = _evaluate(axes, rpsf, offset.to_value(u.deg), np.log10(energy.to_value(u.TeV)))
+    pdf = np.clip(pdf, 0, None)
+
+    rad_lo, rad_hi = table['RAD_LO'].to_value(u.rad), table['RAD_HI'].to_value(u.rad)
+    solid_angle = np.pi * (rad_hi**2 - rad_lo**2)
+    containment = np.cumsum(pdf * solid_angle, axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        containment /= containment[..., -1:]
+
+    # first radius where the cumulative containment exceeds the fraction, linear interpolation within the bin
+    idx = np.clip((containment < fraction).sum(axis=-1), 0, len(rad_hi) - 1)
+    upper = np.take_along_axis(containment, idx[..., np.newaxis], axis=-1)[..., 0]
+    lower = np.where(idx > 0, np.take_along_axis(containment, np.maximum(idx - 1, 0)[..., np.newaxis], axis=-1)[..., 0], 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = np.clip((fraction - lower) / (upper - lower), 0, 1)
+    radius = rad_lo[idx] + t * (rad_hi[idx] - rad_lo[idx])
+    radius[~np.isfinite(upper)] = np.nan
+    return (radius * u.rad).to(u.deg)
+
+
+def background_grid(irf_file_path, energy, offset, hdu='BACKGROUND'):
+    '''
+    Background rate along the DETX axis (DETY = 0) on the (offset, energy) mesh
+    as array of shape (len(offset), len(energy)).
+    '''
+    table = read_irf_table(irf_file_path, hdu)
+    # BKG (BGD in older files) has shape (n_energy, n_dety, n_detx)
+    data = _column(table, 'BKG', 'BGD')
+    axes = (_centers(table, 'DETX'), _centers(table, 'DETY'), _centers(table, 'ENERG', log=True))
+    cube = np.transpose(data.value, (2, 1, 0))
+
+    values = _evaluate(axes, cube, offset.to_value(u.deg), [0], np.log10(energy.to_value(u.TeV)))
+    return np.clip(values[:, 0, :], 0, None) * data.unit
+
+
+def background_map(irf_file_path, hdu='BACKGROUND'):
+    '''
+    Background rate summed over energy on the (DETY, DETX) bins of the table.
+    Returns the bin centers along DETX and DETY and the map.
+    '''
+    table = read_irf_table(irf_file_path, hdu)
+    return _centers(table, 'DETX') * u.deg, _centers(table, 'DETY') * u.deg, _column(table, 'BKG', 'BGD').sum(axis=0)
+
+
+def irf_grids(irf_file_path, energy, offset, fraction=0.68, psf_hdu='PSF'):
+    '''
+    Evaluate all IRF components on the (offset, energy) mesh.
+    Returns a dictionary of arrays suitable for `np.savez`.
+    The PSF radius is NaN if `psf_hdu` is missing or not a PSF table (e.g. a 3-gauss parametrization).
+    '''
+    from colorama import Fore
+
+    try:
+        psf_radius = psf_grid(irf_file_path, energy, offset, fraction=fraction, hdu=psf_hdu).to_value(u.deg)
+    except ValueError as e:
+        print(Fore.YELLOW + f'{e} Filling psf_radius with NaN.' + Fore.RESET)
+        psf_radius = np.full((len(offset), len(energy)), np.nan)
+
+    return {
+        'energy': energy.to_value(u.TeV),
+        'offset': offset.to_value(u.deg),
+        'effective_area': effective_area_grid(irf_file_path, energy, offset).to_value(u.m**2),
+        'energy_resolution': energy_dispersion_grid(irf_file_path, energy, offset),
+        'psf_radius': psf_radius,
+        'background': background_grid(irf_file_path, energy, offset).to_value(1 / (u.MeV * u.s * u.sr)),
+    }
@@ -1,12 +1,45 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import click
-from cta_plots.irf.effective_area_3d import effective_area_3d_plot
-from cta_plots.irf.background_3d import background_3d_plot
-from cta_plots.irf.energy_dispersion_3d import energy_dispersion_3d_plot
-from cta_plots.irf.psf_3d import psf_3d_plot
-import matplotlib.pyplot as plt
+
+from cta_plots.profiling import profile_option, stage
+
+# plotting modules, matplotlib and astropy are imported in the commands to keep `--help` fast
+
+
+def _irf_plots():
+    from cta_plots.irf.effective_area_3d import effective_area_3d_plot, effective_area_3d_data
+    from cta_plots.irf.background_3d import background_3d_plot, background_3d_data
+    from cta_plots.irf.energy_dispersion_3d import energy_dispersion_3d_plot, energy_dispersion_3d_data
+    from cta_plots.irf.psf_3d import psf_3d_plot, psf_3d_data
+
+    return {
+        'effective_area': (effective_area_3d_data, effective_area_3d_plot),
+        'background': (background_3d_data, background_3d_plot),
+        'energy_dispersion': (energy_dispersion_3d_data, energy_dispersion_3d_plot),
+        'psf': (psf_3d_data, psf_3d_plot),
+    }
+
+
+def _plot_single(name, irf_file_path, output):
+    import matplotlib.pyplot as plt
+
+    _, plot_function = _irf_plots()[name]
+    fig = plt.figure(figsize=(10, 7),)
+    ax = fig.add_subplot(111, projection='3d')
+    with stage(name):
+        plot_function(irf_file_path, ax=ax)
+
+    if output:
+        with stage('save'):
+            plt.savefig(output)
+    else:
+        plt.show()
 
 
 @click.group(invoke_without_command=True)
+@profile_option
 @click.option('--debug/--no-debug', default=False)
 @click.pass_context
 def cli(ctx, debug):
@@ -24,14 +57,7 @@ def cli(ctx, debug):
 @click.option('-o', '--output', type=click.Path(exists=False))
 @click.pass_context
 def effective_area(ctx, irf_file_path, output):
-    fig = plt.figure(figsize=(10, 7),)
-    ax = fig.add_subplot(111, projection='3d')
-    effective_area_3d_plot(irf_file_path, ax=ax)
-
-    if output:
-        plt.savefig(output)
-    else:
-        plt.show()
+    _plot_single('effective_area', irf_file_path, output)
 
 
 @cli.command()
@@ -39,14 +65,7 @@ def effective_area(ctx, irf_file_path, output):
 @click.option('-o', '--output', type=click.Path(exists=False))
 @click.pass_context
 def background(ctx, irf_file_path, output):
-    fig = plt.figure(figsize=(10, 7),)
-    ax = fig.add_subplot(111, projection='3d')
-    background_3d_plot(irf_file_path, ax=ax)
-
-    if output:
-        plt.savefig(output)
-    else:
-        plt.show()
+    _plot_single('background', irf_file_path, output)
 
 
 @cli.command()
@@ -54,14 +73,7 @@ def background(ctx, irf_file_path, output):
 @click.option('-o', '--output', type=click.Path(exists=False))
 @click.pass_context
 def energy_dispersion(ctx, irf_file_path, output):
-    fig = plt.figure(figsize=(10, 7),)
-    ax = fig.add_subplot(111, projection='3d')
-    energy_dispersion_3d_plot(irf_file_path, ax=ax)
-
-    if output:
-        plt.savefig(output)
-    else:
-        plt.show()
+    _plot_single('energy_dispersion', irf_file_path, output)
 
 
 @cli.command()
@@ -69,16 +81,100 @@ def energy_dispersion(ctx, irf_file_path, output):
 @click.option('-o', '--output', type=click.Path(exists=False))
 @click.pass_context
 def psf(ctx, irf_file_path, output):
-    fig = plt.figure(figsize=(10, 7),)
-    ax = fig.add_subplot(111, projection='3d')
-    psf_3d_plot(irf_file_path, ax=ax)
+    _plot_single('psf', irf_file_path, output)
 
-    if output:
-        plt.savefig(output)
-    else:
+
+@cli.command(name='all')
+@click.argument('irf_file_path', type=click.Path())
+@click.option('-o', '--output', type=click.Path(exists=False), help='Figures are saved as <name>_<irf><ext>')
+@click.option('--n_jobs', default=4, help='Number of threads used to compute the grids')
+@click.option('--psf_hdu', default='PSF', help='HDU of the PSF table')
+@click.pass_context
+def plot_all(ctx, irf_file_path, output, n_jobs, psf_hdu):
+    '''
+    Plot all IRF components. Each HDU is read only once and the grids are computed concurrently.
+    Figures are drawn sequentially since matplotlib is not thread safe.
+    Components that cannot be read from the file are reported and skipped.
+    '''
+    import matplotlib.pyplot as plt
+    from colorama import Fore
+
+    irf_plots = _irf_plots()
+    options = {'psf': {'hdu': psf_hdu}}
+    with stage('grids'), ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        futures = {
+            name: executor.submit(data_function, irf_file_path, **options.get(name, {}))
+            for name, (data_function, _) in irf_plots.items()
+        }
+        grids = {}
+        for name, future in futures.items():
+            try:
+                grids[name] = future.result()
+            except (KeyError, ValueError) as e:
+                print(Fore.YELLOW + f'Skipping {name}: {e}' + Fore.RESET)
+
+    for name, (_, plot_function) in irf_plots.items():
+        if name not in grids:
+            continue
+        with stage(name):
+            fig = plt.figure(figsize=(10, 7),)
+            ax = fig.add_subplot(111, projection='3d')
+            plot_function(irf_file_path, ax=ax, data=grids[name])
+
+            if output:
+                base, ext = os.path.splitext(output)
+                fig.savefig(f'{base}_{name}{ext}')
+                plt.close(fig)
+
+    if not output:
         plt.show()
 
 
+@cli.command()
+@click.argument('irf_file_path', type=click.Path())
+@click.argument('output', type=click.Path(exists=False))
+@click.option('--n_energy', default=200, help='Number of energy points between 10 GeV and 100 TeV')
+@click.option('--n_offset', default=200, help='Number of offset points between 0 and 6 deg')
+@click.option('--fraction', default=0.68, help='Containment fraction for the PSF radius')
+@click.option('--psf_hdu', default='PSF', help='HDU of the PSF table')
+def grid(irf_file_path, output, n_energy, n_offset, fraction, psf_hdu):
+    '''
+    Evaluate all IRF components on a dense (offset, energy) mesh and store the arrays in a .npz file.
+    The PSF radius is NaN if the PSF HDU is missing or parametrized.
+    '''
+    import astropy.units as u
+    import numpy as np
+    from cta_plots.irf.grid import irf_grids
+
+    energy = np.logspace(-2, 2, n_energy) * u.TeV
+    offset = np.linspace(0, 6, n_offset) * u.deg
+    np.savez(output, **irf_grids(irf_file_path, energy, offset, fraction=fraction, psf_hdu=psf_hdu))
+
+
+@cli.command()
+@click.argument('gammas_path', type=click.Path(exists=True))
+@click.argument('protons_path', type=click.Path(exists=True))
+@click.argument('electrons_path', type=click.Path(exists=True))
+@click.argument('output', type=click.Path(exists=False))
+@click.option('-c', '--cuts_path', type=click.Path(exists=True), help='Optimized cuts CSV. Theta cuts are not applied.')
+@click.option('--chunksize', default=1000000, help='Number of events read at once by each worker')
+@click.option('--n_jobs', default=4, help='Number of worker processes')
+@click.option('--bins_per_decade', default=10)
+@click.option('--pointing', nargs=2, type=float, default=None, help='Pointing alt and az in degree. Estimated from the gammas if not given.')
+def build(gammas_path, protons_path, electrons_path, output, cuts_path, chunksize, n_jobs, bins_per_decade, pointing):
+    '''
+    Build a GADF IRF file from DL2 event files.
+    '''
+    from cta_plots.irf.build import build_irf, make_irf_binning
+
+    binning = make_irf_binning(bins_per_decade=bins_per_decade)
+    hdus = build_irf(
+        gammas_path, protons_path, electrons_path,
+        cuts_path=cuts_path, binning=binning, pointing=pointing or None, chunksize=chunksize, n_jobs=n_jobs
+    )
+    hdus.writeto(output, overwrite=True)
+
+
 if __name__ == '__main__':
     # pylint: disable=no-value-for-parameter
     cli(obj={})
\ No newline at end of file
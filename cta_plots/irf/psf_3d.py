@@ -4,31 +4,33 @@ import matplotlib.ticker as mticker
 from matplotlib.colors import LogNorm
 import numpy as np
 import astropy.units as u
-from gammapy.irf import PSF3D
 from scipy.ndimage import gaussian_filter
 from . import _bin_center, _log_tick_formatter, _log_scale_formatter
+from .grid import psf_grid
 
 
-def psf_3d_plot(irf_file_path, ax=None, hdu="PSF"):
+def psf_3d_data(irf_file_path, hdu="PSF", n_energy=20, n_offset=7):
+    energy_reco = np.logspace(-2, 2, n_energy) * u.TeV
+    offsets = np.linspace(0, 6, n_offset) * u.deg
+
+    X, Y = np.meshgrid(energy_reco, offsets)
+    Z = psf_grid(irf_file_path, energy_reco, offsets, fraction=0.68, hdu=hdu)
+    return X, Y, Z.to_value(u.deg)
+
+
+def psf_3d_plot(irf_file_path, ax=None, hdu="PSF", data=None):
     if not ax:
         fig = plt.figure(figsize=(10, 7),)
         ax = fig.add_subplot(111, projection='3d')
 
-    psf = PSF3D.read(irf_file_path, hdu=hdu)
-    energy_reco = np.logspace(-2, 2, 20) * u.TeV
-    offsets = np.linspace(0, 6, 7) * u.deg
+    if data is None:
+        data = psf_3d_data(irf_file_path, hdu=hdu)
+    X, Y, Z = data
 
     d = np.linspace(0.01, 1.1, 11)[1::2]
     ticks = np.log10(d)
     # ticks = np.append(ticks, 1 + ticks)
 
-    X, Y = np.meshgrid(energy_reco, offsets)
-    Z = []
-    for x in energy_reco:
-        zs = psf.containment_radius(x, offsets, fraction=0.68)
-        Z.append(zs)
-
-    Z = np.vstack(Z).T
     ax.plot_surface(np.log10(X.to_value('TeV')), Y, np.log10(Z), cmap='viridis', linewidth=1, antialiased=True)
 
     ax.xaxis.set_major_locator(mticker.FixedLocator([-2, -1, 0, 1, 2]))
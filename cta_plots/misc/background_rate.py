@@ -5,7 +5,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 from colorama import Fore
-from fact.analysis import li_ma_significance
+from cta_plots.statistics import li_ma_significance
 from tqdm import tqdm
 
 from cta_plots import (load_background_reference,
@@ -16,6 +16,7 @@ from cta_plots import (load_background_reference,
                        create_interpolated_function,
                        )
 
+from cta_plots.histogram import histogram
 from cta_plots.sensitivity_utils import find_relative_sensitivity
 from cta_plots.mc.spectrum import CrabSpectrum
 
@@ -77,8 +78,8 @@ def main(
 
     fig, ax = plt.subplots()
     w = (background.weight) * solid_angles
-    # from IPython import embed; embed()
-    ax.hist(background.gamma_energy_prediction_mean, bins=bin_edges, weights=w, histtype='step', lw=2, )
+    h = histogram(background, 'gamma_energy_prediction_mean', bin_edges, weights=w).sum_w
+    ax.hist(bin_edges[:-1].value, bins=bin_edges.value, weights=h, histtype='step', lw=2, )
 
     if reference:
         plot_refrence(ax)
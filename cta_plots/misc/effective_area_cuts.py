@@ -1,6 +1,5 @@
 import click
 import matplotlib.pyplot as plt
-import numpy as np
 import pandas as pd
 from astropy.stats import binom_conf_interval
 import astropy.units as u
@@ -8,6 +7,7 @@ import astropy.units as u
 from cta_plots import make_energy_bins, load_effective_area_requirement, load_signal_events, apply_cuts
 from cta_plots.mc.spectrum import MCSpectrum
 from cta_plots.colors import main_color
+from cta_plots.histogram import histogram
 from fact.io import read_data
 
 cols = [
@@ -41,10 +41,8 @@ def main(input_file, output, n_bins, cuts_path,  reference):
     runs = read_data(input_file, key='runs')
     mc_production = MCSpectrum.from_cta_runs(runs)
 
-    gammas_energy = gammas.gamma_energy_prediction_mean.values
-
     hist_all = mc_production.expected_events_for_bins(energy_bins=bins)
-    hist_selected, _ = np.histogram(gammas_energy, bins=bins)
+    hist_selected = histogram(gammas, 'gamma_energy_prediction_mean', bins).counts
 
     invalid = hist_selected > hist_all
     hist_selected[invalid] = hist_all[invalid]
@@ -1,11 +1,11 @@
 import click
 import matplotlib.pyplot as plt
-import numpy as np
 import astropy.units as u
 import fact.io
 from . import make_energy_bins
 from matplotlib.colors import LogNorm
 from .colors import default_cmap
+from .histogram import histogram
 
 
 
@@ -20,10 +20,7 @@ def main(gamma_file, output, title, colormap, norm):
 
     gammas = fact.io.read_data(gamma_file, key='array_events').dropna()
 
-    e_true = gammas.mc_energy
-    e_reco = gammas.gamma_energy_prediction_mean
-
-    h, _, _ = np.histogram2d(e_true, e_reco, bins=[bins, bins])
+    h = histogram(gammas, ['mc_energy', 'gamma_energy_prediction_mean'], [bins, bins]).counts
 
     if norm == 'log':
         norm = LogNorm()
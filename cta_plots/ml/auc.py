@@ -3,10 +3,11 @@ import matplotlib.pyplot as plt
 import matplotlib.patches as patches
 from matplotlib.collections import LineCollection
 
-from sklearn.metrics import roc_curve, roc_auc_score
 from mpl_toolkits.axes_grid1.inset_locator import zoomed_inset_axes, mark_inset
 from ..colors import telescope_color
 from ..binning import make_default_cta_binning
+from .roc import BinnedROC, segmented_auc, bootstrap_segmented_auc, bootstrap_binned_roc, auc_from_histograms, tpr_at_fpr
+from ..bootstrap import confidence_interval
 import astropy.units as u
 import pandas as pd
 
@@ -36,23 +37,15 @@ def add_rectangles(ax, offset=0.15):
     ax.add_patch(rect)
 
 
-def plot_balanced_acc(prediction_gammas, prediction_protons, ax=None, cmap='magma'):
-    gamma_labels = np.ones_like(prediction_gammas)
-    proton_labels = np.zeros_like(prediction_protons)
+def plot_balanced_acc(prediction_gammas, prediction_protons, ax=None, cmap='magma', roc=None):
+    if roc is None:
+        roc = BinnedROC.from_predictions(prediction_gammas, prediction_protons)
 
-    y_score = np.hstack([prediction_gammas, prediction_protons])
-    y_true = np.hstack([gamma_labels, proton_labels])
-
-    fpr, tpr, threshold = roc_curve(y_true, y_score, pos_label=1)
-
-    # m  = (threshold >=0 ) & (threshold <= 1)
-    fpr, tpr, threshold = fpr[1:], tpr[1:], threshold[1:]
+    bacc, threshold = roc.balanced_accuracy()
     if not ax:
         fig, ax = plt.subplots(1, 1)
     add_rectangles(ax)
 
-    tnr = 1 - fpr
-    bacc = 0.5 * (tpr + tnr)
     ax.scatter(threshold, bacc, c=threshold, rasterized=True, s=3, cmap=cmap)
 
     
@@ -63,23 +56,18 @@ def plot_balanced_acc(prediction_gammas, prediction_protons, ax=None, cmap='magm
     return ax
 
 
-def plot_quick_auc(prediction_gammas, prediction_protons, label='', ax=None, cmap='magma'):
+def plot_quick_auc(prediction_gammas, prediction_protons, label='', ax=None, cmap='magma', roc=None):
     # see https://matplotlib.org/3.1.0/gallery/lines_bars_and_markers/multicolored_line.html
     # is ugly and why yoo slow. just rasterize scatter plot
     if not ax:
         fig, ax = plt.subplots(1, 1)
     
     add_rectangles(ax)
-    gamma_labels = np.ones_like(prediction_gammas)
-    proton_labels = np.zeros_like(prediction_protons)
-
-    y_score = np.hstack([prediction_gammas, prediction_protons])
-    y_true = np.hstack([gamma_labels, proton_labels])
-
-    fpr, tpr, threshold = roc_curve(y_true, y_score, pos_label=1)
-    auc = roc_auc_score(y_true, y_score)
+    if roc is None:
+        roc = BinnedROC.from_predictions(prediction_gammas, prediction_protons)
 
-    fpr, tpr, threshold = fpr[1:], tpr[1:], threshold[1:]
+    fpr, tpr, threshold = roc.roc_curve()
+    auc = roc.auc()
 
     ax.scatter(fpr, tpr, c=threshold, rasterized=True, s=3, cmap=cmap)
     ax.text(0.2, 0.2, f'area under curve:  {auc:.2f}', alpha=0.5)
@@ -90,7 +78,28 @@ def plot_quick_auc(prediction_gammas, prediction_protons, label='', ax=None, cma
     return ax
 
 
-def plot_auc(gammas, protons, what='mean', inset=False, label='', ax=None):
+def plot_roc_acc(roc, cmap='plasma'):
+    '''
+    ROC curve and balanced accuracy side by side.
+    '''
+    fig, [ax1, ax2] = plt.subplots(1, 2, dpi=800)
+
+    plot_quick_auc(None, None, ax=ax1, cmap=cmap, roc=roc)
+
+    plot_balanced_acc(None, None, ax=ax2, cmap=cmap, roc=roc)
+
+    ax1.set_ylim([-0.075, 1.075])
+    ax1.set_xlim([-0.075, 1.075])
+
+    ax2.set_ylim([-0.075, 1.075])
+    ax2.set_xlim([-0.075, 1.075])
+
+    plt.tight_layout(pad=0, rect=(-0.002, 0, 1.00, 1))
+    plt.subplots_adjust(wspace=0.23)
+    return ax1, ax2
+
+
+def plot_auc(gammas, protons, what='mean', inset=False, label='', ax=None, n_bootstrap=0, n_jobs=4):
     if what == "mean":
         prediction_gammas = gammas.groupby(["array_event_id", "run_id"])["gamma_prediction"].mean()
         prediction_protons = protons.groupby(["array_event_id", "run_id"])["gamma_prediction"].mean()
@@ -113,24 +122,31 @@ def plot_auc(gammas, protons, what='mean', inset=False, label='', ax=None):
         idx = protons.groupby(["array_event_id", "run_id"])["intensity"].idxmax()
         prediction_protons = protons.loc[idx].gamma_prediction.values
 
-    gamma_labels = np.ones_like(prediction_gammas)
-    proton_labels = np.zeros_like(prediction_protons)
-
-    y_score = np.hstack([prediction_gammas, prediction_protons])
-    y_true = np.hstack([gamma_labels, proton_labels])
-
-    fpr, tpr, _ = roc_curve(y_true, y_score, pos_label=1)
-    auc = roc_auc_score(y_true, y_score)
+    roc = BinnedROC.from_predictions(prediction_gammas, prediction_protons)
+    fpr, tpr, _ = roc.roc_curve()
+    auc = roc.auc()
 
     if not ax:
         fig, ax = plt.subplots(1, 1)
     else:
         fig = plt.gcf()
+
+    auc_text = f'{auc:.3f}'
+    if n_bootstrap > 0:
+        signal, background = bootstrap_binned_roc(prediction_gammas, prediction_protons, n_bootstrap=n_bootstrap, n_jobs=n_jobs)
+        auc_low, auc_high = confidence_interval(auc_from_histograms(signal, background))
+        auc_text = f'{auc:.3f}$^{{+{auc_high - auc:.3f}}}_{{-{auc - auc_low:.3f}}}$'
+
     if label:
-        label_text = f'Aggregation: "{label}" AuC: {auc:.3f}'
+        label_text = f'Aggregation: "{label}" AuC: {auc_text}'
     else:
-        label_text = f'Area under Curve: {auc:.3f}'
-    ax.plot(fpr, tpr, lw=2, label=label_text)
+        label_text = f'Area under Curve: {auc_text}'
+    line, = ax.plot(fpr, tpr, lw=2, label=label_text)
+
+    if n_bootstrap > 0:
+        fpr_grid = np.linspace(0, 1, 200)
+        tpr_low, tpr_high = confidence_interval(tpr_at_fpr(signal, background, fpr_grid))
+        ax.fill_between(fpr_grid, tpr_low, tpr_high, color=line.get_color(), alpha=0.3, lw=0)
 
     legend = ax.legend(loc='lower right', framealpha=0.5)
 
@@ -190,14 +206,9 @@ def plot_auc_per_type(gammas, protons, what, box, ax=None):
             prediction_gammas = tel_gammas.gamma_prediction
             prediction_protons = tel_protons.gamma_prediction
 
-        gamma_labels = np.ones_like(prediction_gammas)
-        proton_labels = np.zeros_like(prediction_protons)
-
-        y_score = np.hstack([prediction_gammas, prediction_protons])
-        y_true = np.hstack([gamma_labels, proton_labels])
-
-        fpr, tpr, _ = roc_curve(y_true, y_score, pos_label=1)
-        auc = roc_auc_score(y_true, y_score)
+        roc = BinnedROC.from_predictions(prediction_gammas, prediction_protons)
+        fpr, tpr, _ = roc.roc_curve()
+        auc = roc.auc()
         ax.plot(
             fpr,
             tpr,
@@ -210,7 +221,88 @@ def plot_auc_per_type(gammas, protons, what, box, ax=None):
         add_rectangles(ax)
 
 
-def plot_auc_vs_energy(gammas, protons, e_reco=False, sample=False, ax=None):
+def _mean_prediction_per_segment(events, segments):
+    df = pd.DataFrame({
+        'segment': segments,
+        'array_event_id': events.array_event_id.values,
+        'run_id': events.run_id.values,
+        'gamma_prediction': events.gamma_prediction.values,
+    })
+    mean = df.groupby(['segment', 'array_event_id', 'run_id'], sort=False)['gamma_prediction'].mean()
+    return mean.values, mean.index.get_level_values('segment').values
+
+
+def calculate_auc_vs_energy(gammas, protons, bin_edges, key, sample=False, min_events=350, n_bootstrap=0, n_jobs=4):
+    '''
+    Calculate the AUC of the mean prediction per array event for each telescope type and energy bin.
+    Energy bin and telescope type codes are assigned once, all AUCs are then computed in one go
+    with a segmented rank-sum statistic.
+
+    Parameters
+    ----------
+    gammas, protons : pd.DataFrame
+        telescope events with the columns telescope_type_id, gamma_prediction, array_event_id, run_id and `key`
+    bin_edges : array
+        energy binning in TeV
+    key : str
+        column containing the energy to bin in
+    sample : bool, optional
+        whether to compare the gammas in each bin to the protons from all energies
+    min_events : int, optional
+        minimum number of telescope events for both classes. AUC is NaN for cells with fewer events.
+    n_bootstrap : int, optional
+        number of bootstrap replicas to calculate.
+
+    Returns
+    -------
+    tuple
+        aucs of shape (n_types, n_bins) and the bootstrap replicas of shape (n_bootstrap, n_types, n_bins) or None
+    '''
+    n_types = len(id_to_name)
+    n_bins = len(bin_edges) - 1
+
+    def codes(df, bin_energies=True):
+        type_codes = df.telescope_type_id.values.astype(np.int64) - 1
+        valid = (type_codes >= 0) & (type_codes < n_types)
+        if not bin_energies:
+            return type_codes, valid
+        # right closed intervals, same as pd.cut
+        bin_codes = np.searchsorted(bin_edges, df[key].values, side='left') - 1
+        valid &= (bin_codes >= 0) & (bin_codes < n_bins)
+        return type_codes * n_bins + bin_codes, valid
+
+    gamma_segments, m = codes(gammas)
+    gamma_counts = np.bincount(gamma_segments[m], minlength=n_types * n_bins)
+    gamma_prediction, gamma_segments = _mean_prediction_per_segment(gammas[m], gamma_segments[m])
+
+    if sample:
+        proton_segments, m = codes(protons, bin_energies=False)
+        proton_counts = np.repeat(np.bincount(proton_segments[m], minlength=n_types), n_bins)
+        comparison_segments = gamma_segments // n_bins
+    else:
+        proton_segments, m = codes(protons)
+        proton_counts = np.bincount(proton_segments[m], minlength=n_types * n_bins)
+        comparison_segments = gamma_segments
+    proton_prediction, proton_segments = _mean_prediction_per_segment(protons[m], proton_segments[m])
+
+    too_few = (gamma_counts < min_events) | (proton_counts < min_events)
+
+    args = (gamma_prediction, proton_prediction, comparison_segments, proton_segments)
+    aucs = segmented_auc(*args, signal_groups=gamma_segments, n_groups=n_types * n_bins)
+    aucs[too_few] = np.nan
+
+    replicas = None
+    if n_bootstrap > 0:
+        replicas = bootstrap_segmented_auc(
+            *args, signal_groups=gamma_segments, n_groups=n_types * n_bins, n_bootstrap=n_bootstrap, n_jobs=n_jobs
+        )
+        replicas[:, too_few] = np.nan
+        replicas = replicas.reshape(-1, n_types, n_bins)
+
+    return aucs.reshape(n_types, n_bins), replicas
+
+
+def plot_auc_vs_energy(gammas, protons, e_reco=False, sample=False, ax=None, n_bootstrap=0, n_jobs=4):
 
 
     bins, bin_center, bin_widths = make_default_cta_binning(
@@ -222,52 +314,25 @@ def plot_auc_vs_energy(gammas, protons, e_reco=False, sample=False, ax=None):
     else:
         key = "mc_energy"
 
-    gammas["energy_bin"] = pd.cut(gammas[key], bins)
-    protons["energy_bin"] = pd.cut(protons[key], bins)
+    aucs, replicas = calculate_auc_vs_energy(
+        gammas, protons, bins.to_value(u.TeV), key, sample=sample, n_bootstrap=n_bootstrap, n_jobs=n_jobs
+    )
 
     if not ax:
         fig, ax = plt.subplots(1, 1)
 
     for tel_type in ["SST", "MST", "LST"]:
-        aucs = []
-        for b in gammas.energy_bin.cat.categories:
-
-            tel_gammas = gammas[
-                (gammas.energy_bin == b)
-                &
-                (gammas.telescope_type_id == name_to_id[tel_type])
-            ]
-            if sample:
-                tel_protons = protons[protons.telescope_type_id == name_to_id[tel_type]]
-            else:
-                tel_protons = protons[
-                    (protons.energy_bin == b)
-                    & 
-                    (protons.telescope_type_id == name_to_id[tel_type])
-                ]
-
-            if len(tel_gammas) < 350 or len(tel_protons) < 350:
-                aucs.append(np.nan)
-            else:
-                mean_prediction_gammas = tel_gammas.groupby(
-                    ["array_event_id", "run_id"]
-                )["gamma_prediction"].mean()
-                gamma_labels = np.ones_like(mean_prediction_gammas)
-
-                mean_prediction_protons = tel_protons.groupby(
-                    ["array_event_id", "run_id"]
-                )["gamma_prediction"].mean()
-                proton_labels = np.zeros_like(mean_prediction_protons)
-
-                y_score = np.hstack([mean_prediction_gammas, mean_prediction_protons])
-                y_true = np.hstack([gamma_labels, proton_labels])
-
-                aucs.append(roc_auc_score(y_true, y_score))
+        idx = name_to_id[tel_type] - 1
+        yerr = None
+        if replicas is not None:
+            low, high = confidence_interval(replicas[:, idx])
+            yerr = [np.abs(aucs[idx] - low), np.abs(high - aucs[idx])]
 
         ax.errorbar(
             bin_center.value,
-            aucs,
+            aucs[idx],
             xerr=bin_widths.value / 2.0,
+            yerr=yerr,
             linestyle="--",
             label=tel_type,
             ecolor="gray",
@@ -286,4 +351,3 @@ def plot_auc_vs_energy(gammas, protons, e_reco=False, sample=False, ax=None):
     ax.set_ylabel("Area Under RoC Curve")
     ax.legend()
     return ax
-
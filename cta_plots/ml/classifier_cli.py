@@ -1,24 +1,27 @@
 import os
 
 import click
-import matplotlib.pyplot as plt
 import numpy as np
-from cta_plots.ml.auc import plot_auc, plot_auc_per_type, plot_auc_vs_energy, plot_balanced_acc, plot_quick_auc
-from cta_plots.ml.prediction_hist import plot_quick_histogram
-import fact.io
+
+from cta_plots.profiling import profile_option, stage
+
+# plotting modules, matplotlib and fact are imported in the commands to keep `--help` fast
 
 
 def _apply_flags(ctx, ax, data=None):
+    import matplotlib.pyplot as plt
+
     if ctx.obj["YLIM"]:
         ax.set_ylim(ctx.obj["YLIM"])
 
 
     output = ctx.obj["OUTPUT"]
     if output:
-        plt.savefig(output)
-        if data is not None:
-            n, _ = os.path.splitext(output)
-            data.to_csv(n + '.csv', index=False, na_rep='NaN', )
+        with stage('save'):
+            plt.savefig(output)
+            if data is not None:
+                n, _ = os.path.splitext(output)
+                data.to_csv(n + '.csv', index=False, na_rep='NaN', )
     else:
         plt.show()
 
@@ -26,6 +29,8 @@ def _apply_flags(ctx, ax, data=None):
 
 
 def _load_predictions(gammas_path, protons_path):
+    import fact.io
+
     cols = ["gamma_prediction_mean", "array_event_id", "run_id"]
 
     gammas = fact.io.read_data(
@@ -38,8 +43,14 @@ def _load_predictions(gammas_path, protons_path):
     return gammas.gamma_prediction_mean, protons.gamma_prediction_mean
 
 
+# events with NaN in any of these columns are dropped
+TELESCOPE_DATA_COLUMNS = ["gamma_prediction_mean", "gamma_energy_prediction_mean", "array_event_id", "run_id", "total_intensity"]
+
+
 def _load_telescope_data(gammas_path, protons_path):
-    cols = ["gamma_prediction_mean", "gamma_energy_prediction_mean", "array_event_id", "run_id", "total_intensity"]
+    import fact.io
+
+    cols = TELESCOPE_DATA_COLUMNS
 
     gammas = fact.io.read_data(
         gammas_path, key="array_events", columns=cols
@@ -51,16 +62,28 @@ def _load_telescope_data(gammas_path, protons_path):
     return gammas, protons
 
 
+def _get_data(ctx):
+    if ctx.obj["GAMMAS"] is None:
+        with stage('load') as s:
+            gammas, protons = _load_telescope_data(ctx.obj["GAMMAS_PATH"], ctx.obj["PROTONS_PATH"])
+            s.n_events = len(gammas) + len(protons)
+        ctx.obj["GAMMAS"] = gammas
+        ctx.obj["PROTONS"] = protons
+    return ctx.obj["GAMMAS"], ctx.obj["PROTONS"]
+
+
 
 @click.group(invoke_without_command=True)
+@profile_option
 @click.argument("gammas", type=click.Path())
 @click.argument("protons", type=click.Path())
 @click.option("--debug/--no-debug", default=False)
 @click.option("--ylim", default=None, nargs=2, type=np.float)
 @click.option('-o', '--output', type=click.Path(exists=False))
 @click.option('-c', '--cuts_path', type=click.Path(exists=True))
+@click.option('--chunksize', default=None, type=int, help='Stream predictions in chunks of this many rows where possible')
 @click.pass_context
-def cli(ctx, gammas, protons, debug, ylim, output, cuts_path):
+def cli(ctx, gammas, protons, debug, ylim, output, cuts_path, chunksize):
     # ensure that ctx.obj exists and is a dict (in case `cli()` is called
     # by means other than the `if` block below
     # see https://click.palletsprojects.com/en/7.x/commands/#nested-handling-and-contexts
@@ -68,10 +91,14 @@ def cli(ctx, gammas, protons, debug, ylim, output, cuts_path):
     ctx.obj["DEBUG"] = debug
     ctx.obj["OUTPUT"] = output
     ctx.obj["YLIM"] = ylim
+    ctx.obj["CHUNKSIZE"] = chunksize
+    ctx.obj["GAMMAS_PATH"] = gammas
+    ctx.obj["PROTONS_PATH"] = protons
+    ctx.obj["GAMMAS"] = None
+    ctx.obj["PROTONS"] = None
 
-    gammas, protons = _load_telescope_data(gammas, protons)
-    ctx.obj["GAMMAS"] = gammas
-    ctx.obj["PROTONS"] = protons
+    # data is loaded by the subcommands on first use. When streaming only the
+    # subcommands which need the full tables load it.
 
     if debug and ctx.invoked_subcommand is None:
         click.echo("I was invoked without subcommand")
@@ -92,37 +119,51 @@ def cli(ctx, gammas, protons, debug, ylim, output, cuts_path):
 @click.option(
     "--e_reco/--no-e_reco", default=True, help="Whether to plot vs reconstructed energy"
 )
+@click.option("--bootstrap", default=0, help="Number of bootstrap replicas used for the error bars")
+@click.option("--n_jobs", default=4)
 @click.pass_context
-def auc_vs_energy(ctx, sample, e_reco,):
-    gammas = ctx.obj['GAMMAS']
-    protons = ctx.obj['PROTONS']
-    ax = plot_auc_vs_energy(gammas, protons, e_reco, sample)
+def auc_vs_energy(ctx, sample, e_reco, bootstrap, n_jobs):
+    from cta_plots.ml.auc import plot_auc_vs_energy
+
+    gammas, protons = _get_data(ctx)
+    ax = plot_auc_vs_energy(gammas, protons, e_reco, sample, n_bootstrap=bootstrap, n_jobs=n_jobs)
     _apply_flags(ctx, ax)
 
 
 @cli.command()
-@click.option("--box/--no-box", default=True)
+@click.option("--inset/--no-inset", default=False)
+@click.option("--bootstrap", default=0, help="Number of bootstrap replicas used for the confidence band")
+@click.option("--n_jobs", default=4)
 @click.pass_context
-def roc_acc(ctx, box):
-    gammas = ctx.obj['GAMMAS']
-    protons = ctx.obj['PROTONS']
-    gamma_prediction, protons_prediction = gammas.gamma_prediction_mean, protons.gamma_prediction_mean
-
-    fig, [ax1, ax2] = plt.subplots(1, 2, dpi=800)
-
-    cmap = 'plasma'
-    plot_quick_auc(gamma_prediction, protons_prediction, ax=ax1, cmap=cmap)
-
-    plot_balanced_acc(gamma_prediction, protons_prediction, ax=ax2, cmap=cmap)
+def auc(ctx, inset, bootstrap, n_jobs):
+    from cta_plots.ml.auc import plot_auc
+
+    gammas, protons = _get_data(ctx)
+    # array events carry the already aggregated prediction
+    gammas = gammas.rename(columns={'gamma_prediction_mean': 'gamma_prediction'})
+    protons = protons.rename(columns={'gamma_prediction_mean': 'gamma_prediction'})
+    ax = plot_auc(gammas, protons, what='single', inset=inset, n_bootstrap=bootstrap, n_jobs=n_jobs)
+    _apply_flags(ctx, ax)
 
-    ax1.set_ylim([-0.075, 1.075])
-    ax1.set_xlim([-0.075, 1.075])
 
-    ax2.set_ylim([-0.075, 1.075])
-    ax2.set_xlim([-0.075, 1.075])
+@cli.command()
+@click.option("--box/--no-box", default=True)
+@click.pass_context
+def roc_acc(ctx, box):
+    from cta_plots.ml.auc import plot_roc_acc
+    from cta_plots.ml.roc import BinnedROC
+
+    chunksize = ctx.obj['CHUNKSIZE']
+    if chunksize:
+        # the same events as in _load_telescope_data
+        roc = BinnedROC.from_files(
+            ctx.obj['GAMMAS_PATH'], ctx.obj['PROTONS_PATH'], chunksize=chunksize, dropna_columns=TELESCOPE_DATA_COLUMNS
+        )
+    else:
+        gammas, protons = _get_data(ctx)
+        roc = BinnedROC.from_predictions(gammas.gamma_prediction_mean.values, protons.gamma_prediction_mean.values)
 
-    plt.tight_layout(pad=0, rect=(-0.002, 0, 1.00, 1))
-    plt.subplots_adjust(wspace=0.23)
+    ax1, _ = plot_roc_acc(roc)
     _apply_flags(ctx, ax1)
 
 
@@ -130,8 +171,10 @@ def roc_acc(ctx, box):
 @click.option("--box/--no-box", default=True)
 @click.pass_context
 def hist(ctx, box,):
-    gammas = ctx.obj['GAMMAS']
-    protons = ctx.obj['PROTONS']
+    import matplotlib.pyplot as plt
+    from cta_plots.ml.prediction_hist import plot_quick_histogram
+
+    gammas, protons = _get_data(ctx)
     gamma_prediction, protons_prediction = gammas.gamma_prediction_mean, protons.gamma_prediction_mean
 
     ax = plot_quick_histogram(gamma_prediction, protons_prediction,)
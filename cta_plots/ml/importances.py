@@ -1,12 +1,17 @@
-from sklearn.calibration import CalibratedClassifierCV
-import pandas as pd
-from sklearn.externals import joblib
-import seaborn as sns
-import matplotlib.pyplot as plt
 import click
 
+from cta_plots.profiling import profile_option
+
+# sklearn, seaborn and matplotlib are imported where they are used to keep `--help` fast
+
 
 def plot_importances(model_path, color, ax=None):
+    from sklearn.calibration import CalibratedClassifierCV
+    from sklearn.externals import joblib
+    import pandas as pd
+    import seaborn as sns
+    import matplotlib.pyplot as plt
+
     model = joblib.load(model_path)
     feature_names = model.feature_names
 
@@ -54,11 +59,14 @@ def plot_importances(model_path, color, ax=None):
 
 
 @click.command()
+@profile_option
 @click.argument("model", type=click.Path())
 @click.option("-c", "--color", default="crimson")
 @click.option("--xlim", default=None, nargs=2, type=float)
 @click.option("-o", "--output")
 def main(model, color, xlim, output):
+    import matplotlib.pyplot as plt
+
     fig = plt.gcf()
     size = list(fig.get_size_inches())
     # print(size)
@@ -0,0 +1,307 @@
+import numpy as np
+
+
+class BinnedROC():
+    '''
+    Receiver operating characteristic computed from fixed, fine histograms of the classifier score.
+
+    Instead of sorting all events (as sklearn's roc_curve does) the scores of signal and background
+    events are filled into weighted histograms. The curve, the area under it and the balanced accuracy
+    are then derived from the cumulative counts. Filling is O(n) and the size of the curve
+    is bounded by the number of bins. Histograms can be filled chunk by chunk, so arbitrarily large
+    samples can be streamed from disk.
+
+    Ties within one score bin are treated like ties in the Mann-Whitney statistic, i.e. they count half.
+    With the default of 1000 bins the AUC agrees with the exact value to better than 1E-3
+    for classifier scores in [0, 1].
+    '''
+
+    def __init__(self, bins=1000, score_range=(0, 1)):
+        self.bin_edges = np.linspace(score_range[0], score_range[1], bins + 1)
+        self.signal = np.zeros(bins)
+        self.background = np.zeros(bins)
+
+    @property
+    def n_bins(self):
+        return len(self.bin_edges) - 1
+
+    def _bin_indices(self, scores):
+        low, high = self.bin_edges[0], self.bin_edges[-1]
+        idx = np.floor((scores - low) / (high - low) * self.n_bins).astype(np.int64)
+        # scores on the upper edge belong to the last bin
+        return np.clip(idx, 0, self.n_bins - 1)
+
+    def _histogram(self, scores, weights=None):
+        scores = np.asarray(scores, dtype=np.float64)
+        m = np.isfinite(scores)
+        if weights is not None:
+            weights = np.asarray(weights, dtype=np.float64)[m]
+        return np.bincount(self._bin_indices(scores[m]), weights=weights, minlength=self.n_bins)
+
+    def fill(self, signal_scores=None, background_scores=None, signal_weights=None, background_weights=None):
+        '''
+        Add scores (and optional weights) of signal and/or background events to the histograms.
+        Events with non finite scores are ignored. Returns self so calls can be chained.
+        '''
+        if signal_scores is not None:
+            self.signal += self._histogram(signal_scores, signal_weights)
+        if background_scores is not None:
+            self.background += self._histogram(background_scores, background_weights)
+        return self
+
+    @classmethod
+    def from_predictions(cls, signal_scores, background_scores, signal_weights=None, background_weights=None, bins=1000):
+        roc = cls(bins=bins)
+        return roc.fill(signal_scores, background_scores, signal_weights, background_weights)
+
+    @classmethod
+    def from_files(cls, gammas_path, protons_path, column='gamma_prediction_mean', chunksize=1000000, bins=1000, dropna_columns=()):
+        '''
+        Stream the predictions from the `array_events` group of both files in chunks of
+        `chunksize` rows. Only one chunk is held in memory at any time.
+        Events with NaN in any of the `dropna_columns` are skipped, like `.dropna()` on the loaded table.
+        '''
+        from cta_plots import read_chunked
+
+        columns = [column] + [c for c in dropna_columns if c != column]
+        roc = cls(bins=bins)
+        for chunk in read_chunked(gammas_path, key='array_events', columns=columns, chunksize=chunksize):
+            roc.fill(signal_scores=chunk.dropna()[column].values)
+        for chunk in read_chunked(protons_path, key='array_events', columns=columns, chunksize=chunksize):
+            roc.fill(background_scores=chunk.dropna()[column].values)
+        return roc
+
+    def roc_curve(self):
+        '''
+        Returns fpr, tpr and thresholds ordered by decreasing threshold, just like sklearn.metrics.roc_curve.
+        An event is selected by a threshold if its score is in a bin at or above the threshold.
+        '''
+        fpr, tpr = _rates(self.signal, self.background)
+        return fpr, tpr, self.bin_edges[::-1]
+
+    def auc(self):
+        return auc_from_histograms(self.signal, self.background)
+
+    def balanced_accuracy(self):
+        '''
+        Returns the balanced accuracy and the corresponding thresholds in increasing order.
+        '''
+        fpr, tpr, thresholds = self.roc_curve()
+        bacc = 0.5 * (tpr + 1 - fpr)
+        return bacc[::-1], thresholds[::-1]
+
+
+def _rates(signal, background):
+    # cumulative counts from the highest score bin down. leading zero for the threshold above all events.
+    zeros = np.zeros(signal.shape[:-1] + (1,))
+    tp = np.concatenate([zeros, np.cumsum(signal[..., ::-1], axis=-1)], axis=-1)
+    fp = np.concatenate([zeros, np.cumsum(background[..., ::-1], axis=-1)], axis=-1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        tpr = tp / tp[..., -1:]
+        fpr = fp / fp[..., -1:]
+    return fpr, tpr
+
+
+def auc_from_histograms(signal, background):
+    '''
+    Area under the ROC curve from binned score distributions.
+    Both arguments can have leading dimensions (e.g. one histogram per bootstrap replica),
+    the last axis is the score axis.
+    '''
+    fpr, tpr = _rates(np.asarray(signal, dtype=np.float64), np.asarray(background, dtype=np.float64))
+    return np.sum(np.diff(fpr, axis=-1) * 0.5 * (tpr[..., 1:] + tpr[..., :-1]), axis=-1)
+
+
+def tpr_at_fpr(signal, background, fpr_grid):
+    '''
+    True positive rate of binned ROC curves interpolated to the given false positive rates.
+    Leading dimensions of the histograms are kept.
+    '''
+    fpr, tpr = _rates(np.asarray(signal, dtype=np.float64), np.asarray(background, dtype=np.float64))
+    fpr, tpr = fpr.reshape(-1, fpr.shape[-1]), tpr.reshape(-1, tpr.shape[-1])
+    result = np.array([np.interp(fpr_grid, f, t) for f, t in zip(fpr, tpr)])
+    return result.reshape(np.shape(signal)[:-1] + (len(fpr_grid), ))
+
+
+def segmented_auc(
+    signal_scores,
+    background_scores,
+    signal_segments,
+    background_segments,
+    signal_weights=None,
+    background_weights=None,
+    signal_groups=None,
+    n_groups=None,
+):
+    '''
+    Area under the ROC curve for many independent segments (e.g. energy bins and telescope types)
+    computed from a single sort using the Mann-Whitney rank-sum statistic.
+
+    Every signal event is compared to the background events with the same segment code.
+    The per event statistics are summed up per `signal_groups` (defaults to the segment codes),
+    which allows comparing signal events binned in energy to background from all energies.
+
+    Parameters
+    ----------
+    signal_scores, background_scores : array
+        classifier scores
+    signal_segments, background_segments : array of non-negative int
+        segment codes of each event
+    signal_weights, background_weights : array, optional
+        event weights. Either shape (n_events,) or (n_replicas, n_events) to evaluate
+        many sets of weights (e.g. bootstrap replicas) with the same sort.
+    signal_groups : array of non-negative int, optional
+        codes by which to aggregate the signal events. Defaults to signal_segments.
+    n_groups : int, optional
+        number of groups in the output. Defaults to the largest group code + 1.
+
+    Returns
+    -------
+    array
+        AUC per group (with a leading replica axis for 2d weights). NaN for empty groups.
+    '''
+    signal_scores = np.asarray(signal_scores, dtype=np.float64)
+    background_scores = np.asarray(background_scores, dtype=np.float64)
+    n_signal = len(signal_scores)
+
+    if signal_groups is None:
+        signal_groups = signal_segments
+    signal_groups = np.asarray(signal_groups, dtype=np.int64)
+    if n_groups is None:
+        n_groups = signal_groups.max() + 1 if n_signal else 0
+
+    signal_weights = np.ones(n_signal) if signal_weights is None else np.asarray(signal_weights, dtype=np.float64)
+    background_weights = (
+        np.ones(len(background_scores)) if background_weights is None else np.asarray(background_weights, dtype=np.float64)
+    )
+    n_replicas = max(signal_weights.shape[:-1] + background_weights.shape[:-1], default=None)
+    if n_replicas is not None:
+        signal_weights = np.broadcast_to(signal_weights, (n_replicas, n_signal))
+        background_weights = np.broadcast_to(background_weights, (n_replicas, len(background_scores)))
+    weights = np.concatenate([signal_weights, background_weights], axis=-1)
+
+    scores = np.concatenate([signal_scores, background_scores])
+    segments = np.concatenate([signal_segments, background_segments]).astype(np.int64)
+    is_signal = np.zeros(len(scores), dtype=bool)
+    is_signal[:n_signal] = True
+
+    order = np.lexsort((scores, segments))
+    scores, segments, is_signal = scores[order], segments[order], is_signal[order]
+    weights = weights[..., order]
+
+    n = len(scores)
+    idx = np.arange(n)
+    new_segment = np.ones(n, dtype=bool)
+    new_segment[1:] = segments[1:] != segments[:-1]
+    new_run = new_segment.copy()
+    new_run[1:] |= scores[1:] != scores[:-1]
+
+    # for each position: where its segment and its run of tied scores start and end
+    segment_start = np.maximum.accumulate(np.where(new_segment, idx, 0))
+    segment_end = np.minimum.accumulate(np.where(np.append(new_segment[1:], True), idx + 1, n)[::-1])[::-1]
+    run_start = np.maximum.accumulate(np.where(new_run, idx, 0))
+    run_end = np.minimum.accumulate(np.where(np.append(new_run[1:], True), idx + 1, n)[::-1])[::-1]
+
+    background_weights = np.where(is_signal, 0, weights)
+    zeros = np.zeros(weights.shape[:-1] + (1,))
+    cumulative = np.concatenate([zeros, np.cumsum(background_weights, axis=-1)], axis=-1)
+
+    s = np.flatnonzero(is_signal)
+    less = cumulative[..., run_start[s]] - cumulative[..., segment_start[s]]
+    equal = cumulative[..., run_end[s]] - cumulative[..., run_start[s]]
+    total = cumulative[..., segment_end[s]] - cumulative[..., segment_start[s]]
+
+    w = weights[..., s]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        u = np.where(total > 0, w * (less + 0.5 * equal) / total, 0)
+    w = np.where(total > 0, w, 0)
+
+    groups = signal_groups[order[s]]
+    u = _grouped_sum(groups, u, n_groups)
+    w = _grouped_sum(groups, w, n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(w > 0, u / w, np.nan)
+
+
+def _grouped_sum(groups, values, n_groups):
+    if values.ndim == 1:
+        return np.bincount(groups, weights=values, minlength=n_groups)
+    n_replicas = values.shape[0]
+    codes = groups[np.newaxis, :] + n_groups * np.arange(n_replicas)[:, np.newaxis]
+    return np.bincount(codes.ravel(), weights=values.ravel(), minlength=n_groups * n_replicas).reshape(n_replicas, n_groups)
+
+
+def _segmented_auc_statistic(signal_weights, background_weights, *args, **kwargs):
+    return segmented_auc(*args, signal_weights=signal_weights, background_weights=background_weights, **kwargs)
+
+
+def bootstrap_segmented_auc(
+    signal_scores,
+    background_scores,
+    signal_segments,
+    background_segments,
+    signal_groups=None,
+    n_groups=None,
+    n_bootstrap=100,
+    batch_size=10,
+    n_jobs=4,
+    seed=0,
+):
+    '''
+    Poisson bootstrap of segmented_auc. Replicas are evaluated in batches sharing one sort.
+    See cta_plots.bootstrap.poisson_bootstrap.
+
+    Returns an array of shape (n_bootstrap, n_groups).
+    '''
+    from cta_plots.bootstrap import poisson_bootstrap
+
+    if signal_groups is None:
+        signal_groups = signal_segments
+    if n_groups is None:
+        n_groups = np.max(signal_groups) + 1
+
+    return poisson_bootstrap(
+        _segmented_auc_statistic,
+        (len(signal_scores), len(background_scores)),
+        args=(signal_scores, background_scores, signal_segments, background_segments),
+        kwargs={'signal_groups': signal_groups, 'n_groups': n_groups},
+        n_bootstrap=n_bootstrap,
+        batch_size=batch_size,
+        n_jobs=n_jobs,
+        seed=seed,
+    )
+
+
+def _binned_roc_statistic(signal_weights, background_weights, signal_idx, background_idx, n_bins):
+    signal = _grouped_sum(signal_idx, signal_weights.astype(np.float64), n_bins)
+    background = _grouped_sum(background_idx, background_weights.astype(np.float64), n_bins)
+    return np.stack([signal, background], axis=1)
+
+
+def bootstrap_binned_roc(signal_scores, background_scores, bins=1000, n_bootstrap=100, batch_size=20, n_jobs=4, seed=0):
+    '''
+    Poisson bootstrap of the binned ROC. The score bins are computed once, each replica only
+    needs a weighted bincount.
+
+    Returns the signal and background histograms of all replicas, each of shape (n_bootstrap, bins).
+    Use auc_from_histograms or BinnedROC to turn them into AUCs or curves.
+    '''
+    from cta_plots.bootstrap import poisson_bootstrap
+
+    roc = BinnedROC(bins=bins)
+    signal_scores = np.asarray(signal_scores, dtype=np.float64)
+    background_scores = np.asarray(background_scores, dtype=np.float64)
+    signal_scores = signal_scores[np.isfinite(signal_scores)]
+    background_scores = background_scores[np.isfinite(background_scores)]
+
+    histograms = poisson_bootstrap(
+        _binned_roc_statistic,
+        (len(signal_scores), len(background_scores)),
+        args=(roc._bin_indices(signal_scores), roc._bin_indices(background_scores), roc.n_bins),
+        n_bootstrap=n_bootstrap,
+        batch_size=batch_size,
+        n_jobs=n_jobs,
+        seed=seed,
+    )
+    return histograms[:, 0], histograms[:, 1]
@@ -0,0 +1,269 @@
+'''
+Stage level profiling for the command line tools.
+
+Processing steps are wrapped in `stage` blocks, which form a tree of timings:
+
+    with stage('load gammas') as s:
+        gammas = read_data(...)
+        s.n_events = len(gammas)
+
+Stages cost next to nothing unless profiling was started, which the `--profile` option
+added by `profile_option` does. Then a background thread samples the resident memory
+of the process so that each stage knows its peak RSS. At the end a summary table is printed
+and, if requested, a cProfile (.prof) or speedscope (.json) file is written.
+Time spent in joblib workers is attributed to the stage waiting for them,
+their memory is not included in the peak RSS. Stages entered from other threads are ignored.
+'''
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import click
+
+_PROFILER = None
+
+
+class Stage():
+    __slots__ = ('name', 'start', 'duration', 'peak_rss', 'n_events', 'children')
+
+    def __init__(self, name, start=0.0):
+        self.name = name
+        self.start = start
+        self.duration = 0.0
+        self.peak_rss = 0
+        self.n_events = None
+        self.children = []
+
+
+def current_rss():
+    '''
+    Resident set size of this process in bytes.
+    Falls back to the peak RSS on systems without /proc.
+    '''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on linux, bytes on macOS
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class Profiler():
+
+    def __init__(self, name, interval=0.01, cprofile=False):
+        self.interval = interval
+        self.t0 = time.perf_counter()
+        self.root = Stage(name)
+        self.stack = [self.root]
+        self.thread = threading.get_ident()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._cprofile = None
+        if cprofile:
+            import cProfile
+            self._cprofile = cProfile.Profile()
+
+    def _update_rss(self):
+        rss = current_rss()
+        for s in list(self.stack):
+            if rss > s.peak_rss:
+                s.peak_rss = rss
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self._update_rss()
+
+    def start(self):
+        self._update_rss()
+        self._sampler.start()
+        if self._cprofile:
+            self._cprofile.enable()
+
+    def stop(self):
+        if self._cprofile:
+            self._cprofile.disable()
+        self._stop.set()
+        self._sampler.join()
+        self._update_rss()
+        self.root.duration = time.perf_counter() - self.t0
+
+    def enter(self, name):
+        s = Stage(name, start=time.perf_counter() - self.t0)
+        self.stack[-1].children.append(s)
+        self.stack.append(s)
+        self._update_rss()
+        return s
+
+    def exit(self, s):
+        self._update_rss()
+        s.duration = time.perf_counter() - self.t0 - s.start
+        # stages are strictly nested, but be robust against stages left open by exceptions
+        while self.stack[-1] is not s:
+            self.stack.pop()
+        self.stack.pop()
+
+    def dump_stats(self, path):
+        self._cprofile.dump_stats(path)
+
+
+@contextmanager
+def stage(name, n_events=None):
+    '''
+    Record the time and peak memory of the enclosed block as a child of the current stage.
+    The yielded stage has an `n_events` attribute which can be set inside the block.
+    '''
+    profiler = _PROFILER
+    if profiler is None or threading.get_ident() != profiler.thread:
+        s = Stage(name)
+        s.n_events = n_events
+        yield s
+        return
+
+    s = profiler.enter(name)
+    s.n_events = n_events
+    try:
+        yield s
+    finally:
+        profiler.exit(s)
+
+
+def profiled(name):
+    '''
+    Decorator wrapping every call of the function in a stage.
+    '''
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def start_profiling(name, cprofile=False):
+    global _PROFILER
+    _PROFILER = Profiler(name, cprofile=cprofile)
+    _PROFILER.start()
+    return _PROFILER
+
+
+def stop_profiling():
+    global _PROFILER
+    profiler, _PROFILER = _PROFILER, None
+    if profiler is not None:
+        profiler.stop()
+    return profiler
+
+
+def _merged(stages):
+    '''
+    Merge sibling stages with the same name, e.g. stages called in a loop.
+    Returns a list of (name, calls, duration, peak_rss, n_events, children) in order of first appearance.
+    '''
+    merged = {}
+    for s in stages:
+        if s.name not in merged:
+            merged[s.name] = [s.name, 0, 0.0, 0, None, []]
+        m = merged[s.name]
+        m[1] += 1
+        m[2] += s.duration
+        m[3] = max(m[3], s.peak_rss)
+        if s.n_events is not None:
+            m[4] = (m[4] or 0) + s.n_events
+        m[5].extend(s.children)
+    return list(merged.values())
+
+
+def summary(root):
+    '''
+    Text table of the stage tree with total and self time, share of the total time,
+    peak RSS, number of events and number of calls.
+    '''
+    total = max(root.duration, 1e-12)
+    lines = [f"{'stage':<48} {'time/s':>9} {'self/s':>9} {'%':>6} {'peak RSS':>10} {'events':>11} {'calls':>6}"]
+
+    def add(entries, depth):
+        for name, calls, duration, peak_rss, n_events, children in entries:
+            children = _merged(children)
+            self_time = duration - sum(c[2] for c in children)
+            events = f'{n_events:,}' if n_events is not None else ''
+            lines.append(
+                f"{'  ' * depth + name:<48} {duration:9.3f} {self_time:9.3f} {100 * duration / total:6.1f}"
+                f" {peak_rss / 2**20:7.0f} MiB {events:>11} {calls:>6}"
+            )
+            add(children, depth + 1)
+
+    add(_merged([root]), 0)
+    return '\n'.join(lines)
+
+
+def to_speedscope(root):
+    '''
+    The stage tree as an evented profile in the speedscope file format (https://www.speedscope.app).
+    '''
+    frames, frame_index, events = [], {}, []
+
+    def add(s):
+        if s.name not in frame_index:
+            frame_index[s.name] = len(frames)
+            frames.append({'name': s.name})
+        events.append({'type': 'O', 'frame': frame_index[s.name], 'at': s.start})
+        for c in s.children:
+            add(c)
+        events.append({'type': 'C', 'frame': frame_index[s.name], 'at': s.start + s.duration})
+
+    add(root)
+    return {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'shared': {'frames': frames},
+        'profiles': [{
+            'type': 'evented',
+            'name': root.name,
+            'unit': 'seconds',
+            'startValue': 0,
+            'endValue': root.duration,
+            'events': events,
+        }],
+        'name': root.name,
+        'exporter': 'cta_plots.profiling',
+    }
+
+
+def _finish(output):
+    profiler = stop_profiling()
+    if profiler is None:
+        return
+    click.echo(summary(profiler.root), err=True)
+    if output and output.endswith('.json'):
+        with open(output, 'w') as f:
+            json.dump(to_speedscope(profiler.root), f)
+    elif output:
+        profiler.dump_stats(output)
+
+
+def profile_option(f):
+    '''
+    Add --profile and --profile_output options to a click command or group.
+    Has to be placed below the @click.command/@click.group decorator.
+    For groups the profile covers all invoked subcommands.
+    '''
+    @click.option(
+        '--profile_output', type=click.Path(dir_okay=False),
+        help='Write a cProfile (.prof) or speedscope (.json) file of the run. Implies --profile.',
+    )
+    @click.option('--profile', is_flag=True, default=False, help='Print time and peak memory of the processing stages.')
+    @functools.wraps(f)
+    def wrapper(*args, profile=False, profile_output=None, **kwargs):
+        if profile or profile_output:
+            ctx = click.get_current_context()
+            cprofile = profile_output is not None and not profile_output.endswith('.json')
+            start_profiling(ctx.command_path, cprofile=cprofile)
+            ctx.call_on_close(lambda: _finish(profile_output))
+        return f(*args, **kwargs)
+    return wrapper
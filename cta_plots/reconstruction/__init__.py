@@ -1,10 +1,11 @@
-import pandas as pd
-from pkg_resources import resource_string
 from io import BytesIO
 
 
 def load_energy_resolution_requirement(site='paranal'):
     path = 'ascii/CTA-Performance-prod3b-v1-South-20deg-50h-Eres.txt'
+    from pkg_resources import resource_string
+    import pandas as pd
+
     r = resource_string('cta_plots.resources', path)
     df = pd.read_csv(
         BytesIO(r), delimiter='\t\t', skiprows=11, names=['energy', 'resolution'], engine='python'
@@ -14,6 +15,9 @@ def load_energy_resolution_requirement(site='paranal'):
 
 def load_angular_resolution_requirement(site='paranal'):
     path = 'ascii/CTA-Performance-prod3b-v1-South-20deg-50h-Angres.txt'
+    from pkg_resources import resource_string
+    import pandas as pd
+
     r = resource_string('cta_plots.resources', path)
     df = pd.read_csv(
         BytesIO(r), delimiter='\t\t', skiprows=11, names=['energy', 'resolution'], engine='python'
@@ -23,6 +27,9 @@ def load_angular_resolution_requirement(site='paranal'):
 
 def load_energy_resolution_reference():
     path = 'ascii/CTA-Performance-prod3b-v1-South-20deg-50h-Eres.txt'
+    from pkg_resources import resource_string
+    import pandas as pd
+
     r = resource_string('cta_plots.resources', path)
     df = pd.read_csv(
         BytesIO(r), delimiter='\t\t', skiprows=9, names=['energy', 'resolution'], engine='python'
@@ -9,11 +9,12 @@ import astropy.units as u
 from cta_plots.colors import default_cmap, main_color, color_cycle
 from cta_plots.coordinate_utils import calculate_distance_to_true_source_position
 from cta_plots.binning import make_default_cta_binning
+from cta_plots.bootstrap import bootstrap_binned_percentile, confidence_interval
 from . import load_angular_resolution_requirement
 from .. import add_colorbar_to_figure
 
 
-def plot_angular_resolution(reconstructed_events, reference, plot_e_reco, ylog=False, ylim=None, ax=None):
+def plot_angular_resolution(reconstructed_events, reference, plot_e_reco, ylog=False, ylim=None, ax=None, n_bootstrap=0, n_jobs=4):
 
     df = reconstructed_events
     distance = calculate_distance_to_true_source_position(df)
@@ -30,6 +31,9 @@ def plot_angular_resolution(reconstructed_events, reference, plot_e_reco, ylog=F
     y = distance
 
     b_68, bin_edges, _ = binned_statistic(x, y, statistic=lambda y: np.nanpercentile(y, 68), bins=bins)
+    if n_bootstrap > 0:
+        replicas = bootstrap_binned_percentile(x, y.to_value(u.deg), bins.to_value(u.TeV), 68, n_bootstrap=n_bootstrap, n_jobs=n_jobs)
+        b_68_low, b_68_high = confidence_interval(replicas)
 
     bin_centers = np.sqrt(bin_edges[1:] * bin_edges[:-1])
     # bins_y = np.logspace(np.log10(0.005), np.log10(50.8), 100)
@@ -51,6 +55,8 @@ def plot_angular_resolution(reconstructed_events, reference, plot_e_reco, ylog=F
     # b_68[-1] = b_68[-2]
     # ax.step(bin_edges[:-1], b_68, where='post', lw=2, color=main_color, label='68\\textsuperscript{th} Percentile')
     ax.hlines(b_68, bins[:-1], bins[1:], lw=2, color=main_color, label='68\\textsuperscript{th} Percentile')
+    if n_bootstrap > 0:
+        ax.fill_between(bins, np.append(b_68_low, b_68_low[-1]), np.append(b_68_high, b_68_high[-1]), step='post', color=main_color, alpha=0.3, lw=0)
 
     if reference:
         df = load_angular_resolution_requirement()
@@ -69,6 +75,9 @@ def plot_angular_resolution(reconstructed_events, reference, plot_e_reco, ylog=F
         'energy_prediction': bin_centers,
         'angular_resolution': b_68,
     })
+    if n_bootstrap > 0:
+        df['angular_resolution_low'] = b_68_low
+        df['angular_resolution_high'] = b_68_high
     plt.tight_layout(pad=0, rect=(0, 0, 1.002, 1))
     return ax, df
 
@@ -5,13 +5,14 @@ import matplotlib.pyplot as plt
 from scipy.stats import binned_statistic
 from . import load_energy_resolution_reference
 from ..binning import make_default_cta_binning
+from ..bootstrap import bootstrap_binned_percentile, confidence_interval
 from matplotlib.colors import PowerNorm
 from cta_plots.colors import default_cmap, main_color, main_color_complement
 
 from .. import add_colorbar_to_figure
 
 
-def plot_resolution(e_true, e_reco, color='#5f218c', reference=False, method='cta', plot_e_reco=False, plot_bias=False, ax=None):
+def plot_resolution(e_true, e_reco, color='#5f218c', reference=False, method='cta', plot_e_reco=False, plot_bias=False, ax=None, n_bootstrap=0, n_jobs=4):
 
     if not ax:
         fig, ax = plt.subplots(1, 1)
@@ -30,6 +31,15 @@ def plot_resolution(e_true, e_reco, color='#5f218c', reference=False, method='ct
     elif method in ['absolute', 'cta']:
         iqr, _, _ = binned_statistic(e_x, resolution, statistic=lambda y: np.nanpercentile(np.abs(y), 68), bins=bins)
 
+    if n_bootstrap > 0:
+        edges = bins.to_value(u.TeV)
+        if method == 'relative':
+            replicas = bootstrap_binned_percentile(e_x, resolution, edges, [16, 84], n_bootstrap=n_bootstrap, n_jobs=n_jobs)
+            replicas = (replicas[..., 1] - replicas[..., 0]) / 2
+        else:
+            replicas = bootstrap_binned_percentile(e_x, np.abs(resolution), edges, 68, n_bootstrap=n_bootstrap, n_jobs=n_jobs)
+        iqr_low, iqr_high = confidence_interval(replicas)
+
 
 
     median, _, _ = binned_statistic(e_x, resolution, statistic=np.nanmedian, bins=bins)
@@ -47,6 +57,8 @@ def plot_resolution(e_true, e_reco, color='#5f218c', reference=False, method='ct
     add_colorbar_to_figure(im, fig, ax, label='Counts')
 
     ax.hlines(iqr, bins[:-1], bins[1:], lw=2, color=color, label='Resolution')
+    if n_bootstrap > 0:
+        ax.fill_between(bins, np.append(iqr_low, iqr_low[-1]), np.append(iqr_high, iqr_high[-1]), step='post', color=color, alpha=0.3, lw=0)
     
     if plot_bias:
         ax.hlines(median, bins[:-1], bins[1:], lw=1, color=color, label='Bias', alpha=0.8)
@@ -74,6 +86,9 @@ def plot_resolution(e_true, e_reco, color='#5f218c', reference=False, method='ct
         'median': median,
         'bias': median,
     })
+    if n_bootstrap > 0:
+        df['resolution_low'] = iqr_low
+        df['resolution_high'] = iqr_high
     plt.tight_layout(pad=0, rect=(-0.02, 0, 1.002, 1))
     return ax, df
 
@@ -2,18 +2,15 @@ import os
 
 import click
 import numpy as np
-import matplotlib.pyplot as plt
-import h5py
-from cta_plots import apply_cuts
-from cta_plots.reconstruction.angular_resolution import plot_angular_resolution, plot_angular_resolution_per_multiplicity
-from cta_plots.reconstruction.h_max import plot_h_max, plot_h_max_distance
-from cta_plots.reconstruction.impact import plot_impact, plot_impact_distance
-from cta_plots.reconstruction.energy import plot_resolution
-from cta_plots import load_signal_events, load_data_description
 from cta_plots.colors import main_color, default_cmap
+from cta_plots.profiling import profile_option, stage
+
+# plotting modules, matplotlib and h5py are imported in the commands to keep `--help` fast
 
 
 def _apply_flags(ctx, axs, data=None):
+    import matplotlib.pyplot as plt
+
     try:
         iter(axs)
     except TypeError:
@@ -49,22 +46,27 @@ def _apply_flags(ctx, axs, data=None):
 
     output = ctx.obj["OUTPUT"]
     if output:
-        plt.savefig(output)
-        if data is not None:
-            n, _ = os.path.splitext(output)
-            data.to_csv(n + '.csv', index=False, na_rep='NaN', )
+        with stage('save'):
+            plt.savefig(output)
+            if data is not None:
+                n, _ = os.path.splitext(output)
+                data.to_csv(n + '.csv', index=False, na_rep='NaN', )
     else:
         plt.show()
 
 
 
 def _column_exists(path, column, key):
+    import h5py
+
     with h5py.File(path, "r") as f:
         group = f.get(key)
         return column in group.keys()
 
 
-def _load_data(path, cuts_path=None, dropna=True):
+def _load_data(path, cuts_path=None, dropna=True, preview=None, seed=0):
+    from cta_plots import load_signal_events
+
     cols = [
         'mc_energy',
         'mc_alt',
@@ -88,15 +90,37 @@ def _load_data(path, cuts_path=None, dropna=True):
         if _column_exists(path, col, 'array_events'):
             cols.append(col)
 
-    df, _, _ = load_signal_events(path, calculate_weights=False, columns=cols) 
-    if dropna:
-        df.dropna(inplace=True)
+    df, _, _ = load_signal_events(path, calculate_weights=False, columns=cols, preview=preview, seed=seed)
+    # a single selection for incomplete events and cuts
+    selected = df.notna().all(axis=1).values if dropna else np.ones(len(df), dtype=bool)
     if cuts_path:
-        df = apply_cuts(df, cuts_path, theta_cuts=False, sigma=0)
+        from cta_plots.cuts import load_cuts
+        selected &= load_cuts(cuts_path, sigma=0).mask(df, theta=False)
+    if not selected.all():
+        df = df[selected]
     return df
 
 
+def _get_data(ctx):
+    if ctx.obj["DATA"] is None:
+        from cta_plots import load_data_description
+        from cta_plots.session import cached
+
+        path, cuts_path = ctx.obj["PATH"], ctx.obj["CUTS_PATH"]
+        with stage('load') as s:
+            data = cached(
+                _load_data, path, cuts_path=cuts_path, cache_dir=ctx.obj["CACHE_DIR"],
+                dropna=ctx.obj["DROPNA"], preview=ctx.obj["PREVIEW"], seed=ctx.obj["SEED"],
+            )
+            s.n_events = len(data)
+        ctx.obj["DATA"] = data
+        if ctx.obj["TAG"]:
+            ctx.obj["DESC"] = load_data_description(path, data, cuts_path=cuts_path)
+    return ctx.obj["DATA"]
+
+
 @click.group(invoke_without_command=True, chain=True)
+@profile_option
 @click.option("--debug/--no-debug", default=False)
 @click.option("--dropna/--no-dropna", default=True)
 @click.option("--legend/--no-legend", default=True)
@@ -105,9 +129,18 @@ def _load_data(path, cuts_path=None, dropna=True):
 @click.option("--ylim", default=None, nargs=2, type=np.float)
 @click.option('-o', '--output', type=click.Path(exists=False))
 @click.option('-c', '--cuts_path', type=click.Path(exists=True))
+@click.option(
+    '--cache_dir', type=click.Path(file_okay=False), envvar='CTA_PLOTS_CACHE',
+    help='Keep the loaded and cut events in this directory so later calls can memory map them instead of reading PATH again.'
+)
+@click.option(
+    '--preview', type=click.FloatRange(0, 1, min_open=True), default=None,
+    help='Use only this fraction of the events, selected in bins of true energy.'
+)
+@click.option('--seed', default=0, help='Seed for the --preview selection')
 @click.argument('path', type=click.Path(exists=True))
 @click.pass_context
-def cli(ctx, path, debug, dropna, legend, ylog, ylim, tag, cuts_path, output):
+def cli(ctx, path, debug, dropna, legend, ylog, ylim, tag, cuts_path, output, cache_dir, preview, seed):
     # ensure that ctx.obj exists and is a dict (in case `cli()` is called
     # by means other than the `if` block below
     # see https://click.palletsprojects.com/en/7.x/commands/#nested-handling-and-contexts
@@ -117,10 +150,16 @@ def cli(ctx, path, debug, dropna, legend, ylog, ylim, tag, cuts_path, output):
     ctx.obj["LEGEND"] = legend
     ctx.obj["YLIM"] = ylim
     ctx.obj["YLOG"] = ylog
-    data = _load_data(path, dropna=dropna, cuts_path=cuts_path)
-    ctx.obj["DATA"] = data
-    if tag:
-        ctx.obj["DESC"] = load_data_description(path, data, cuts_path=cuts_path)
+    ctx.obj["PATH"] = path
+    ctx.obj["CUTS_PATH"] = cuts_path
+    ctx.obj["DROPNA"] = dropna
+    ctx.obj["TAG"] = tag
+    ctx.obj["DESC"] = None
+    ctx.obj["CACHE_DIR"] = cache_dir
+    ctx.obj["PREVIEW"] = preview
+    ctx.obj["SEED"] = seed
+    # loaded once by the first (chained) subcommand
+    ctx.obj["DATA"] = None
 
     if debug and ctx.invoked_subcommand is None:
         print("I was invoked without subcommand")
@@ -131,12 +170,18 @@ def cli(ctx, path, debug, dropna, legend, ylog, ylim, tag, cuts_path, output):
 @cli.command()
 @click.option('--reference/--no-reference', default=False)
 @click.option('--plot_e_reco', is_flag=True, default=False)
+@click.option('--bootstrap', default=0, help='Number of bootstrap replicas used for the confidence band')
+@click.option('--n_jobs', default=4)
 @click.pass_context
-def angular_resolution(ctx, reference, plot_e_reco):
-    reconstructed_events = ctx.obj["DATA"]
+def angular_resolution(ctx, reference, plot_e_reco, bootstrap, n_jobs):
+    from cta_plots.reconstruction.angular_resolution import plot_angular_resolution
+
+    reconstructed_events = _get_data(ctx)
     ylog = ctx.obj["YLOG"]
     ylim = ctx.obj["YLIM"]
-    ax, df = plot_angular_resolution(reconstructed_events, reference, plot_e_reco, ylog=ylog, ylim=ylim)
+    ax, df = plot_angular_resolution(
+        reconstructed_events, reference, plot_e_reco, ylog=ylog, ylim=ylim, n_bootstrap=bootstrap, n_jobs=n_jobs
+    )
     _apply_flags(ctx, ax, data=df)
 
 
@@ -145,7 +190,9 @@ def angular_resolution(ctx, reference, plot_e_reco):
 @click.option('--plot_e_reco', is_flag=True, default=False)
 @click.pass_context
 def angular_resolution_multiplicity(ctx, reference, plot_e_reco):
-    reconstructed_events = ctx.obj["DATA"]
+    from cta_plots.reconstruction.angular_resolution import plot_angular_resolution_per_multiplicity
+
+    reconstructed_events = _get_data(ctx)
     ax = plot_angular_resolution_per_multiplicity(reconstructed_events, reference, plot_e_reco)
     _apply_flags(ctx, ax)
 
@@ -155,7 +202,9 @@ def angular_resolution_multiplicity(ctx, reference, plot_e_reco):
 @click.option('--cmap', default=default_cmap)
 @click.pass_context
 def h_max(ctx, color, cmap):
-    reconstructed_events = ctx.obj["DATA"]
+    from cta_plots.reconstruction.h_max import plot_h_max
+
+    reconstructed_events = _get_data(ctx)
     ax = plot_h_max(reconstructed_events, color=color, colormap=cmap)
     _apply_flags(ctx, ax)
 
@@ -166,7 +215,9 @@ def h_max(ctx, color, cmap):
 @click.option('--cmap', default=default_cmap)
 @click.pass_context
 def h_max_distance(ctx, color, cmap):
-    reconstructed_events = ctx.obj["DATA"]
+    from cta_plots.reconstruction.h_max import plot_h_max_distance
+
+    reconstructed_events = _get_data(ctx)
     ax = plot_h_max_distance(reconstructed_events, color=color, colormap=cmap)
     _apply_flags(ctx, ax)
 
@@ -176,7 +227,9 @@ def h_max_distance(ctx, color, cmap):
 @click.option('--cmap', default=default_cmap)
 @click.pass_context
 def impact(ctx, color, cmap):
-    reconstructed_events = ctx.obj["DATA"]
+    from cta_plots.reconstruction.impact import plot_impact
+
+    reconstructed_events = _get_data(ctx)
     ax = plot_impact(reconstructed_events, color=color, colormap=cmap)
     _apply_flags(ctx, ax)
 
@@ -186,7 +239,9 @@ def impact(ctx, color, cmap):
 @click.option('--cmap', default=default_cmap)
 @click.pass_context
 def impact_distance(ctx, color, cmap):
-    reconstructed_events = ctx.obj["DATA"]
+    from cta_plots.reconstruction.impact import plot_impact_distance
+
+    reconstructed_events = _get_data(ctx)
     ax = plot_impact_distance(reconstructed_events, color=color, colormap=cmap)
     _apply_flags(ctx, ax)
 
@@ -197,14 +252,20 @@ def impact_distance(ctx, color, cmap):
 @click.option('--method', default='relative', type=click.Choice(['cta', 'relative', 'absolute']))
 @click.option('--plot_e_reco', is_flag=True, default=False)
 @click.option('--plot_bias', is_flag=True, default=False)
+@click.option('--bootstrap', default=0, help='Number of bootstrap replicas used for the confidence band')
+@click.option('--n_jobs', default=4)
 @click.pass_context
-def energy_resolution(ctx, reference, method, plot_e_reco, plot_bias):
+def energy_resolution(ctx, reference, method, plot_e_reco, plot_bias, bootstrap, n_jobs):
+    from cta_plots.reconstruction.energy import plot_resolution
 
-    reconstructed_events = ctx.obj['DATA']
+    reconstructed_events = _get_data(ctx)
 
     e_true = reconstructed_events.mc_energy
     e_reco = reconstructed_events.gamma_energy_prediction_mean
-    ax, df = plot_resolution(e_true, e_reco, reference=reference, method=method, plot_e_reco=plot_e_reco, plot_bias=plot_bias)
+    ax, df = plot_resolution(
+        e_true, e_reco, reference=reference, method=method, plot_e_reco=plot_e_reco, plot_bias=plot_bias,
+        n_bootstrap=bootstrap, n_jobs=n_jobs,
+    )
     ctx.obj["YLOG"] = False
     _apply_flags(ctx, ax, data=df)
 
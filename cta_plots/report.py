@@ -0,0 +1,379 @@
+'''
+Render many plots from one set of input files.
+
+The report is described by a YAML or TOML file like
+
+    output_dir: build/report
+    format: pdf
+    n_jobs: 8
+    inputs:
+      gammas: gammas_diffuse.h5
+      gammas_pointlike: gammas_pointlike.h5  # for the sensitivity, defaults to gammas
+      protons: protons.h5
+      electrons: electrons.h5
+      cuts: cuts.csv
+      t_obs: 50  # hours, used for the event weights
+      preview: 0.1  # optional, use 10 percent of the events (see cta_plots.preview_selection)
+      seed: 0
+    plots:
+      - plot: angular_resolution
+        options: {bootstrap: 100}
+      - plot: energy_resolution
+        name: energy_bias
+        options: {plot_bias: true}
+      - plot: sensitivity
+
+Every input table is loaded once in the main process. The plots are then rendered by
+forked worker processes (Agg backend) which share the loaded tables copy-on-write.
+A manifest.json with load and render timings is written to the output directory.
+'''
+import json
+import os
+import time
+import traceback
+
+import click
+
+from cta_plots.profiling import profile_option, stage
+
+
+def read_config(path):
+    _, ext = os.path.splitext(path)
+    if ext == '.toml':
+        try:
+            import tomllib
+        except ImportError:
+            # python < 3.11, the toml package reads text
+            try:
+                import toml
+            except ImportError:
+                raise click.ClickException('Reading toml configs requires python >= 3.11 or toml. Install it or use a yaml config.')
+            with open(path) as f:
+                return toml.load(f)
+        with open(path, 'rb') as f:
+            return tomllib.load(f)
+    if ext in ('.yml', '.yaml'):
+        try:
+            import yaml
+        except ImportError:
+            raise click.ClickException('Reading yaml configs requires pyyaml. Install it or use a toml config.')
+        with open(path) as f:
+            return yaml.safe_load(f)
+    raise click.ClickException(f'Unknown config format {ext}. Use .yaml, .yml or .toml')
+
+
+def _load_reco(store):
+    from cta_plots.reconstruction.reco_cli import _load_data
+    return _load_data(
+        store.inputs['gammas'], cuts_path=store.inputs.get('cuts'),
+        preview=store.inputs.get('preview'), seed=store.inputs.get('seed', 0)
+    )
+
+
+def _load_predictions(store):
+    from cta_plots.ml.classifier_cli import _load_telescope_data
+    return _load_telescope_data(store.inputs['gammas'], store.inputs['protons'])
+
+
+def _load_selected_gammas(store):
+    from cta_plots.sensitivity.effective_area import load_selected_gammas
+    return load_selected_gammas(store.inputs['gammas'], store.inputs.get('cuts'))
+
+
+def _load_runs(store):
+    from cta_plots import load_runs
+    return load_runs(store.inputs['gammas'])
+
+
+def _load_signal(store):
+    import astropy.units as u
+    from cta_plots import load_signal_events
+    path = store.inputs.get('gammas_pointlike', store.inputs['gammas'])
+    return load_signal_events(
+        path, assumed_obs_time=store.inputs.get('t_obs', 50) * u.h,
+        preview=store.inputs.get('preview'), seed=store.inputs.get('seed', 0)
+    )
+
+
+def _load_background(store):
+    import astropy.units as u
+    from cta_plots import load_background_events
+
+    _, source_alt, source_az = store.get('signal')
+    return load_background_events(
+        store.inputs['protons'], store.inputs['electrons'], source_alt, source_az,
+        assumed_obs_time=store.inputs.get('t_obs', 50) * u.h,
+        preview=store.inputs.get('preview'), seed=store.inputs.get('seed', 0)
+    )
+
+
+LOADERS = {
+    'reco': _load_reco,
+    'predictions': _load_predictions,
+    'selected_gammas': _load_selected_gammas,
+    'runs': _load_runs,
+    'signal': _load_signal,
+    'background': _load_background,
+}
+
+
+class EventStore():
+    '''
+    Loads each dataset needed by the report once and keeps it in memory.
+    '''
+
+    def __init__(self, inputs):
+        self.inputs = inputs
+        self.timings = {}
+        self._data = {}
+
+    def get(self, name):
+        if name not in self._data:
+            start = time.perf_counter()
+            with stage(f'load {name}'):
+                self._data[name] = LOADERS[name](self)
+            self.timings[name] = time.perf_counter() - start
+        return self._data[name]
+
+
+def _angular_resolution(store, reference=False, plot_e_reco=False, bootstrap=0, n_jobs=1, ylog=True, ylim=None):
+    from cta_plots.reconstruction.angular_resolution import plot_angular_resolution
+    return plot_angular_resolution(
+        store.get('reco'), reference, plot_e_reco, ylog=ylog, ylim=ylim, n_bootstrap=bootstrap, n_jobs=n_jobs
+    )
+
+
+def _angular_resolution_multiplicity(store, reference=False, plot_e_reco=False):
+    from cta_plots.reconstruction.angular_resolution import plot_angular_resolution_per_multiplicity
+    return plot_angular_resolution_per_multiplicity(store.get('reco'), reference, plot_e_reco), None
+
+
+def _energy_resolution(store, reference=False, method='relative', plot_e_reco=False, plot_bias=False, bootstrap=0, n_jobs=1):
+    from cta_plots.reconstruction.energy import plot_resolution
+
+    events = store.get('reco')
+    return plot_resolution(
+        events.mc_energy, events.gamma_energy_prediction_mean, reference=reference, method=method,
+        plot_e_reco=plot_e_reco, plot_bias=plot_bias, n_bootstrap=bootstrap, n_jobs=n_jobs,
+    )
+
+
+def _h_max(store, **kwargs):
+    from cta_plots.reconstruction.h_max import plot_h_max
+    return plot_h_max(store.get('reco'), **kwargs), None
+
+
+def _h_max_distance(store, **kwargs):
+    from cta_plots.reconstruction.h_max import plot_h_max_distance
+    return plot_h_max_distance(store.get('reco'), **kwargs), None
+
+
+def _impact(store, **kwargs):
+    from cta_plots.reconstruction.impact import plot_impact
+    return plot_impact(store.get('reco'), **kwargs), None
+
+
+def _impact_distance(store, **kwargs):
+    from cta_plots.reconstruction.impact import plot_impact_distance
+    return plot_impact_distance(store.get('reco'), **kwargs), None
+
+
+def _auc(store, inset=False, bootstrap=0, n_jobs=1):
+    from cta_plots.ml.auc import plot_auc
+
+    gammas, protons = store.get('predictions')
+    gammas = gammas.rename(columns={'gamma_prediction_mean': 'gamma_prediction'})
+    protons = protons.rename(columns={'gamma_prediction_mean': 'gamma_prediction'})
+    return plot_auc(gammas, protons, what='single', inset=inset, n_bootstrap=bootstrap, n_jobs=n_jobs), None
+
+
+def _auc_vs_energy(store, e_reco=True, sample=True, bootstrap=0, n_jobs=1):
+    from cta_plots.ml.auc import plot_auc_vs_energy
+
+    gammas, protons = store.get('predictions')
+    return plot_auc_vs_energy(gammas, protons, e_reco, sample, n_bootstrap=bootstrap, n_jobs=n_jobs), None
+
+
+def _roc_acc(store, cmap='plasma'):
+    from cta_plots.ml.auc import plot_roc_acc
+    from cta_plots.ml.roc import BinnedROC
+
+    gammas, protons = store.get('predictions')
+    roc = BinnedROC.from_predictions(gammas.gamma_prediction_mean.values, protons.gamma_prediction_mean.values)
+    ax, _ = plot_roc_acc(roc, cmap=cmap)
+    return ax, None
+
+
+def _prediction_hist(store):
+    from cta_plots.ml.prediction_hist import plot_quick_histogram
+
+    gammas, protons = store.get('predictions')
+    ax = plot_quick_histogram(gammas.gamma_prediction_mean, protons.gamma_prediction_mean)
+    ax.legend()
+    return ax, None
+
+
+def _effective_area(store, reference=True, cmap='magma'):
+    from cta_plots.sensitivity.effective_area import plot_effective_area
+
+    gammas, selected = store.get('selected_gammas')
+    ax = plot_effective_area(
+        gammas, store.get('runs'), cuts_path=store.inputs.get('cuts'), reference=reference, cmap=cmap, selected=selected
+    )
+    return ax, None
+
+
+def _sensitivity(store, color='xkcd:purple', reference=False, requirement=False, flux=True, fix_theta=False, correct_bias=True, n_jobs=1):
+    from cta_plots.sensitivity.sensitivity import calculate_sensitivity, plot_sensitivity_curve
+
+    gammas, _, _ = store.get('signal')
+    df, bin_edges, bin_center = calculate_sensitivity(
+        gammas, store.get('background'), fix_theta=fix_theta, correct_bias=correct_bias, n_jobs=n_jobs,
+        seed=store.inputs.get('seed', 0),
+    )
+    ax = plot_sensitivity_curve(df, bin_edges, bin_center, color=color, reference=reference, requirement=requirement, flux=flux)
+    return ax, df
+
+
+# plot name -> (function, datasets loaded before the workers are started)
+PLOTS = {
+    'angular_resolution': (_angular_resolution, ['reco']),
+    'angular_resolution_multiplicity': (_angular_resolution_multiplicity, ['reco']),
+    'energy_resolution': (_energy_resolution, ['reco']),
+    'h_max': (_h_max, ['reco']),
+    'h_max_distance': (_h_max_distance, ['reco']),
+    'impact': (_impact, ['reco']),
+    'impact_distance': (_impact_distance, ['reco']),
+    'auc': (_auc, ['predictions']),
+    'auc_vs_energy': (_auc_vs_energy, ['predictions']),
+    'roc_acc': (_roc_acc, ['predictions']),
+    'prediction_hist': (_prediction_hist, ['predictions']),
+    'effective_area': (_effective_area, ['selected_gammas', 'runs']),
+    'sensitivity': (_sensitivity, ['signal', 'background']),
+}
+
+# set in the main process before forking so the workers inherit the loaded tables
+_STORE = None
+
+
+def render_plot(spec, output_dir, file_format):
+    '''
+    Render a single plot described by a config entry and save it.
+    Returns the manifest entry for this plot. Errors are recorded instead of raised.
+    '''
+    import matplotlib.pyplot as plt
+
+    name = spec.get('name', spec['plot'])
+    output = os.path.join(output_dir, f'{name}.{file_format}')
+    entry = {'name': name, 'plot': spec['plot'], 'output': output, 'pid': os.getpid()}
+
+    start = time.perf_counter()
+    try:
+        # only recorded when rendering in the main process (-j 1)
+        with stage(name):
+            _render(spec, output, entry)
+        entry['status'] = 'ok'
+    except Exception:
+        entry['status'] = 'failed'
+        entry['error'] = traceback.format_exc()
+    finally:
+        plt.close('all')
+    entry['seconds'] = time.perf_counter() - start
+    return entry
+
+
+def _render(spec, output, entry):
+    import matplotlib.pyplot as plt
+
+    function, _ = PLOTS[spec['plot']]
+    plt.figure()
+    ax, df = function(_STORE, **spec.get('options', {}))
+    if spec.get('ylim'):
+        ax.set_ylim(spec['ylim'])
+    plt.savefig(output)
+    if df is not None:
+        n, _ = os.path.splitext(output)
+        df.to_csv(n + '.csv', index=False, na_rep='NaN')
+        entry['csv'] = n + '.csv'
+
+
+def _render_in_worker(args):
+    return render_plot(*args)
+
+
+def run_report(config, n_jobs=None):
+    '''
+    Load the inputs once, render all plots and write the manifest. Returns the manifest.
+    '''
+    import matplotlib
+    matplotlib.use('Agg')
+    import multiprocessing
+
+    global _STORE
+
+    output_dir = config.get('output_dir', 'report')
+    file_format = config.get('format', 'pdf')
+    n_jobs = n_jobs or config.get('n_jobs', 4)
+    specs = config['plots']
+    os.makedirs(output_dir, exist_ok=True)
+
+    for spec in specs:
+        if spec['plot'] not in PLOTS:
+            raise click.ClickException(f'Unknown plot {spec["plot"]}. Known plots: {", ".join(PLOTS)}')
+
+    start = time.perf_counter()
+    _STORE = EventStore(config['inputs'])
+    for spec in specs:
+        for dataset in PLOTS[spec['plot']][1]:
+            _STORE.get(dataset)
+    load_time = time.perf_counter() - start
+
+    tasks = [(spec, output_dir, file_format) for spec in specs]
+    if n_jobs == 1:
+        entries = [_render_in_worker(t) for t in tasks]
+    else:
+        with multiprocessing.get_context('fork').Pool(n_jobs) as pool:
+            entries = pool.map(_render_in_worker, tasks, chunksize=1)
+
+    manifest = {
+        'inputs': config['inputs'],
+        'n_jobs': n_jobs,
+        'load_seconds': load_time,
+        'loads': _STORE.timings,
+        'total_seconds': time.perf_counter() - start,
+        'plots': entries,
+    }
+    with open(os.path.join(output_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+@click.command()
+@profile_option
+@click.argument('config_path', type=click.Path(exists=True))
+@click.option('-j', '--n_jobs', type=int, default=None, help='Number of worker processes. Overrides the config.')
+@click.option('--list', 'list_plots', is_flag=True, default=False, help='List the available plots and exit.')
+def main(config_path, n_jobs, list_plots):
+    '''
+    Render all plots listed in the YAML or TOML config at CONFIG_PATH.
+    '''
+    if list_plots:
+        for name, (_, datasets) in PLOTS.items():
+            click.echo(f'{name:<34} {", ".join(datasets)}')
+        return
+
+    config = read_config(config_path)
+    manifest = run_report(config, n_jobs=n_jobs)
+
+    for entry in manifest['plots']:
+        click.echo(f"{entry['name']:<34} {entry['status']:<7} {entry['seconds']:.2f}s")
+    click.echo(f"loading {manifest['load_seconds']:.2f}s, total {manifest['total_seconds']:.2f}s")
+
+    failed = [e for e in manifest['plots'] if e['status'] != 'ok']
+    if failed:
+        raise click.ClickException(f'{len(failed)} plot(s) failed, see manifest.json')
+
+
+if __name__ == '__main__':
+    # pylint: disable=no-value-for-parameter
+    main()
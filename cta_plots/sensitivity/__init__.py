@@ -1,10 +1,6 @@
 from io import BytesIO
-from pkg_resources import resource_string
 
-import pandas as pd
 import numpy as np
-from fact.analysis import li_ma_significance
-from scipy.optimize import minimize_scalar
 from tqdm import tqdm
 
 
@@ -13,6 +9,9 @@ def load_effective_area_reference(site='paranal', cuts_applied=False):
         path = 'ascii/CTA-Performance-prod3b-v1-South-20deg-50h-EffArea.txt'
     else:
         path = 'ascii/CTA-Performance-prod3b-v1-South-20deg-50h-EffAreaNoDirectionCut.txt'
+    from pkg_resources import resource_string
+    import pandas as pd
+
     r = resource_string('cta_plots.resources', path)
     df = pd.read_csv(
         BytesIO(r), delimiter='\t\t', skiprows=11, names=['energy', 'effective_area'], engine='python'
@@ -22,6 +21,9 @@ def load_effective_area_reference(site='paranal', cuts_applied=False):
 
 def load_sensitivity_reference():
     path = '/ascii/CTA-Performance-prod3b-v1-South-20deg-50h-DiffSens.txt'
+    from pkg_resources import resource_string
+    import pandas as pd
+
     r = resource_string('cta_plots.resources', path)
     df = pd.read_csv(
         BytesIO(r), delimiter='\t\t', skiprows=10, names=['e_min', 'e_max', 'sensitivity'], engine='python'
@@ -31,6 +33,9 @@ def load_sensitivity_reference():
 
 def load_sensitivity_requirement():
     path = 'sensitivity_requirement_south_50.txt'
+    from pkg_resources import resource_string
+    import pandas as pd
+
     r = resource_string('cta_plots.resources', path)
     df = pd.read_csv(
         BytesIO(r),
@@ -102,11 +107,13 @@ def calculate_n_off(background_events, theta_cut, alpha=0.2,):
 
 
 def calculate_significance(signal_events, background_events, theta_cut, alpha=0.2):
+    from cta_plots.statistics import li_ma_significance
+
     n_on, _, n_off, _ = calculate_n_on_n_off(signal_events, background_events, theta_cut, alpha=alpha)
     return li_ma_significance(n_on, n_off, alpha=alpha)
 
 
-def calculate_relative_sensitivity(signal_events, background_events, theta_cut, alpha=0.2):
+def calculate_relative_sensitivity(signal_events, background_events, theta_cut, alpha=0.2, return_validity=False):
     '''
     Calculates the relative sensitivity for the given signal and background. 
     Return np.inf in case check_validity() returns false for the input.
@@ -121,6 +128,8 @@ def calculate_relative_sensitivity(signal_events, background_events, theta_cut,
         signal regions to iterate over
     alpha : float, optional
         assumed ratio between signal and background region
+    return_validity : bool, optional
+        also return the results of check_validity() and check_validity_counts()
     Returns
     -------
     float
@@ -131,14 +140,17 @@ def calculate_relative_sensitivity(signal_events, background_events, theta_cut,
     n_off, n_off_count, total_bkg_counts = calculate_n_off(background_events, theta_cut, alpha=alpha)
 
     
-    valid = check_validity(n_signal, n_off, alpha=alpha)
-    valid &= check_validity_counts(n_signal_count, n_off_count, total_bkg_counts, alpha=alpha)
+    valid_weighted = check_validity(n_signal, n_off, alpha=alpha)
+    valid_counts = check_validity_counts(n_signal_count, n_off_count, total_bkg_counts, alpha=alpha)
 
-    if valid:
+    if valid_weighted & valid_counts:
         relative_sensitivity = find_relative_sensitivity(n_signal, n_off, alpha=alpha)
-        return relative_sensitivity
     else:
-        return np.inf
+        relative_sensitivity = np.inf
+
+    if return_validity:
+        return relative_sensitivity, valid_weighted, valid_counts
+    return relative_sensitivity
 
 
 
@@ -213,6 +225,8 @@ def find_cuts_for_best_sensitivity(
 
 
 def _target(scaling_factor, n_signal, n_background, alpha=0.2, sigma=5):
+    from cta_plots.statistics import li_ma_significance
+
     n_on = n_background * alpha + n_signal * scaling_factor
     n_off = n_background
 
@@ -243,6 +257,8 @@ def find_relative_sensitivity(n_signal, n_background, alpha=0.2, target_sigma=5)
 
     '''
 
+    from scipy.optimize import minimize_scalar
+
     right_bound = 100
     result = minimize_scalar(
         _target, args=(n_signal, n_background, alpha, target_sigma), bounds=(0, right_bound), method='bounded'
@@ -252,7 +268,7 @@ def find_relative_sensitivity(n_signal, n_background, alpha=0.2, target_sigma=5)
     return result
 
 
-def find_relative_sensitivity_poisson(n_signal, n_background, t_signal, t_background, alpha=0.2, target_sigma=5, N=300):
+def find_relative_sensitivity_poisson(n_signal, n_background, t_signal, t_background, alpha=0.2, target_sigma=5, N=300, rng=None):
     '''
     Given number of signal events and background events, both weighted and unweighted, calculates the 
     factor by which to scale the number of signals to reach the required detection significance. 
@@ -278,6 +294,8 @@ def find_relative_sensitivity_poisson(n_signal, n_background, t_signal, t_backgr
         Target detection level to reach (the default is 5)
     N : int, optional
         Number of repititions for error calculation (the default is 300)
+    rng : np.random.Generator, SeedSequence or int, optional
+        source of the Poisson samples, fresh entropy if None
 
     Returns
     -------
@@ -286,10 +304,13 @@ def find_relative_sensitivity_poisson(n_signal, n_background, t_signal, t_backgr
 
     '''
 
+    from scipy.optimize import minimize_scalar
+
     right_bound = 100
 
-    n_signal = np.random.poisson(n_signal, size=N)
-    n_background = np.random.poisson(n_background, size=N) 
+    rng = np.random.default_rng(rng)
+    n_signal = rng.poisson(n_signal, size=N)
+    n_background = rng.poisson(n_background, size=N)
 
     hs = []
     for signal, background in zip(n_signal, n_background):
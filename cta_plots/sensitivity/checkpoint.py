@@ -0,0 +1,103 @@
+'''
+Checkpoints for the optimization of the event selection in bins of estimated energy.
+
+The result of each bin is appended to a JSON lines file as soon as it is available.
+The first line holds a hash of the inputs and the configuration. A later run with the same
+hash reuses the stored bins, a run with a different one starts a new checkpoint.
+A line cut off by a crash is ignored.
+'''
+import hashlib
+import json
+import os
+
+from colorama import Fore
+
+
+def checkpoint_key(input_paths, **config):
+    '''
+    Hash of the input files (path, size and modification time) and the configuration.
+    '''
+    from cta_plots.session import session_key
+
+    description = {'inputs': [session_key(p) for p in input_paths], 'config': config}
+    return hashlib.sha1(json.dumps(description, sort_keys=True, default=repr).encode()).hexdigest()
+
+
+class Checkpoint():
+    '''
+    Results of finished energy bins, stored in `path`.
+    `results` maps the bin index to the stored record.
+    '''
+
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+        self.results = {}
+
+        if os.path.exists(path):
+            header, records = _read(path)
+            if header.get('key') == key:
+                self.results = {r['bin']: r for r in records}
+                print(Fore.YELLOW + f'Resuming from {path}: {len(self.results)} bins done' + Fore.RESET)
+            else:
+                records = []
+                print(Fore.YELLOW + f'Inputs or configuration changed, starting a new checkpoint in {path}' + Fore.RESET)
+        else:
+            records = []
+
+        # rewrite without an incomplete last line so new records can be appended
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(json.dumps({'key': key}) + '\n')
+            for r in records:
+                f.write(json.dumps(r) + '\n')
+        os.replace(tmp, path)
+
+    def get(self, i, e_low, e_high):
+        '''
+        The stored record of bin i or None. Records for different bin edges are not reused.
+        '''
+        r = self.results.get(i)
+        if r is None or not (_close(r['e_min'], e_low) and _close(r['e_max'], e_high)):
+            return None
+        return r
+
+    def add(self, i, e_low, e_high, cuts, telemetry=None):
+        record = {'bin': i, 'e_min': float(e_low), 'e_max': float(e_high), 'cuts': cuts, 'telemetry': telemetry}
+        # round trip so the stored record is identical to what a resumed run reads
+        line = json.dumps(record, default=_to_builtin)
+        self.results[i] = json.loads(line)
+        with open(self.path, 'a') as f:
+            f.write(line + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        return self.results[i]
+
+
+def _close(a, b):
+    return abs(a - b) <= 1e-9 * max(abs(a), abs(b))
+
+
+def _to_builtin(value):
+    if hasattr(value, 'item'):
+        return value.item()
+    return float(value)
+
+
+def _read(path):
+    with open(path) as f:
+        lines = f.read().splitlines()
+
+    records = []
+    for line in lines[1:]:
+        try:
+            records.append(json.loads(line))
+        except json.JSONDecodeError:
+            # incomplete last line
+            break
+
+    try:
+        header = json.loads(lines[0]) if lines else {}
+    except json.JSONDecodeError:
+        header = {}
+    return header, records
@@ -1,51 +1,53 @@
 import click
-import matplotlib.pyplot as plt
 import numpy as np
 
-from astropy.stats import binom_conf_interval
-import astropy.units as u
-import pandas as pd
-# from scipy.interpolate import interp1d
-from matplotlib import cm
-
-from cta_plots.binning import make_default_cta_binning
 from cta_plots.sensitivity import load_effective_area_reference
-from cta_plots.spectrum import MCSpectrum
 from cta_plots.colors import color_cycle
-from cta_plots import load_signal_events, apply_cuts, load_runs, load_data_description, create_interpolated_function
+from cta_plots import load_signal_events, load_runs, load_data_description
+from cta_plots.profiling import profile_option, stage
 
+# pandas, astropy and matplotlib are imported where they are used to keep `--help` fast
 
-def prediction_function(cuts_path, sigma=0):
-    cuts = pd.read_csv(cuts_path)
-    bin_center = np.sqrt(cuts.e_min * cuts.e_max)
-    return create_interpolated_function(bin_center, cuts.prediction_cut, sigma=sigma)
 
+def prediction_function(cuts_path):
+    from cta_plots.cuts import load_cuts
 
-@click.command()
-@click.argument('input_file', type=click.Path(exists=True))
-@click.option('-o', '--output', type=click.Path(exists=False))
-@click.option('-p', '--cuts_path', type=click.Path(exists=True))
-@click.option('--reference/--no-reference', default=True)
-@click.option('--cmap', default='magma')
-def main(input_file, output, cuts_path, reference, cmap):
+    # sigma only smoothes the theta cuts, use the same CutSet as load_selected_gammas
+    return load_cuts(cuts_path).prediction_cut
 
-    bins, bin_center, bin_widths = make_default_cta_binning(e_min=0.005 * u.TeV, bins_per_decade=15)
+
+def load_selected_gammas(input_file, cuts_path, sigma=1):
+    '''
+    Load the gammas and the positions of the complete events passing the cuts in `cuts_path` (if given).
+    The selection is not copied out of the table.
+    '''
+    from cta_plots.cuts import load_cuts
 
     gammas, _, _ = load_signal_events(input_file, calculate_weights=False, )
-    gammas.dropna(inplace=True)
+    selected = gammas.notna().all(axis=1).values
+    if cuts_path:
+        selected &= load_cuts(cuts_path, sigma=sigma).mask(gammas, theta=True)
+    return gammas, np.flatnonzero(selected)
+
+
+def plot_effective_area(gammas, runs, cuts_path=None, reference=True, cmap='magma', data_description=None, selected=None):
+    '''
+    Effective area of the `selected` gammas (mask or index array, all gammas if None).
+    '''
+    import astropy.units as u
+    import matplotlib.pyplot as plt
+    from astropy.stats import binom_conf_interval
+    from matplotlib import cm
+    from cta_plots.binning import make_default_cta_binning
+    from cta_plots.histogram import histogram
+    from cta_plots.spectrum import MCSpectrum
 
-    sigma = 1
-    gammas = apply_cuts(gammas, cuts_path=cuts_path, theta_cuts=True, sigma=sigma)
+    bins, bin_center, bin_widths = make_default_cta_binning(e_min=0.005 * u.TeV, bins_per_decade=15)
 
-    runs = load_runs(input_file)
     mc_production = MCSpectrum.from_cta_runs(runs)
 
-    data_description = load_data_description(input_file, gammas, cuts_path=cuts_path)
-
-    gammas_energy = gammas.mc_energy.values
-
     hist_all = mc_production.expected_events_for_bins(energy_bins=bins)
-    hist_selected, _ = np.histogram(gammas_energy, bins=bins)
+    hist_selected = histogram(gammas, 'mc_energy', bins, mask=selected).counts
 
     invalid = hist_selected > hist_all
     hist_selected[invalid] = hist_all[invalid]
@@ -65,7 +67,7 @@ def main(input_file, output, cuts_path, reference, cmap):
     mask = area > 0
     color = None
     if cuts_path:
-        f_prediction = prediction_function(cuts_path, sigma=0)
+        f_prediction = prediction_function(cuts_path)
         colormap = cm.get_cmap(cmap, 512)
         color = colormap(f_prediction(bin_center.value[mask]))
 
@@ -107,9 +109,32 @@ def main(input_file, output, cuts_path, reference, cmap):
     plt.xlabel('True Energy / TeV')
     plt.ylabel('Effective Area / $\\text{m}^2$')
     plt.tight_layout(pad=0, rect=(0.001, 0, 1.041, 0.99))
+    return plt.gca()
+
+
+@click.command()
+@profile_option
+@click.argument('input_file', type=click.Path(exists=True))
+@click.option('-o', '--output', type=click.Path(exists=False))
+@click.option('-p', '--cuts_path', type=click.Path(exists=True))
+@click.option('--reference/--no-reference', default=True)
+@click.option('--cmap', default='magma')
+def main(input_file, output, cuts_path, reference, cmap):
+    import matplotlib.pyplot as plt
+
+    with stage('load'):
+        gammas, selected = load_selected_gammas(input_file, cuts_path)
+        runs = load_runs(input_file)
+        data_description = load_data_description(input_file, selected, cuts_path=cuts_path)
+
+    with stage('plot', n_events=len(selected)):
+        plot_effective_area(
+            gammas, runs, cuts_path=cuts_path, reference=reference, cmap=cmap, data_description=data_description, selected=selected
+        )
 
     if output:
-        plt.savefig(output)
+        with stage('save'):
+            plt.savefig(output)
     else:
         plt.show()
 
@@ -0,0 +1,458 @@
+'''
+Incremental sensitivity calculation for productions that arrive in batches of runs.
+
+For every input file a partial result is stored: the weighted and unweighted event counts
+passing each cell of the cut grid (estimated energy bin, multiplicity, prediction and theta cut),
+which are all that `calculate_n_signal` and `calculate_n_off` need.
+The weights are stored multiplied by the number of simulated showers of the file
+and for an observation time of one hour, so that partials of files from the same
+production can be summed and renormalized with the total number of showers.
+
+A new batch only requires the partials of the new files. All partials in the directory
+are merged and the cuts are re-optimized on the merged counts, which takes seconds.
+The energy bias correction of cta_plot_sensitivity needs the individual events and is not applied.
+'''
+import json
+import os
+
+import click
+import numpy as np
+
+from cta_plots.profiling import profile_option, stage
+from cta_plots.sensitivity import check_validity, check_validity_counts
+
+PARTICLES = ('gamma', 'proton', 'electron')
+GENERATOR_COLUMNS = [
+    'mc_spectral_index',
+    'mc_shower_reuse',
+    'mc_energy_range_min',
+    'mc_energy_range_max',
+    'mc_max_scatter_range',
+    'mc_min_viewcone_radius',
+    'mc_max_viewcone_radius',
+]
+
+
+def default_grid():
+    '''
+    The cut grid of cta_plot_sensitivity.
+    '''
+    import astropy.units as u
+    from cta_plots.binning import make_default_cta_binning
+    from cta_plots.sensitivity.sensitivity import THETA_CUTS, PREDICTION_CUTS, MULTIPLICITIES
+
+    bin_edges, _, _ = make_default_cta_binning(e_min=0.02 * u.TeV, e_max=200 * u.TeV)
+    return {
+        'energy': bin_edges.to_value(u.TeV),
+        'multiplicity': np.asarray(MULTIPLICITIES, dtype=np.float64),
+        'prediction': np.asarray(PREDICTION_CUTS, dtype=np.float64),
+        'theta': np.asarray(THETA_CUTS, dtype=np.float64),
+    }
+
+
+def _reverse_cumsum(a, axis):
+    return np.flip(np.cumsum(np.flip(a, axis=axis), axis=axis), axis=axis)
+
+
+def grid_counts(events, grid, theta=True, weights='weight'):
+    '''
+    Sum of weights and number of events passing each cell of the cut grid:
+    multiplicity >= m, prediction >= p and, if `theta` is True, theta <= t.
+    Returns arrays with shape (energy, multiplicity, prediction[, theta]).
+
+    If `weights` is a list of columns, the sums of weights get an additional leading axis with
+    one entry per column. The bin indices and counts are computed only once.
+    '''
+    from cta_plots.histogram import Histogram, digitize
+
+    # lower edges for the >= cuts, the last bin is open to the right
+    edges = [grid['energy'], np.append(grid['multiplicity'], np.inf), np.append(grid['prediction'], np.inf)]
+    values = [events.gamma_energy_prediction_mean.values, events.num_triggered_telescopes.values, events.gamma_prediction_mean.values]
+    if theta:
+        # theta <= t is theta < nextafter(t)
+        edges.append(np.append(-np.inf, np.nextafter(grid['theta'], np.inf)))
+        values.append(events.theta.values)
+
+    indices = [digitize(v, e) for v, e in zip(values, edges)]
+    columns = [weights] if isinstance(weights, str) else list(weights)
+    histograms = [Histogram(*edges).fill_indices(*indices, weights=events[c].values) for c in columns]
+
+    # axis 0 enumerates the weight columns
+    sum_w = np.stack([h.sum_w for h in histograms])
+    counts = histograms[0].counts[np.newaxis]
+    for axis in (2, 3):
+        sum_w = _reverse_cumsum(sum_w, axis)
+        counts = _reverse_cumsum(counts, axis)
+    if theta:
+        sum_w = np.cumsum(sum_w, axis=4)
+        counts = np.cumsum(counts, axis=4)
+
+    if isinstance(weights, str):
+        return sum_w[0], counts[0]
+    return sum_w, counts[0]
+
+
+def _generator(runs):
+    return {c: float(runs[c].iloc[0]) for c in GENERATOR_COLUMNS}
+
+
+def compute_partial(path, particle, source_alt=None, source_az=None, grid=None):
+    '''
+    Partial result for one file of gammas, protons or electrons.
+    Background partials need the source position, gamma partials define it.
+    '''
+    import astropy.units as u
+    from fact.io import read_data
+    from cta_plots import load_signal_events, load_background_particle
+    from cta_plots.spectrum import MCSpectrum
+
+    grid = grid or default_grid()
+    if particle == 'gamma':
+        events, source_alt, source_az = load_signal_events(path, assumed_obs_time=1 * u.h)
+        runs = read_data(path, key='runs')
+    else:
+        events, runs = load_background_particle(path, particle, source_alt, source_az, assumed_obs_time=1 * u.h)
+        # only events within 1 degree are used for the off counts
+        events = events[events.theta <= 1.0]
+
+    if np.ndim(source_alt) > 0:
+        raise ValueError('Partial results need point like gammas')
+
+    n_showers = MCSpectrum.from_cta_runs(runs).total_showers_simulated
+    with stage('grid counts', n_events=len(events)):
+        sum_w, counts = grid_counts(events, grid, theta=particle == 'gamma')
+
+    meta = {
+        'particle': particle,
+        'path': os.path.abspath(path),
+        'run_ids': sorted(int(r) for r in runs.run_id),
+        'n_showers': float(n_showers),
+        'generator': _generator(runs),
+        'source_alt': float(u.Quantity(source_alt, u.deg).value),
+        'source_az': float(u.Quantity(source_az, u.deg).value),
+    }
+    return {'meta': meta, 'grid': grid, 'sum_w': sum_w * n_showers, 'counts': counts}
+
+
+def _partial_path(partials_dir, path, particle):
+    from cta_plots.session import session_key
+    return os.path.join(partials_dir, f'{particle}-{session_key(path)}.npz')
+
+
+def write_partial(filename, partial):
+    tmp = filename + '.tmp.npz'
+    np.savez(
+        tmp,
+        meta=json.dumps(partial['meta']),
+        sum_w=partial['sum_w'],
+        counts=partial['counts'],
+        **{f'grid_{k}': v for k, v in partial['grid'].items()},
+    )
+    os.replace(tmp, filename)
+
+
+def read_partial(filename):
+    with np.load(filename) as f:
+        return {
+            'meta': json.loads(str(f['meta'])),
+            'grid': {k[len('grid_'):]: f[k] for k in f.files if k.startswith('grid_')},
+            'sum_w': f['sum_w'],
+            'counts': f['counts'],
+        }
+
+
+def read_partials(partials_dir):
+    return [
+        read_partial(os.path.join(partials_dir, f))
+        for f in sorted(os.listdir(partials_dir))
+        if f.endswith('.npz') and not f.endswith('.tmp.npz')
+    ]
+
+
+def merge_partials(partials):
+    '''
+    Sum the partial results of each particle type and normalize the weights
+    with the total number of simulated showers.
+    Raises a ValueError if the partials do not belong to the same production, source position
+    and cut grid or if a run is contained in more than one partial.
+    '''
+    if not partials:
+        raise ValueError('No partial results to merge')
+
+    grid = partials[0]['grid']
+    source = (partials[0]['meta']['source_alt'], partials[0]['meta']['source_az'])
+
+    merged = {}
+    for partial in partials:
+        meta = partial['meta']
+        if not all(np.array_equal(grid[k], partial['grid'][k]) for k in grid):
+            raise ValueError(f'{meta["path"]} was computed for a different cut grid')
+        if not np.allclose(source, (meta['source_alt'], meta['source_az'])):
+            raise ValueError(f'{meta["path"]} was computed for a different source position')
+
+        m = merged.setdefault(meta['particle'], {'sum_w': 0, 'counts': 0, 'n_showers': 0, 'run_ids': set(), 'generator': meta['generator']})
+        if m['generator'] != meta['generator']:
+            raise ValueError(f'{meta["path"]} was simulated with different settings than the other {meta["particle"]} files')
+        duplicates = m['run_ids'].intersection(meta['run_ids'])
+        if duplicates:
+            raise ValueError(f'Runs {sorted(duplicates)[:5]} of {meta["path"]} are already contained in another partial result')
+
+        m['sum_w'] = m['sum_w'] + partial['sum_w']
+        m['counts'] = m['counts'] + partial['counts']
+        m['n_showers'] += meta['n_showers']
+        m['run_ids'].update(meta['run_ids'])
+
+    missing = [p for p in PARTICLES if p not in merged]
+    if missing:
+        raise ValueError(f'No partial results for {", ".join(missing)}')
+
+    for m in merged.values():
+        m['sum_w'] = m['sum_w'] / m['n_showers']
+    merged['grid'] = grid
+    return merged
+
+
+def relative_sensitivity_grid(n_signal, n_off, alpha=0.2, target_sigma=5, right_bound=100, iterations=60):
+    '''
+    Vectorized version of `find_relative_sensitivity`: the factor by which the signal has to be
+    scaled to reach the target significance, found by bisection. NaN if it is larger than `right_bound`.
+    '''
+    from cta_plots.statistics import li_ma_significance
+
+    n_signal = np.asarray(n_signal, dtype=np.float64)
+    n_off = np.broadcast_to(n_off, n_signal.shape)
+
+    def significance(scale):
+        return li_ma_significance(n_off * alpha + scale * n_signal, n_off, alpha=alpha)
+
+    low = np.zeros(n_signal.shape)
+    high = np.full(n_signal.shape, float(right_bound))
+    reachable = significance(high) >= target_sigma
+    for _ in range(iterations):
+        mid = 0.5 * (low + high)
+        above = significance(mid) >= target_sigma
+        high = np.where(above, mid, high)
+        low = np.where(above, low, mid)
+
+    return np.where(reachable, 0.5 * (low + high), np.nan)
+
+
+def relative_sensitivity_poisson_grid(n_signal, n_off, alpha=0.2, target_sigma=5, N=300, rng=None):
+    '''
+    Vectorized version of `find_relative_sensitivity_poisson` for many cells at once.
+    Returns an array of shape (n_cells, 3) with the (50, 5, 95) percentiles.
+    `rng` (np.random.Generator, SeedSequence or int) is the source of the Poisson samples, fresh entropy if None.
+    '''
+    rng = np.random.default_rng(rng)
+    n_signal = rng.poisson(n_signal, size=(N, len(n_signal)))
+    n_off = rng.poisson(n_off, size=(N, len(n_off))).astype(np.float64)
+
+    rs = relative_sensitivity_grid(n_signal, n_off, alpha=alpha, target_sigma=target_sigma)
+    rs[n_off == 0] = np.nan
+    return np.nanpercentile(rs, (50, 5, 95), axis=0).T
+
+
+def optimize_merged(merged, t_obs=50, alpha=0.2, seed=0):
+    '''
+    Find the best cuts in each energy bin on the merged counts and calculate the
+    relative sensitivity like `calc_relative_sensitivity`.
+
+    Parameters
+    ----------
+    merged : dict
+        result of `merge_partials`
+    t_obs : float
+        observation time in hours
+    alpha : float, optional
+        assumed ratio between signal and background region
+    seed : int, optional
+        seed of the Poisson samples of the errors
+
+    Returns
+    -------
+    pd.DataFrame
+        one row per energy bin with the same columns as the output of cta_plot_sensitivity
+    '''
+    background_w = (merged['proton']['sum_w'] + merged['electron']['sum_w']) * t_obs
+    background_counts = merged['proton']['counts'] + merged['electron']['counts']
+    return optimize_grid(
+        merged['grid'], merged['gamma']['sum_w'] * t_obs, merged['gamma']['counts'], background_w, background_counts, alpha=alpha, seed=seed
+    )
+
+
+def optimize_grid(grid, n_signal, n_signal_counts, background_w, background_counts, alpha=0.2, seed=0):
+    '''
+    Find the best cuts in each energy bin given the output of `grid_counts` for signal and background.
+    `n_signal` may have a leading axis with one entry per assumed signal spectrum,
+    in which case a list with one result per spectrum is returned.
+    The background terms and validity checks on the counts are shared by all spectra.
+    `seed` determines the Poisson samples of the errors.
+
+    Returns
+    -------
+    pd.DataFrame or list of pd.DataFrame
+        one row per energy bin with the same columns as the output of cta_plot_sensitivity
+    '''
+    import pandas as pd
+    from cta_plots.statistics import li_ma_significance
+
+    n_signal = np.asarray(n_signal)
+    single = n_signal.ndim == 4
+    if single:
+        n_signal = n_signal[np.newaxis]
+
+    off_scale = grid['theta']**2 / alpha
+    total_bkg_counts = background_counts[..., np.newaxis]
+    n_off = background_w[..., np.newaxis] * off_scale
+    n_off_counts = total_bkg_counts * off_scale
+
+    valid = check_validity(n_signal, n_off, alpha=alpha)
+    valid &= check_validity_counts(n_signal_counts, n_off_counts, total_bkg_counts, alpha=alpha)
+    significance = li_ma_significance(n_signal + alpha * n_off, n_off, alpha=alpha)
+
+    relative_sensitivity = np.full(n_signal.shape, np.inf)
+    relative_sensitivity[valid] = relative_sensitivity_grid(
+        n_signal[valid], np.broadcast_to(n_off, n_signal.shape)[valid], alpha=alpha
+    )
+
+    # best cell (spectrum, energy, multiplicity, prediction, theta) per energy bin of each spectrum
+    cells = []
+    for k, i in np.ndindex(n_signal.shape[:2]):
+        rs = relative_sensitivity[k, i]
+        if (significance[k, i] == 0).all() or np.isnan(rs).all():
+            continue
+        cells.append((k, i, *np.unravel_index(np.nanargmin(rs), rs.shape)))
+
+    # the errors of all selected cells are sampled together
+    errors = {}
+    if cells:
+        k, i, m, p, t = np.array(cells).T
+        percentiles = relative_sensitivity_poisson_grid(n_signal[k, i, m, p, t], n_off[i, m, p, t], alpha=alpha, rng=seed)
+        errors = {cell[:2]: (cell[2:], e) for cell, e in zip(cells, percentiles)}
+
+    results = []
+    for k in range(len(n_signal)):
+        rows = []
+        for i in range(len(grid['energy']) - 1):
+            row = {'e_min': grid['energy'][i], 'e_max': grid['energy'][i + 1]}
+            if (k, i) in errors:
+                (m, p, t), (sensitivity, low, high) = errors[(k, i)]
+                cell = (i, m, p, t)
+                row.update({
+                    'sensitivity': sensitivity,
+                    'sensitivity_low': low,
+                    'sensitivity_high': high,
+                    'prediction_cut': grid['prediction'][p],
+                    'significance': significance[k][cell],
+                    'signal_counts': n_signal_counts[cell],
+                    'background_counts': n_off_counts[cell],
+                    'weighted_signal_counts': n_signal[k][cell],
+                    'weighted_background_counts': n_off[cell],
+                    'theta_cut': grid['theta'][t],
+                    'multiplicity': grid['multiplicity'][m],
+                    'total_bkg_counts': total_bkg_counts[i, m, p, 0],
+                    'valid': valid[k][cell],
+                })
+            rows.append(row)
+        results.append(pd.DataFrame(rows, columns=RESULT_COLUMNS))
+
+    return results[0] if single else results
+
+
+RESULT_COLUMNS = [
+    'sensitivity', 'sensitivity_low', 'sensitivity_high', 'prediction_cut', 'significance',
+    'signal_counts', 'background_counts', 'weighted_signal_counts', 'weighted_background_counts',
+    'theta_cut', 'multiplicity', 'total_bkg_counts', 'valid', 'e_min', 'e_max',
+]
+
+
+def update_partials(partials_dir, gammas=(), protons=(), electrons=()):
+    '''
+    Compute and store the partial results of the given files which are not in `partials_dir` yet.
+    Returns the paths of the newly computed partials.
+    '''
+    os.makedirs(partials_dir, exist_ok=True)
+    source = None
+    new = []
+
+    for path in gammas:
+        filename = _partial_path(partials_dir, path, 'gamma')
+        if not os.path.exists(filename):
+            with stage(f'partial {os.path.basename(path)}'):
+                write_partial(filename, compute_partial(path, 'gamma'))
+            new.append(filename)
+
+    for particle, paths in (('proton', protons), ('electron', electrons)):
+        for path in paths:
+            filename = _partial_path(partials_dir, path, particle)
+            if os.path.exists(filename):
+                continue
+            if source is None:
+                source = _source_position(partials_dir)
+            with stage(f'partial {os.path.basename(path)}'):
+                write_partial(filename, compute_partial(path, particle, *source))
+            new.append(filename)
+    return new
+
+
+def _source_position(partials_dir):
+    import astropy.units as u
+
+    for partial in read_partials(partials_dir):
+        if partial['meta']['particle'] == 'gamma':
+            return partial['meta']['source_alt'] * u.deg, partial['meta']['source_az'] * u.deg
+    raise ValueError('Background partials need the source position. Add a gamma file first.')
+
+
+@click.command()
+@profile_option
+@click.argument('partials_dir', type=click.Path(file_okay=False))
+@click.option('-g', '--gammas', multiple=True, type=click.Path(exists=True, dir_okay=False), help='New point like gamma file, can be given multiple times')
+@click.option('-p', '--protons', multiple=True, type=click.Path(exists=True, dir_okay=False), help='New proton file, can be given multiple times')
+@click.option('-e', '--electrons', multiple=True, type=click.Path(exists=True, dir_okay=False), help='New electron file, can be given multiple times')
+@click.option('-o', '--output', type=click.Path(exists=False))
+@click.option('-t', '--t_obs', default=50, help='Observation time in hours')
+@click.option('-c', '--color', default='xkcd:purple')
+@click.option('--reference/--no-reference', default=False)
+@click.option('--requirement/--no-requirement', default=False)
+@click.option('--seed', default=0, help='Seed for the Poisson errors')
+def main(partials_dir, gammas, protons, electrons, output, t_obs, color, reference, requirement, seed):
+    '''
+    Add the partial results of new files to PARTIALS_DIR and calculate the
+    sensitivity from all partial results in it.
+    '''
+    import astropy.units as u
+    import matplotlib.pyplot as plt
+    from cta_plots.binning import Binning
+    from cta_plots.sensitivity.sensitivity import plot_sensitivity_curve
+
+    try:
+        new = update_partials(partials_dir, gammas=gammas, protons=protons, electrons=electrons)
+        with stage('merge'):
+            merged = merge_partials(read_partials(partials_dir))
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f'{len(new)} new partial results, {sum(len(merged[p]["run_ids"]) for p in PARTICLES)} runs in total')
+
+    with stage('optimize'):
+        df_sensitivity = optimize_merged(merged, t_obs=t_obs, seed=seed)
+    print(df_sensitivity)
+
+    # the merged result is written before plotting so it is not lost if the plot fails
+    if output:
+        n, _ = os.path.splitext(output)
+        df_sensitivity.to_csv(n + '.csv', index=False, na_rep='NaN')
+
+    bin_edges, bin_center, _ = Binning.from_edges(merged['grid']['energy'] * u.TeV)
+    with stage('plot'):
+        plot_sensitivity_curve(df_sensitivity, bin_edges, bin_center, color=color, reference=reference, requirement=requirement)
+
+    if output:
+        plt.savefig(output)
+    else:
+        plt.show()
+
+
+if __name__ == '__main__':
+    # pylint: disable=no-value-for-parameter
+    main()
@@ -0,0 +1,197 @@
+'''
+Sensitivity, angular resolution and effective area in bins of estimated energy and field of view offset
+from diffuse gammas, for camera wide performance studies.
+
+The diffuse gammas in each ring of true offset are weighted like a point source at that offset
+(see `load_diffuse_signal_events`). The background in a ring of reconstructed offset is scaled to the
+equivalent of a circle with 1 degree radius, which is what `calculate_n_off` assumes for point like data.
+Each offset ring is optimized on the cut grid of cta_plot_sensitivity (`cta_plots.sensitivity.grid`)
+in a separate worker.
+'''
+import os
+
+import click
+import numpy as np
+
+from cta_plots.profiling import profile_option, stage
+
+
+def _select_ring(events, lo, hi):
+    m = (events.offset >= lo) & (events.offset < hi)
+    return events[m]
+
+
+def _apply_best_cuts(events, energy_edges, cuts, theta=True):
+    '''
+    Mask of the events passing the optimized cuts of their bin in estimated energy.
+    Events in bins without cuts are rejected.
+    '''
+    from cta_plots.histogram import digitize
+
+    idx = digitize(events.gamma_energy_prediction_mean.values, energy_edges)
+    inside = idx >= 0
+    passed = np.zeros(len(events), dtype=bool)
+
+    # comparisons with the NaN cuts of empty bins are False
+    i = idx[inside]
+    m = events.num_triggered_telescopes.values[inside] >= cuts.multiplicity.values[i]
+    m &= events.gamma_prediction_mean.values[inside] >= cuts.prediction_cut.values[i]
+    if theta:
+        m &= events.theta.values[inside] <= cuts.theta_cut.values[i]
+    passed[inside] = m
+    return passed
+
+
+def optimize_offset_bin(gammas, background, grid, lo, hi, simulated, generation_area, alpha=0.2, containment=0.68):
+    '''
+    Sensitivity, angular resolution and effective area for one ring of offset [lo, hi) in degree.
+    `gammas` and `background` contain the events of this ring,
+    `simulated` the number of simulated gammas in this ring per bin of true energy.
+
+    The angular resolution is the `containment` quantile of theta of the gammas passing
+    the optimized multiplicity and prediction cuts in each bin of estimated energy.
+    The effective area is given in bins of true energy after all cuts,
+    each event is cut according to its estimated energy.
+    '''
+    from cta_plots.histogram import Histogram, digitize
+    from cta_plots.sensitivity.grid import grid_counts, optimize_grid
+
+    # background per ring area relative to the circle of 1 degree radius used by calculate_n_off
+    scale = 1 / (hi**2 - lo**2)
+    n_signal, n_signal_counts = grid_counts(gammas, grid)
+    background_w, background_counts = grid_counts(background, grid, theta=False)
+    df = optimize_grid(grid, n_signal, n_signal_counts, background_w * scale, background_counts * scale, alpha=alpha)
+
+    energy_edges = grid['energy']
+    passed = _apply_best_cuts(gammas, energy_edges, df, theta=False)
+    idx = digitize(gammas.gamma_energy_prediction_mean.values, energy_edges)
+    theta = gammas.theta.values
+    df['angular_resolution'] = [
+        np.quantile(theta[passed & (idx == i)], containment) if (passed & (idx == i)).any() else np.nan
+        for i in range(len(energy_edges) - 1)
+    ]
+
+    passed &= _apply_best_cuts(gammas, energy_edges, df, theta=True)
+    selected = Histogram(energy_edges).fill(gammas.mc_energy.values[passed]).counts
+    with np.errstate(invalid='ignore', divide='ignore'):
+        df['effective_area'] = np.where(simulated > 0, selected / simulated, np.nan) * generation_area
+
+    df.insert(0, 'offset_min', lo)
+    df.insert(1, 'offset_max', hi)
+    return df
+
+
+def calculate_offset_sensitivity(gammas, background, runs, offset_bins, grid=None, alpha=0.2, n_jobs=4):
+    '''
+    Run `optimize_offset_bin` for each ring of offset in parallel.
+    `gammas` and `background` need an `offset` column in degree,
+    true offset for the gammas and reconstructed offset for the background.
+
+    Returns
+    -------
+    pd.DataFrame
+        one row per (offset, energy) cell
+    '''
+    import astropy.units as u
+    import pandas as pd
+    from joblib import Parallel, delayed
+    from cta_plots.irf.build import simulated_events
+    from cta_plots.sensitivity.grid import default_grid
+
+    grid = grid or default_grid()
+    simulated, generation_area = simulated_events(runs, {'energy': grid['energy'], 'offset': offset_bins})
+
+    rings = list(zip(offset_bins[:-1], offset_bins[1:]))
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(optimize_offset_bin)(
+            _select_ring(gammas, lo, hi), _select_ring(background, lo, hi), grid, lo, hi,
+            simulated[j], generation_area.to_value(u.m**2), alpha=alpha,
+        )
+        for j, (lo, hi) in enumerate(rings)
+    )
+    return pd.concat(results, ignore_index=True)
+
+
+def plot_offset_sensitivity(df, ax=None, spectrum_name='crab'):
+    '''
+    Sensitivity in units of E^2 dN/dE on the (energy, offset) plane.
+    '''
+    import astropy.units as u
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import LogNorm
+    from cta_plots.spectrum import signal_spectrum
+
+    if not ax:
+        ax = plt.gca()
+
+    energy_edges = np.unique(np.append(df.e_min.values, df.e_max.values))
+    offset_edges = np.unique(np.append(df.offset_min.values, df.offset_max.values))
+    table = df.pivot(index='offset_min', columns='e_min', values='sensitivity').values
+
+    center = np.sqrt(energy_edges[:-1] * energy_edges[1:]) * u.TeV
+    flux = (signal_spectrum(spectrum_name).flux(center) * center**2).to_value(u.erg / (u.s * u.cm**2))
+    im = ax.pcolormesh(energy_edges, offset_edges, np.ma.masked_invalid(table * flux), norm=LogNorm())
+    plt.colorbar(im, ax=ax, label='Sensitivity / erg cm$^{-2}$ s$^{-1}$')
+
+    ax.set_xscale('log')
+    ax.set_xlabel('Estimated Energy / TeV')
+    ax.set_ylabel('Offset in FoV / deg')
+    return ax
+
+
+@click.command()
+@profile_option
+@click.argument('gammas_path', type=click.Path(exists=True))
+@click.argument('protons_path', type=click.Path(exists=True))
+@click.argument('electrons_path', type=click.Path(exists=True))
+@click.option('-o', '--output', type=click.Path(exists=False))
+@click.option('-t', '--t_obs', default=50, help='Observation time in hours')
+@click.option('--n_offset', default=6, help='Number of offset bins')
+@click.option('--max_offset', default=6.0, help='Maximum offset in degree')
+@click.option('--n_jobs', default=4)
+def main(gammas_path, protons_path, electrons_path, output, t_obs, n_offset, max_offset, n_jobs):
+    '''
+    Sensitivity, angular resolution and effective area in bins of estimated energy and offset
+    from DIFFUSE gammas. The result is written as a table with one row per (offset, energy) cell.
+    '''
+    import astropy.units as u
+    import matplotlib.pyplot as plt
+    import pandas as pd
+    from cta_plots import load_diffuse_signal_events, load_background_events
+    from cta_plots.irf.build import find_pointing
+
+    pd.set_option('display.max_columns', 500)
+    t_obs *= u.h
+    offset_bins = np.linspace(0, max_offset, n_offset + 1)
+
+    pointing = find_pointing(gammas_path)
+    try:
+        gammas, runs = load_diffuse_signal_events(gammas_path, pointing, offset_bins, assumed_obs_time=t_obs)
+    except ValueError:
+        raise click.ClickException('Off-axis sensitivity needs diffuse gammas')
+
+    # distance to the pointing position is the reconstructed offset
+    background = load_background_events(
+        protons_path, electrons_path, pointing[0] * u.deg, pointing[1] * u.deg, assumed_obs_time=t_obs
+    )
+    background['offset'] = background.theta
+
+    with stage('optimize', n_events=len(gammas) + len(background)):
+        df = calculate_offset_sensitivity(gammas, background, runs, offset_bins, n_jobs=n_jobs)
+    print(df)
+
+    with stage('plot'):
+        plot_offset_sensitivity(df)
+
+    if output:
+        n, _ = os.path.splitext(output)
+        with stage('write'):
+            df.to_csv(n + '.csv', index=False, na_rep='NaN')
+            plt.savefig(output)
+    else:
+        plt.show()
+
+
+if __name__ == '__main__':
+    # pylint: disable=no-value-for-parameter
+    main()
@@ -1,3 +1,6 @@
+import os
+import time
+
 from tqdm import tqdm
 import numpy as np
 from . import calculate_relative_sensitivity, calculate_significance
@@ -5,6 +8,16 @@ from joblib import Parallel, delayed
 
 
 def _optimize_prediction_cuts(signal_events, background_events, prediction_cuts, theta_cuts, multiplicity, alpha=0.2, ):
+    start = time.perf_counter()
+    stats = {
+        'multiplicity': int(multiplicity),
+        'pid': os.getpid(),
+        'cells': 0,
+        'rejected_validity': 0,
+        'rejected_validity_counts': 0,
+        'events': 0,
+    }
+
     rs = []
     for pc in tqdm(prediction_cuts, disable=True):
         m = (signal_events.gamma_prediction_mean >= pc)
@@ -19,15 +32,165 @@ def _optimize_prediction_cuts(signal_events, background_events, prediction_cuts,
                 tc,
                 alpha=alpha
             )
-            relative_sensitivity = calculate_relative_sensitivity(
+            relative_sensitivity, valid, valid_counts = calculate_relative_sensitivity(
                 selected_signal,
                 selected_background,
                 tc,
                 alpha=alpha,
+                return_validity=True,
             )
             rs.append([relative_sensitivity, significance, tc, pc, multiplicity])
 
-    return rs
+            stats['cells'] += 1
+            stats['rejected_validity'] += int(not valid)
+            stats['rejected_validity_counts'] += int(not valid_counts)
+            stats['events'] += len(selected_signal) + len(selected_background)
+
+    stats['seconds'] = time.perf_counter() - start
+    return rs, stats
+
+
+def _summarize_telemetry(worker_stats, n_signal, n_background, seconds, n_jobs):
+    '''
+    Combine the statistics of the workers evaluating one energy bin.
+    '''
+    cells = sum(w['cells'] for w in worker_stats)
+    for w in worker_stats:
+        w['evaluations_per_second'] = w['cells'] / w['seconds'] if w['seconds'] > 0 else np.nan
+
+    return {
+        'cells': cells,
+        'rejected_validity': sum(w['rejected_validity'] for w in worker_stats),
+        'rejected_validity_counts': sum(w['rejected_validity_counts'] for w in worker_stats),
+        'signal_events': n_signal,
+        'background_events': n_background,
+        'events_per_cell': sum(w['events'] for w in worker_stats) / cells if cells else 0,
+        'seconds': seconds,
+        'n_jobs': n_jobs,
+        'evaluations_per_second': cells / seconds if seconds > 0 else np.nan,
+        'workers': worker_stats,
+    }
+
+
+TELESCOPE_TYPE_CUTS = {
+    'num_triggered_lst': np.arange(0, 5),
+    'num_triggered_mst': np.array([0, 1, 2, 3, 4, 5, 6, 8, 10, 15]),
+    'num_triggered_sst': np.array([0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 30]),
+}
+
+
+def _cumulative_table(events, ge_cuts, theta_cuts=None, weights=None):
+    '''
+    Sum of weights of the events passing each combination of cuts.
+    `ge_cuts` is a list of (column, cut values) pairs for cuts of the form column >= cut,
+    if `theta_cuts` is given the last axis is theta <= cut.
+
+    Each event is reduced to the number of cuts it passes in each dimension, so the table
+    is filled from the occupied level combinations with a single bincount and
+    turned into cumulative counts with one cumsum per axis.
+    '''
+    # NaNs pass no cut, like in the comparisons of the event loop
+    levels = [
+        np.where(np.isnan(v), 0, np.searchsorted(cuts, v, side='right'))
+        for v, cuts in ((events[column].values.astype(np.float64), cuts) for column, cuts in ge_cuts)
+    ]
+    shape = [len(cuts) + 1 for _, cuts in ge_cuts]
+    if theta_cuts is not None:
+        # index of the tightest theta cut the event still passes, len(theta_cuts) if none
+        levels.append(np.searchsorted(theta_cuts, events.theta.values, side='left'))
+        shape.append(len(theta_cuts) + 1)
+
+    flat = np.ravel_multi_index(levels, shape) if len(events) else np.zeros(0, dtype=int)
+    table = np.bincount(flat, weights=weights, minlength=int(np.prod(shape))).reshape(shape)
+
+    for axis in range(len(ge_cuts)):
+        # events with level l pass the first l cuts
+        table = np.flip(np.cumsum(np.flip(table, axis=axis), axis=axis), axis=axis)
+        table = np.take(table, np.arange(1, shape[axis]), axis=axis)
+    if theta_cuts is not None:
+        table = np.cumsum(table, axis=-1)[..., :-1]
+    return table
+
+
+def _pareto_front(n_signal, n_off):
+    '''
+    Indices of the cells not dominated by another cell with at least as much signal and less background.
+    The relative sensitivity and the significance can only be minimal/maximal on this front.
+    '''
+    order = np.lexsort((n_off, -n_signal))
+    best_off = np.minimum.accumulate(n_off[order])
+    keep = np.ones(len(order), dtype=bool)
+    keep[1:] = n_off[order][1:] < best_off[:-1]
+    return order[keep]
+
+
+def _optimize_cut_table(
+    theta_cuts, prediction_cuts, multiplicities, extra_cuts, signal_events, background_events, alpha=0.2, criterion='sensitivity'
+):
+    '''
+    `find_best_cuts` for additional integer cut dimensions, e.g. a minimum number of triggered telescopes per type.
+    All cells are evaluated on cumulative count tables. Invalid and dominated cells are pruned
+    before the relative sensitivity is computed for the remaining ones.
+    '''
+    from cta_plots.statistics import li_ma_significance
+    from . import check_validity, check_validity_counts
+    from .grid import relative_sensitivity_grid
+
+    start = time.perf_counter()
+    ge_cuts = [('num_triggered_telescopes', np.asarray(multiplicities)), ('gamma_prediction_mean', np.asarray(prediction_cuts))]
+    ge_cuts += [(column, np.asarray(cuts)) for column, cuts in extra_cuts.items()]
+    theta_cuts = np.asarray(theta_cuts)
+
+    background_events = background_events[background_events.theta <= 1.0]
+    n_signal = _cumulative_table(signal_events, ge_cuts, theta_cuts, weights=signal_events.weight.values)
+    n_signal_counts = _cumulative_table(signal_events, ge_cuts, theta_cuts)
+    total_bkg_counts = _cumulative_table(background_events, ge_cuts)[..., np.newaxis]
+    background_w = _cumulative_table(background_events, ge_cuts, weights=background_events.weight.values)
+
+    off_scale = theta_cuts**2 / alpha
+    n_off = background_w[..., np.newaxis] * off_scale
+    n_off_counts = total_bkg_counts * off_scale
+    n_off, n_off_counts, total_bkg_counts = np.broadcast_arrays(n_off, n_off_counts, total_bkg_counts)
+
+    valid_weighted = check_validity(n_signal, n_off, alpha=alpha)
+    valid_counts = check_validity_counts(n_signal_counts, n_off_counts, total_bkg_counts, alpha=alpha)
+    valid = (valid_weighted & valid_counts).ravel()
+    significance = li_ma_significance(n_signal + alpha * n_off, n_off, alpha=alpha).ravel()
+
+    s, b = n_signal.ravel(), n_off.ravel()
+    candidates = np.flatnonzero(valid) if criterion == 'sensitivity' else np.arange(len(s))
+    front = candidates[_pareto_front(s[candidates], b[candidates])]
+
+    relative_sensitivity = np.full(len(s), np.inf)
+    evaluate = front[valid[front]]
+    relative_sensitivity[evaluate] = relative_sensitivity_grid(s[evaluate], b[evaluate], alpha=alpha)
+
+    telemetry = {
+        'cells': len(s),
+        'rejected_validity': int((~valid_weighted).sum()),
+        'rejected_validity_counts': int((~valid_counts).sum()),
+        'pruned': int(len(s) - len(front)),
+        'evaluated': len(evaluate),
+        'signal_events': len(signal_events),
+        'background_events': len(background_events),
+        'seconds': time.perf_counter() - start,
+        'n_jobs': 1,
+        'workers': [],
+    }
+    telemetry['evaluations_per_second'] = len(s) / telemetry['seconds'] if telemetry['seconds'] > 0 else np.nan
+
+    if (significance == 0).all():
+        return None, telemetry
+
+    if criterion == 'sensitivity':
+        finite = front[np.isfinite(relative_sensitivity[front])]
+        best = finite[np.argmin(relative_sensitivity[finite])] if len(finite) else 0
+    elif criterion == 'significance':
+        best = front[np.nanargmax(significance[front])]
+
+    index = np.unravel_index(best, n_signal.shape)
+    best_cuts = {column: cuts[i] for (column, cuts), i in zip(ge_cuts, index)}
+    return (relative_sensitivity[best], significance[best], theta_cuts[index[-1]], best_cuts), telemetry
 
 
 def find_best_cuts(
@@ -38,7 +201,9 @@ def find_best_cuts(
     background_events,
     alpha=0.2,
     n_jobs=4,
-    criterion='sensitivity'
+    criterion='sensitivity',
+    return_telemetry=False,
+    extra_cuts=None,
 ):
     '''
     Find best the combination of theta_cuts, predicitons_cuts and multiplicity_cut for which 
@@ -58,12 +223,34 @@ def find_best_cuts(
         A dataframe containing energies and weights for the background (protons + electrons)
     alpha : float, optional
         assumed ratio between signal and background region
+    return_telemetry : bool, optional
+        additionally return a dict with the number of evaluated cells, the number of cells
+        rejected by check_validity and check_validity_counts, events per cell,
+        wall time and evaluations per second for the whole bin and for each worker.
+    extra_cuts : dict, optional
+        additional cuts of the form column >= value to optimize, mapping columns to the values to try,
+        e.g. `TELESCOPE_TYPE_CUTS`. The search runs on cumulative count tables instead of the event loop
+        and a dict with the best value for each column is returned after best_mult.
 
     Returns
     -------
     tuple
-        best_sensitivity, best_prediction_cut, best_theta_cut, best_significance, best_mult
+        best_sensitivity, best_prediction_cut, best_theta_cut, best_significance, best_mult[, best_extra_cuts]
     '''
+    if extra_cuts:
+        best, telemetry = _optimize_cut_table(
+            theta_cuts, prediction_cuts, multiplicities, extra_cuts, signal_events, background_events, alpha=alpha, criterion=criterion
+        )
+        if best is None:
+            result = (np.nan, np.nan, np.nan, np.nan, np.nan, {column: np.nan for column in extra_cuts})
+        else:
+            best_sensitivity, best_significance, best_theta_cut, best_cuts = best
+            best_mult = best_cuts.pop('num_triggered_telescopes')
+            best_prediction_cut = best_cuts.pop('gamma_prediction_mean')
+            result = (best_sensitivity, best_prediction_cut, best_theta_cut, best_significance, best_mult, best_cuts)
+        return result + (telemetry,) if return_telemetry else result
+
+    start = time.perf_counter()
     op = delayed(_optimize_prediction_cuts)
 
     frames = []
@@ -75,12 +262,18 @@ def find_best_cuts(
         selected_background = background_events[m]
         frames.append((selected_signal, selected_background, mult))
 
-    rs = Parallel(n_jobs=n_jobs)(op(s, b, prediction_cuts, theta_cuts, multiplicity=m, alpha=alpha) for (s, b, m) in frames)
-    rs = np.array(rs).reshape(-1, 5)
+    results = Parallel(n_jobs=n_jobs)(op(s, b, prediction_cuts, theta_cuts, multiplicity=m, alpha=alpha) for (s, b, m) in frames)
+    rs = np.array([r for r, _ in results]).reshape(-1, 5)
+
+    telemetry = _summarize_telemetry(
+        [stats for _, stats in results], len(signal_events), len(background_events), time.perf_counter() - start, n_jobs
+    )
 
     relative_sensitivities = np.array([r[0] for r in rs])
     significances = np.array([r[1] for r in rs])
     if (significances == 0).all():
+        if return_telemetry:
+            return np.nan, np.nan, np.nan, np.nan, np.nan, telemetry
         return np.nan, np.nan, np.nan, np.nan, np.nan
 
     if criterion == 'sensitivity':
@@ -90,4 +283,6 @@ def find_best_cuts(
 
     best_sensitivity, best_significance, best_theta_cut, best_prediction_cut, best_mult = rs[max_index]
 
+    if return_telemetry:
+        return best_sensitivity, best_prediction_cut, best_theta_cut, best_significance, best_mult, telemetry
     return best_sensitivity, best_prediction_cut, best_theta_cut, best_significance, best_mult
@@ -73,18 +73,18 @@ def plot_reference(ax=None):
     return ax
 
 
-def plot_sensitivity(rs, bin_edges, bin_center, color='blue', ax=None, **kwargs):
-    crab = CrabLogParabola()
-    
-    sensitivity = rs.sensitivity.values * (crab.flux(bin_center) * bin_center ** 2).to_value(
-        u.erg / (u.s * u.cm ** 2)
-    )
-    sensitivity_low = rs.sensitivity_low.values * (crab.flux(bin_center) * bin_center ** 2).to_value(
-        u.erg / (u.s * u.cm ** 2)
-    )
-    sensitivity_high = rs.sensitivity_high.values * (crab.flux(bin_center) * bin_center ** 2).to_value(
-        u.erg / (u.s * u.cm ** 2)
-    )
+def plot_sensitivity(rs, bin_edges, bin_center, color='blue', ax=None, spectrum=None, **kwargs):
+    '''
+    Plot the relative sensitivity in units of the flux of the assumed source `spectrum`.
+    Defaults to the Crab spectrum (`CrabLogParabola`).
+    '''
+    if spectrum is None:
+        spectrum = CrabLogParabola()
+
+    flux = (spectrum.flux(bin_center) * bin_center ** 2).to_value(u.erg / (u.s * u.cm ** 2))
+    sensitivity = rs.sensitivity.values * flux
+    sensitivity_low = rs.sensitivity_low.values * flux
+    sensitivity_high = rs.sensitivity_high.values * flux
     xerr = [np.abs(bin_edges[:-1] - bin_center).to_value('TeV'), np.abs(bin_edges[1:] - bin_center).to_value('TeV')]
     yerr = [np.abs(sensitivity - sensitivity_low), np.abs(sensitivity - sensitivity_high)]
 
@@ -93,10 +93,12 @@ def plot_sensitivity(rs, bin_edges, bin_center, color='blue', ax=None, **kwargs)
 
     m = (rs['valid'] == True)
 
+    # only the valid points get a legend entry
+    label = kwargs.pop('label', None)
     werr = [xerr[0][m], xerr[1][m]] 
     serr = [yerr[0][m], yerr[1][m]] 
     ax.errorbar(
-        bin_center[m].to_value('TeV'), sensitivity[m], xerr=werr, yerr=serr, linestyle='', ecolor=color, zorder=20, **kwargs
+        bin_center[m].to_value('TeV'), sensitivity[m], xerr=werr, yerr=serr, linestyle='', ecolor=color, zorder=20, label=label, **kwargs
     )
 
     werr = [xerr[0][~m], xerr[1][~m]] 
@@ -1,164 +1,356 @@
 import os
 
-import astropy.units as u
 import click
-import matplotlib.pyplot as plt
 import numpy as np
-import pandas as pd
-pd.set_option('display.max_columns', 500)
 from colorama import Fore
 
 from tqdm import tqdm
 
-from cta_plots import load_signal_events, load_background_events
-
-from cta_plots.binning import make_default_cta_binning
-from cta_plots.sensitivity.plotting import plot_crab_flux, plot_reference, plot_requirement, plot_sensitivity
+from cta_plots.profiling import profile_option, profiled, stage
 from cta_plots.sensitivity import calculate_n_off, calculate_n_signal
-from cta_plots.sensitivity.optimize import find_best_cuts
-from cta_plots.coordinate_utils import calculate_distance_to_true_source_position
-
-from cta_plots.spectrum import CrabSpectrum
 from cta_plots.sensitivity import find_relative_sensitivity_poisson, check_validity, check_validity_counts
 
-from scipy.ndimage import gaussian_filter1d
+# pandas, astropy, matplotlib and the plotting modules are imported where they are used
+# to keep `--help` fast
 
-crab = CrabSpectrum()
 
+def _bin_name(e_low, e_high):
+    return f'{e_low:.3g} - {e_high:.3g} TeV'
 
-def optimize_event_selection_fixed_theta(gammas, background, bin_edges, alpha=0.2, n_jobs=4):
-    results = []
 
+def _append_telemetry(telemetry, bin_telemetry, e_low, e_high):
+    if telemetry is not None:
+        telemetry.append({'e_min': e_low, 'e_max': e_high, **bin_telemetry})
+
+
+def _split_by_energy(gammas, background, bin_edges):
+    '''
+    Yield (e_low, e_high, signal_in_range, background_in_range) for each bin in estimated energy.
+    The bins are closed on the left, e_low <= energy < e_high (the last bin includes e_high),
+    see `Binning.split`. Before, pd.cut assigned events exactly on an edge to the lower bin.
+    '''
+    from cta_plots.binning import Binning
+
+    binning = Binning.from_edges(bin_edges)
+    edges = binning.edges.value
+    signal_bins = binning.split(gammas, 'gamma_energy_prediction_mean')
+    background_bins = binning.split(background, 'gamma_energy_prediction_mean')
+    for (i, signal_in_range), (_, background_in_range) in zip(signal_bins, background_bins):
+        yield edges[i], edges[i + 1], signal_in_range, background_in_range
+
+
+def write_telemetry(telemetry, output):
+    '''
+    Write the optimizer telemetry next to the output file.
+    <output>_telemetry.json contains everything including the statistics of each worker,
+    <output>_telemetry.csv one row per energy bin.
+    '''
+    import json
+    import pandas as pd
+
+    n, _ = os.path.splitext(output)
+    with open(f'{n}_telemetry.json', 'w') as f:
+        json.dump(telemetry, f, indent=2, default=float)
+
+    df = pd.DataFrame([{k: v for k, v in t.items() if k != 'workers'} for t in telemetry])
+    df['slowest_worker_evaluations_per_second'] = [
+        min((w['evaluations_per_second'] for w in t['workers']), default=np.nan) for t in telemetry
+    ]
+    df.to_csv(f'{n}_telemetry.csv', index=False, na_rep='NaN')
 
-    groups = pd.cut(gammas.gamma_energy_prediction_mean, bins=bin_edges)
-    g = gammas.groupby(groups)
 
-    groups = pd.cut(background.gamma_energy_prediction_mean, bins=bin_edges)
-    b = background.groupby(groups)
+def _best_cuts_in_bin(signal_in_range, background_in_range, alpha=0.2, n_jobs=4, extra_cuts=None, fix_theta=False):
+    '''
+    Optimize the cuts for the events in one bin of estimated energy.
+    With `fix_theta` the theta cut is the median distance of the gammas to the source position.
 
-    for (_, signal_in_range), (_, background_in_range) in tqdm(zip(g, b), total=len(bin_edges) - 1):
+    Returns
+    -------
+    tuple
+        dict of the best cuts, telemetry of `find_best_cuts`
+    '''
+    from cta_plots.sensitivity.optimize import find_best_cuts
+
+    theta_cuts = THETA_CUTS
+    if fix_theta:
+        from cta_plots.coordinate_utils import calculate_distance_to_true_source_position
         distance = calculate_distance_to_true_source_position(signal_in_range)
         theta_cuts = np.array([np.nanpercentile(distance, 50)])
-        best_sensitivity, best_prediction_cut, best_theta_cut, best_significance, best_mult = find_best_cuts(
-            theta_cuts, PREDICTION_CUTS, MULTIPLICITIES, signal_in_range, background_in_range, alpha=alpha, n_jobs=n_jobs
+
+    *best, bin_telemetry = find_best_cuts(
+        theta_cuts, PREDICTION_CUTS, MULTIPLICITIES, signal_in_range, background_in_range, alpha=alpha, n_jobs=n_jobs,
+        return_telemetry=True, extra_cuts=extra_cuts,
+    )
+    best_sensitivity, best_prediction_cut, best_theta_cut, best_significance, best_mult = best[:5]
+
+    d = {
+        'prediction_cut': best_prediction_cut,
+        'significance': best_significance,
+        'theta_cut': best_theta_cut,
+        'multiplicity': best_mult,
+    }
+    if extra_cuts:
+        d.update({f'min_{column}': value for column, value in best[5].items()})
+    return d, bin_telemetry
+
+
+def _best_cuts_in_indexed_bin(i, *args, **kwargs):
+    return (i, *_best_cuts_in_bin(*args, **kwargs))
+
+
+def _optimize_bins_from_checkpoint(gammas, background, bin_edges, checkpoint, alpha=0.2, n_jobs=4, extra_cuts=None, fix_theta=False):
+    '''
+    Reuse the bins stored in the checkpoint and optimize the remaining ones, one bin per worker.
+    Each bin is added to the checkpoint as soon as it is finished.
+    The events of a bin are only selected when the bin is dispatched to a worker.
+    Returns the checkpoint records ordered by bin.
+    '''
+    from joblib import Parallel, delayed
+    from cta_plots.binning import Binning
+
+    edges = Binning.from_edges(bin_edges).edges.value
+    records = {}
+    todo = []
+    for i, (e_low, e_high) in enumerate(zip(edges[:-1], edges[1:])):
+        r = checkpoint.get(i, e_low, e_high)
+        if r is None:
+            todo.append(i)
+        else:
+            records[i] = {**r, 'from_checkpoint': True}
+    print(f'{len(records)} energy bins from checkpoint {checkpoint.path}, optimizing {len(todo)}')
+
+    if todo:
+        remaining = set(todo)
+        bins = (
+            (i, signal_in_range, background_in_range)
+            for i, (_, _, signal_in_range, background_in_range) in enumerate(_split_by_energy(gammas, background, bin_edges))
+            if i in remaining
+        )
+        op = delayed(_best_cuts_in_indexed_bin)
+        # the bins are the unit of work here, find_best_cuts runs single threaded in each worker
+        results = Parallel(n_jobs=min(n_jobs, len(todo)), return_as='generator_unordered')(
+            op(i, s, b, alpha=alpha, n_jobs=1, extra_cuts=extra_cuts, fix_theta=fix_theta) for i, s, b in bins
         )
+        for i, d, bin_telemetry in tqdm(results, total=len(todo)):
+            records[i] = {**checkpoint.add(i, edges[i], edges[i + 1], d, bin_telemetry), 'from_checkpoint': False}
 
-        d = {
-            'prediction_cut': best_prediction_cut,
-            'significance': best_significance,
-            'theta_cut': best_theta_cut,
-            'multiplicity': best_mult,
-        }
-        results.append(d)
+    return [records[i] for i in sorted(records)]
+
+
+def _optimize_bins(gammas, background, bin_edges, alpha=0.2, n_jobs=4, telemetry=None, extra_cuts=None, fix_theta=False, checkpoint=None):
+    import astropy.units as u
+    import pandas as pd
+
+    results = []
+    if checkpoint is not None:
+        records = _optimize_bins_from_checkpoint(
+            gammas, background, bin_edges, checkpoint, alpha=alpha, n_jobs=n_jobs, extra_cuts=extra_cuts, fix_theta=fix_theta
+        )
+        for r in records:
+            results.append(r['cuts'])
+            _append_telemetry(telemetry, {**r['telemetry'], 'from_checkpoint': r['from_checkpoint']}, r['e_min'], r['e_max'])
+    else:
+        bins = _split_by_energy(gammas, background, bin_edges)
+        for e_low, e_high, signal_in_range, background_in_range in tqdm(bins, total=len(bin_edges) - 1):
+            with stage(_bin_name(e_low, e_high), n_events=len(signal_in_range) + len(background_in_range)):
+                d, bin_telemetry = _best_cuts_in_bin(
+                    signal_in_range, background_in_range, alpha=alpha, n_jobs=n_jobs, extra_cuts=extra_cuts, fix_theta=fix_theta
+                )
+            _append_telemetry(telemetry, bin_telemetry, e_low, e_high)
+            results.append(d)
 
     results_df = pd.DataFrame(results)
-    results_df['e_min'] = bin_edges[:-1]
-    results_df['e_max'] = bin_edges[1:]
+    results_df['e_min'] = u.Quantity(bin_edges[:-1], u.TeV).value
+    results_df['e_max'] = u.Quantity(bin_edges[1:], u.TeV).value
     return results_df
 
 
-def optimize_event_selection(gammas, background, bin_edges, alpha=0.2, n_jobs=4):
-    results = []
+def optimize_event_selection_fixed_theta(gammas, background, bin_edges, alpha=0.2, n_jobs=4, telemetry=None, checkpoint=None):
+    return _optimize_bins(
+        gammas, background, bin_edges, alpha=alpha, n_jobs=n_jobs, telemetry=telemetry, fix_theta=True, checkpoint=checkpoint
+    )
 
-    # theta_cuts = np.arange(0.01, 0.18, 0.01)
-    # prediction_cuts = np.arange(0.0, 1.05, 0.05)
-    # multiplicities = np.arange(2, 10)
 
+def optimize_event_selection(gammas, background, bin_edges, alpha=0.2, n_jobs=4, telemetry=None, extra_cuts=None, checkpoint=None):
+    '''
+    Find the best cuts in each bin of estimated energy.
+    The best values of the `extra_cuts` (column >= value, see `find_best_cuts`) are stored in columns `min_<column>`.
 
-    groups = pd.cut(gammas.gamma_energy_prediction_mean, bins=bin_edges)
-    g = gammas.groupby(groups)
+    If a `Checkpoint` (see `cta_plots.sensitivity.checkpoint`) is given, the result of each bin is
+    written to it as soon as the bin is finished and bins already in the checkpoint are not optimized again.
+    The remaining bins are distributed over `n_jobs` workers.
+    '''
+    return _optimize_bins(
+        gammas, background, bin_edges, alpha=alpha, n_jobs=n_jobs, telemetry=telemetry, extra_cuts=extra_cuts, checkpoint=checkpoint
+    )
 
-    groups = pd.cut(background.gamma_energy_prediction_mean, bins=bin_edges)
-    b = background.groupby(groups)
 
-    for (_, signal_in_range), (_, background_in_range) in tqdm(zip(g, b), total=len(bin_edges) - 1):
-        best_sensitivity, best_prediction_cut, best_theta_cut, best_significance, best_mult = find_best_cuts(
-            THETA_CUTS, PREDICTION_CUTS, MULTIPLICITIES, signal_in_range, background_in_range, alpha=alpha, n_jobs=n_jobs
+def _extra_cut_mask(events, cuts_row):
+    '''
+    Mask of the events passing the `min_<column>` cuts in a row of optimized cuts.
+    '''
+    m = np.ones(len(events), dtype=bool)
+    for name, value in cuts_row.items():
+        if name.startswith('min_'):
+            m &= events[name[len('min_'):]].values >= value
+    return m
+
+
+def _relative_sensitivity_in_bin(signal_in_range, background_in_range, r, alpha, rng=None):
+    best_mult = r.multiplicity
+    best_prediction_cut = r.prediction_cut
+    best_theta_cut = r.theta_cut
+    best_significance = r.significance
+
+    gammas_gammalike = signal_in_range[
+        (signal_in_range.gamma_prediction_mean >= best_prediction_cut)
+        &
+        (signal_in_range.num_triggered_telescopes >= best_mult)
+        &
+        _extra_cut_mask(signal_in_range, r)
+    ]
+
+    background_gammalike = background_in_range[
+        (background_in_range.gamma_prediction_mean >= best_prediction_cut)
+        &
+        (background_in_range.num_triggered_telescopes >= best_mult)
+        &
+        _extra_cut_mask(background_in_range, r)
+    ]
+    n_signal, n_signal_counts = calculate_n_signal(
+        gammas_gammalike, best_theta_cut,
+    )
+    n_off, n_off_counts, total_bkg_counts = calculate_n_off(
+        background_gammalike, best_theta_cut, alpha=alpha
+    )
+
+    # print('----------------')
+    # valid = check_validity(n_signal_counts, n_off_counts, total_bkg_counts, alpha=alpha, silent=True)
+    # print('----------------')
+    valid = check_validity(n_signal, n_off, alpha=alpha, silent=False)
+    valid &= check_validity_counts(n_signal_counts, n_off_counts, total_bkg_counts, alpha=alpha, silent=False)
+    # print('----------------')
+    rs = find_relative_sensitivity_poisson(n_signal, n_off, n_signal_counts, n_off_counts, alpha=alpha, rng=rng)
+    m, l, h = rs
+
+    return {
+        'sensitivity': m,
+        'sensitivity_low': l,
+        'sensitivity_high': h,
+        'prediction_cut': best_prediction_cut,
+        'significance': best_significance,
+        'signal_counts': n_signal_counts,
+        'background_counts': n_off_counts,
+        'weighted_signal_counts': n_signal,
+        'weighted_background_counts': n_off,
+        'theta_cut': best_theta_cut,
+        'multiplicity': best_mult,
+        'total_bkg_counts': total_bkg_counts,
+        'valid': valid,
+        **{name: value for name, value in r.items() if name.startswith('min_')},
+    }
+
+
+def _share_columns(df, binning, columns, directory, prefix):
+    '''
+    Write `columns` of `df` sorted by bin of estimated energy to .npy files in `directory`.
+    Returns the read only memory maps of the columns and the bounds of each bin in them.
+    joblib hands memory maps to the workers by reference, so the data is not copied.
+    '''
+    codes = binning.digitize(df, 'gamma_energy_prediction_mean')
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(binning.n_bins + 1))
+
+    shared = {}
+    for c in columns:
+        values = df[c].values
+        path = os.path.join(directory, f'{prefix}_{c}.npy')
+        out = np.lib.format.open_memmap(path, mode='w+', dtype=values.dtype, shape=values.shape)
+        np.take(values, order, out=out)
+        out.flush()
+        del out
+        shared[c] = np.load(path, mmap_mode='r')
+    return shared, bounds
+
+
+def _relative_sensitivity_in_shared_bin(signal, background, signal_bounds, background_bounds, r, alpha, seed):
+    import pandas as pd
+
+    signal_in_range = pd.DataFrame({c: v[signal_bounds[0]:signal_bounds[1]] for c, v in signal.items()})
+    background_in_range = pd.DataFrame({c: v[background_bounds[0]:background_bounds[1]] for c, v in background.items()})
+    return _relative_sensitivity_in_bin(signal_in_range, background_in_range, r, alpha, rng=np.random.default_rng(seed))
+
+
+def _shared_memory_directory(n_bytes):
+    '''
+    /dev/shm if it can hold `n_bytes`, the default temporary directory otherwise.
+    '''
+    import shutil
+
+    if os.path.isdir('/dev/shm') and shutil.disk_usage('/dev/shm').free > 2 * n_bytes:
+        return '/dev/shm'
+    return None
+
+
+def _relative_sensitivity_parallel(gammas, background, bin_edges, rows, seeds, alpha, n_jobs):
+    import tempfile
+    from joblib import Parallel, delayed
+    from cta_plots.binning import Binning
+
+    binning = Binning.from_edges(bin_edges)
+    extra = [name[len('min_'):] for name in rows[0].index if name.startswith('min_')] if rows else []
+    columns = ['gamma_prediction_mean', 'num_triggered_telescopes', 'theta', 'weight'] + extra
+
+    n_bytes = sum(df[c].values.nbytes for df in (gammas, background) for c in columns)
+    with tempfile.TemporaryDirectory(prefix='cta_plots_', dir=_shared_memory_directory(n_bytes)) as directory:
+        signal, signal_bounds = _share_columns(gammas, binning, columns, directory, 'signal')
+        bkg, bkg_bounds = _share_columns(background, binning, columns, directory, 'background')
+
+        op = delayed(_relative_sensitivity_in_shared_bin)
+        results = Parallel(n_jobs=n_jobs)(
+            op(signal, bkg, signal_bounds[i:i + 2], bkg_bounds[i:i + 2], r, alpha, seed)
+            for i, (r, seed) in enumerate(zip(rows, seeds))
         )
+        del signal, bkg
+    return results
 
-        d = {
-            'prediction_cut': best_prediction_cut,
-            'significance': best_significance,
-            'theta_cut': best_theta_cut,
-            'multiplicity': best_mult,
-        }
-        results.append(d)
 
-    results_df = pd.DataFrame(results)
-    results_df['e_min'] = bin_edges[:-1]
-    results_df['e_max'] = bin_edges[1:]
-    return results_df
+@profiled('errors')
+def calc_relative_sensitivity(gammas, background, cuts, alpha, sigma=0, n_jobs=1, seed=0):
+    '''
+    Relative sensitivity with Poisson errors for the optimized `cuts` in each bin of estimated energy.
 
+    The Poisson samples of each bin come from their own random stream spawned from `seed`,
+    so the result depends on the seed but not on `n_jobs`. With n_jobs > 1 the bins are evaluated
+    by a process pool. The needed event columns are sorted by energy bin and put into shared memory once,
+    each worker reads the slice of its bin from there.
+    '''
+    import astropy.units as u
+    import pandas as pd
+    from scipy.ndimage import gaussian_filter1d
 
-def calc_relative_sensitivity(gammas, background, cuts, alpha, sigma=0):
     bin_edges = list(cuts['e_min']) + [cuts['e_max'].iloc[-1]]
 
-    results = []
-
     if sigma > 0:
         cuts.prediction_cut = gaussian_filter1d(cuts.prediction_cut, sigma=sigma)
         cuts.theta_cut = gaussian_filter1d(cuts.theta_cut, sigma=sigma)
         cuts.multiplicity = gaussian_filter1d(cuts.multiplicity, sigma=sigma)
 
-    groups = pd.cut(gammas.gamma_energy_prediction_mean, bins=bin_edges)
-    g = gammas.groupby(groups)
-
-    groups = pd.cut(background.gamma_energy_prediction_mean, bins=bin_edges)
-    b = background.groupby(groups)
-
-    for (_, signal_in_range), (_, background_in_range), (_, r) in tqdm(zip(g, b, cuts.iterrows()), total=len(bin_edges) - 1):
-        best_mult = r.multiplicity
-        best_prediction_cut = r.prediction_cut
-        best_theta_cut = r.theta_cut
-        best_significance = r.significance
+    rows = [r for _, r in cuts.iterrows()]
+    seeds = np.random.SeedSequence(seed).spawn(len(rows))
 
-        gammas_gammalike = signal_in_range[
-            (signal_in_range.gamma_prediction_mean >= best_prediction_cut)
-            &
-            (signal_in_range.num_triggered_telescopes >= best_mult)
+    if n_jobs > 1:
+        results = _relative_sensitivity_parallel(gammas, background, bin_edges, rows, seeds, alpha, n_jobs)
+    else:
+        bins = _split_by_energy(gammas, background, bin_edges)
+        results = [
+            _relative_sensitivity_in_bin(signal_in_range, background_in_range, r, alpha, rng=np.random.default_rng(s))
+            for (_, _, signal_in_range, background_in_range), r, s in tqdm(zip(bins, rows, seeds), total=len(rows))
         ]
 
-        background_gammalike = background_in_range[
-            (background_in_range.gamma_prediction_mean >= best_prediction_cut)
-            &
-            (background_in_range.num_triggered_telescopes >= best_mult)
-        ]
-        n_signal, n_signal_counts = calculate_n_signal(
-            gammas_gammalike, best_theta_cut,
-        )
-        n_off, n_off_counts, total_bkg_counts = calculate_n_off(
-            background_gammalike, best_theta_cut, alpha=alpha
-        )
-
-        # print('----------------')
-        # valid = check_validity(n_signal_counts, n_off_counts, total_bkg_counts, alpha=alpha, silent=True)
-        # print('----------------')
-        valid = check_validity(n_signal, n_off, alpha=alpha, silent=False)
-        valid &= check_validity_counts(n_signal_counts, n_off_counts, total_bkg_counts, alpha=alpha, silent=False)
-        # print('----------------')
-        rs = find_relative_sensitivity_poisson(n_signal, n_off, n_signal_counts, n_off_counts, alpha=alpha)
-        m, l, h = rs
-        
-        d = {
-            'sensitivity': m,
-            'sensitivity_low': l,
-            'sensitivity_high': h,
-            'prediction_cut': best_prediction_cut,
-            'significance': best_significance,
-            'signal_counts': n_signal_counts,
-            'background_counts': n_off_counts,
-            'weighted_signal_counts': n_signal,
-            'weighted_background_counts': n_off,
-            'theta_cut': best_theta_cut,
-            'multiplicity': best_mult,
-            'total_bkg_counts': total_bkg_counts,
-            'valid': valid,
-        }
-        results.append(d)
-
     results_df = pd.DataFrame(results)
-    results_df['e_min'] = bin_edges[:-1]
-    results_df['e_max'] = bin_edges[1:]
+    results_df['e_min'] = u.Quantity(bin_edges[:-1], u.TeV).value
+    results_df['e_max'] = u.Quantity(bin_edges[1:], u.TeV).value
     return results_df
 
 
@@ -167,82 +359,132 @@ PREDICTION_CUTS = np.arange(0.3, 1.05, 0.05)
 MULTIPLICITIES = np.arange(2, 11)
 
 
-@click.command()
-@click.argument('gammas_path', type=click.Path(exists=True))
-@click.argument('protons_path', type=click.Path(exists=True))
-@click.argument('electrons_path', type=click.Path(exists=True))
-@click.option('-o', '--output', type=click.Path(exists=False))
-@click.option('-m', '--multiplicity', default=2)
-@click.option('-t', '--t_obs', default=50)
-@click.option('-c', '--color', default='xkcd:purple')
-@click.option('--n_jobs', default=4)
-@click.option('--landscape/--no-landscape', default=False)
-@click.option('--reference/--no-reference', default=False)
-@click.option('--fix_theta/--no-fix_theta', default=False)
-@click.option('--correct_bias/--no-correct_bias', default=True)
-@click.option('--requirement/--no-requirement', default=False)
-@click.option('--flux/--no-flux', default=True)
-def main(
-    gammas_path,
-    protons_path,
-    electrons_path,
-    output,
-    multiplicity,
-    t_obs,
-    color,
-    n_jobs,
-    landscape,
-    reference,
-    fix_theta,
-    correct_bias,
-    requirement,
-    flux,
+def calculate_sensitivity(
+    gammas, background, fix_theta=False, correct_bias=True, n_jobs=4, telemetry=None, extra_cuts=None, checkpoint=None, seed=0,
 ):
-    t_obs *= u.h
-
-    gammas, source_alt, source_az = load_signal_events(gammas_path, assumed_obs_time=t_obs)
-    background = load_background_events(
-        protons_path, electrons_path, source_alt, source_az, assumed_obs_time=t_obs
-    )
+    '''
+    Optimize the event selection in bins of estimated energy and calculate the relative sensitivity.
+    The energy bias correction is applied to copies of the energy columns, the input tables are not modified.
+    If a list is passed as `telemetry`, the optimizer statistics for each energy bin are appended to it.
+    `extra_cuts` are additional cuts to optimize, see `find_best_cuts`.
+    Finished energy bins are stored in and reused from the `checkpoint`, see `optimize_event_selection`.
+    `seed` determines the Poisson samples of the errors, see `calc_relative_sensitivity`.
+
+    Returns
+    -------
+    tuple
+        df_sensitivity, bin_edges, bin_center
+    '''
+    import astropy.units as u
+    from cta_plots.binning import make_default_cta_binning
 
     e_min, e_max = 0.02 * u.TeV, 200 * u.TeV
     bin_edges, bin_center, _ = make_default_cta_binning(e_min=e_min, e_max=e_max)
     SIGMA = 0
     if correct_bias:
-        from scipy.stats import binned_statistic
-        from cta_plots import create_interpolated_function
+        gammas, background = correct_energy_bias(gammas, background, bin_edges, bin_center, sigma=SIGMA)
+    else:
+        print(Fore.YELLOW + 'Not correcting for energy bias' + Fore.RESET)
+
+    with stage('optimize', n_events=len(gammas) + len(background)):
+        if fix_theta:
+            print('Not optimizing theta!')
+            df_cuts = optimize_event_selection_fixed_theta(
+                gammas, background, bin_edges, alpha=0.2, n_jobs=n_jobs, telemetry=telemetry, checkpoint=checkpoint
+            )
+        else:
+            df_cuts = optimize_event_selection(
+                gammas, background, bin_edges, alpha=0.2, n_jobs=n_jobs, telemetry=telemetry, extra_cuts=extra_cuts,
+                checkpoint=checkpoint,
+            )
+    
+    df_sensitivity = calc_relative_sensitivity(gammas, background, df_cuts, alpha=0.2, sigma=SIGMA, n_jobs=n_jobs, seed=seed)
+    return df_sensitivity, bin_edges, bin_center
+
 
+def correct_energy_bias(gammas, background, bin_edges, bin_center, sigma=0):
+    '''
+    Correct the estimated energy of signal and background for the median bias of the gammas.
+    Returns copies, the input tables are not modified.
+    '''
+    from scipy.stats import binned_statistic
+    from cta_plots import create_interpolated_function
+
+    with stage('bias', n_events=len(gammas) + len(background)):
         e_reco = gammas.gamma_energy_prediction_mean
         e_true = gammas.mc_energy
         resolution = (e_reco - e_true) / e_true
 
         median, _, _ = binned_statistic(e_reco, resolution, statistic=np.nanmedian, bins=bin_edges)
-        energy_bias = create_interpolated_function(bin_center, median, sigma=SIGMA)
+        energy_bias = create_interpolated_function(bin_center, median, sigma=sigma)
 
         e_corrected = e_reco / (energy_bias(e_reco) + 1)
-        gammas.gamma_energy_prediction_mean = e_corrected
+        gammas = gammas.assign(gamma_energy_prediction_mean=e_corrected)
 
         e_reco = background.gamma_energy_prediction_mean
         e_corrected = e_reco / (energy_bias(e_reco) + 1)
-        background.gamma_energy_prediction_mean = e_corrected
-        
+        background = background.assign(gamma_energy_prediction_mean=e_corrected)
+    return gammas, background
+
+
+def calculate_sensitivity_spectra(gammas, background, spectra, correct_bias=True, alpha=0.2, seed=0):
+    '''
+    Calculate the sensitivity for several assumed signal spectra at once.
+    The gammas need the columns `weight_<name>` for each spectrum, see `load_signal_events`.
+
+    The cut grid is evaluated on histograms of the events (see `cta_plots.sensitivity.grid`)
+    so the bin indices, background sums and cumulative sums are computed once
+    and each additional spectrum only adds one weighted histogram.
+    `seed` determines the Poisson samples of the errors.
+
+    Returns
+    -------
+    tuple
+        dict mapping spectrum names to df_sensitivity, bin_edges, bin_center
+    '''
+    import astropy.units as u
+    from cta_plots import weight_column
+    from cta_plots.binning import Binning
+    from cta_plots.sensitivity.grid import default_grid, grid_counts, optimize_grid
+
+    grid = default_grid()
+    bin_edges, bin_center, _ = Binning.from_edges(grid['energy'] * u.TeV)
+    if correct_bias:
+        gammas, background = correct_energy_bias(gammas, background, bin_edges, bin_center)
     else:
         print(Fore.YELLOW + 'Not correcting for energy bias' + Fore.RESET)
 
-    if fix_theta:
-        print('Not optimizing theta!')
-        df_cuts = optimize_event_selection_fixed_theta(gammas, background, bin_edges, alpha=0.2, n_jobs=n_jobs)
-    else:
-        df_cuts = optimize_event_selection(gammas, background, bin_edges, alpha=0.2, n_jobs=n_jobs)
-    
-    df_sensitivity = calc_relative_sensitivity(gammas, background, df_cuts, alpha=0.2, sigma=SIGMA)
+    with stage('optimize', n_events=len(gammas) + len(background)):
+        n_signal, n_signal_counts = grid_counts(gammas, grid, weights=[weight_column(name) for name in spectra])
+        background_w, background_counts = grid_counts(background[background.theta <= 1.0], grid, theta=False)
+        results = optimize_grid(grid, n_signal, n_signal_counts, background_w, background_counts, alpha=alpha, seed=seed)
+
+    return dict(zip(spectra, results)), bin_edges, bin_center
+
+
+def plot_sensitivity_curve(
+    df_sensitivity, bin_edges, bin_center, color='xkcd:purple', reference=False, requirement=False, flux=True, landscape=False, spectra=None,
+):
+    '''
+    Plot the sensitivity curve. If `spectra` is given, `df_sensitivity` is a dict mapping
+    spectrum names to results and one curve is drawn for each of them.
+    '''
+    import matplotlib.pyplot as plt
+    from cta_plots.sensitivity.plotting import plot_crab_flux, plot_reference, plot_requirement, plot_sensitivity
 
-    print(df_sensitivity)
     if landscape:
         size = plt.gcf().get_size_inches()
         plt.figure(figsize=(8.24, size[0] * 0.9))
     
-    ax = plot_sensitivity(df_sensitivity, bin_edges, bin_center, color=color, lw=2)
+    if spectra:
+        from cta_plots.spectrum import signal_spectrum
+        for i, name in enumerate(spectra):
+            ax = plot_sensitivity(
+                df_sensitivity[name], bin_edges, bin_center, color=color if i == 0 else f'C{i}', lw=2,
+                spectrum=signal_spectrum(name), label=name,
+            )
+    else:
+        ax = plot_sensitivity(df_sensitivity, bin_edges, bin_center, color=color, lw=2)
 
     if reference:
         plot_reference(ax)
@@ -262,9 +504,9 @@ def main(
     
     # fix legend handles. The handle for the reference is different form a line2d handle. this makes it consistent.
     from matplotlib.lines import Line2D
-    handles = ax.get_legend_handles_labels()[0]
-    labels = ax.get_legend_handles_labels()[1]
-    handles[2] = Line2D([0], [0], color=handles[2].lines[0].get_color())  
+    handles, labels = ax.get_legend_handles_labels()
+    if reference:
+        handles = [Line2D([0], [0], color=h.lines[0].get_color()) if l == 'Reference' else h for h, l in zip(handles, labels)]
     legend = ax.legend(handles, labels, framealpha=0, borderaxespad=0.025)
 
     # add meta information to legend title
@@ -275,20 +517,158 @@ def main(
 
 
     plt.tight_layout(pad=0, rect=(0, 0, 1, 1))
-    if output:
-        n, _ = os.path.splitext(output)
-        print(f"writing csv to {n + '.csv'}")
-        df_sensitivity.to_csv(n + '.csv', index=False, na_rep='NaN')
-        plt.savefig(output)
+    return ax
+
+
+def write_cut_ranges(output):
+    n, _ = os.path.splitext(output)
+    with open(f'{n}_theta_cuts.txt', 'w') as f:
+        f.write(cuts_to_latex(THETA_CUTS))
+
+    with open(f'{n}_prediction_cuts.txt', 'w') as f:
+        f.write(cuts_to_latex(PREDICTION_CUTS))
+
+    with open(f'{n}_multiplicities.txt', 'w') as f:
+        f.write(cuts_to_latex(MULTIPLICITIES, integer=True))
+
+
+@click.command()
+@profile_option
+@click.argument('gammas_path', type=click.Path(exists=True))
+@click.argument('protons_path', type=click.Path(exists=True))
+@click.argument('electrons_path', type=click.Path(exists=True))
+@click.option('-o', '--output', type=click.Path(exists=False))
+@click.option('-m', '--multiplicity', default=2)
+@click.option('-t', '--t_obs', default=50)
+@click.option('-c', '--color', default='xkcd:purple')
+@click.option('--n_jobs', default=4)
+@click.option('--landscape/--no-landscape', default=False)
+@click.option('--reference/--no-reference', default=False)
+@click.option('--fix_theta/--no-fix_theta', default=False)
+@click.option('--correct_bias/--no-correct_bias', default=True)
+@click.option('--requirement/--no-requirement', default=False)
+@click.option('--flux/--no-flux', default=True)
+@click.option(
+    '--preview', type=click.FloatRange(0, 1, min_open=True), default=None,
+    help='Quick look using only this fraction of the events in each bin of true energy. Weights are scaled up accordingly.'
+)
+@click.option(
+    '--seed', default=0,
+    help='Seed for the --preview selection and the Poisson errors. Larger fractions with the same seed contain all events of smaller ones.'
+)
+@click.option(
+    '-s', '--spectrum', 'spectra', multiple=True,
+    help='Assumed source spectrum, can be given multiple times. One of crab, crab_hegra, crab_veritas, crab_magic or powerlaw:<index>.'
+    ' All spectra are evaluated in one pass on the cut grid.'
+)
+@click.option(
+    '--type_multiplicity/--no-type_multiplicity', default=False,
+    help='Also optimize the minimum number of triggered telescopes of each type (LST, MST, SST).'
+)
+@click.option(
+    '--checkpoint', 'checkpoint_path', type=click.Path(dir_okay=False),
+    help='Store the optimized cuts of each energy bin in this file as soon as the bin is done.'
+    ' A restart with the same inputs and options only optimizes the missing bins.'
+)
+def main(
+    gammas_path,
+    protons_path,
+    electrons_path,
+    output,
+    multiplicity,
+    t_obs,
+    color,
+    n_jobs,
+    landscape,
+    reference,
+    fix_theta,
+    correct_bias,
+    requirement,
+    flux,
+    preview,
+    seed,
+    spectra,
+    type_multiplicity,
+    checkpoint_path,
+):
+    import astropy.units as u
+    import matplotlib.pyplot as plt
+    import pandas as pd
+    from cta_plots import DEFAULT_COLUMNS, load_signal_events, load_background_events
+    from cta_plots.sensitivity.optimize import TELESCOPE_TYPE_CUTS
+    from cta_plots.spectrum import signal_spectrum
+
+    pd.set_option('display.max_columns', 500)
+    t_obs *= u.h
+
+    for name in spectra:
+        try:
+            signal_spectrum(name)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param_hint='--spectrum')
+    if spectra and fix_theta:
+        raise click.UsageError('--spectrum cannot be combined with --fix_theta')
+    if type_multiplicity and (spectra or fix_theta):
+        raise click.UsageError('--type_multiplicity cannot be combined with --spectrum or --fix_theta')
+    if checkpoint_path and spectra:
+        raise click.UsageError('--checkpoint cannot be combined with --spectrum')
+
+    columns = DEFAULT_COLUMNS
+    extra_cuts = None
+    if type_multiplicity:
+        extra_cuts = TELESCOPE_TYPE_CUTS
+        columns = DEFAULT_COLUMNS + list(TELESCOPE_TYPE_CUTS)
+
+    gammas, source_alt, source_az = load_signal_events(
+        gammas_path, assumed_obs_time=t_obs, preview=preview, seed=seed, spectra=spectra, columns=columns
+    )
+    background = load_background_events(
+        protons_path, electrons_path, source_alt, source_az, assumed_obs_time=t_obs, preview=preview, seed=seed, columns=columns
+    )
+
+    checkpoint = None
+    if checkpoint_path:
+        from cta_plots.sensitivity.checkpoint import Checkpoint, checkpoint_key
+        key = checkpoint_key(
+            [gammas_path, protons_path, electrons_path], command='sensitivity', t_obs=t_obs.to_value(u.h), fix_theta=fix_theta,
+            correct_bias=correct_bias, preview=preview, seed=seed, theta_cuts=THETA_CUTS.tolist(),
+            prediction_cuts=PREDICTION_CUTS.tolist(), multiplicities=MULTIPLICITIES.tolist(),
+            extra_cuts={column: cuts.tolist() for column, cuts in (extra_cuts or {}).items()},
+        )
+        checkpoint = Checkpoint(checkpoint_path, key)
 
-        with open(f'{n}_theta_cuts.txt', 'w') as f:
-            f.write(cuts_to_latex(THETA_CUTS))
+    if spectra:
+        results, bin_edges, bin_center = calculate_sensitivity_spectra(gammas, background, spectra, correct_bias=correct_bias, seed=seed)
+        df_sensitivity = pd.concat([df.assign(spectrum=name) for name, df in results.items()], ignore_index=True)
+    else:
+        telemetry = []
+        df_sensitivity, bin_edges, bin_center = calculate_sensitivity(
+            gammas, background, fix_theta=fix_theta, correct_bias=correct_bias, n_jobs=n_jobs, telemetry=telemetry,
+            extra_cuts=extra_cuts, checkpoint=checkpoint, seed=seed,
+        )
+        results = df_sensitivity
+        if output:
+            write_telemetry(telemetry, output)
 
-        with open(f'{n}_prediction_cuts.txt', 'w') as f:
-            f.write(cuts_to_latex(PREDICTION_CUTS))
+    if preview:
+        # signal_counts and background_counts are the statistics actually used
+        df_sensitivity['preview_fraction'] = preview
+        df_sensitivity['preview_seed'] = seed
 
-        with open(f'{n}_multiplicities.txt', 'w') as f:
-            f.write(cuts_to_latex(MULTIPLICITIES, integer=True))
+    print(df_sensitivity)
+    with stage('plot'):
+        plot_sensitivity_curve(
+            results, bin_edges, bin_center, color=color, reference=reference, requirement=requirement, flux=flux, landscape=landscape,
+            spectra=spectra,
+        )
+
+    if output:
+        n, _ = os.path.splitext(output)
+        print(f"writing csv to {n + '.csv'}")
+        with stage('write'):
+            df_sensitivity.to_csv(n + '.csv', index=False, na_rep='NaN')
+            plt.savefig(output)
+            write_cut_ranges(output)
     else:
         plt.show()
 
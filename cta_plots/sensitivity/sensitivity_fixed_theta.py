@@ -5,7 +5,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 from colorama import Fore
-from fact.analysis import li_ma_significance
+from cta_plots.statistics import li_ma_significance
 from tqdm import tqdm
 from cta_plots.binning import make_default_cta_binning
 from cta_plots import load_signal_events, load_background_events, load_angular_resolution_function 
@@ -1,21 +1,25 @@
 import click
 import numpy as np
-import matplotlib.pyplot as plt
-import astropy.units as u
 import os
 
-import matplotlib.offsetbox as offsetbox
-from cta_plots import load_signal_events, load_background_events, ELECTRON_TYPE
-from cta_plots.sensitivity.optimize import find_best_cuts
+from cta_plots import ELECTRON_TYPE
+from cta_plots.histogram import histogram
+from cta_plots.profiling import profile_option, stage
 
 
 @click.command()
+@profile_option
 @click.argument('gammas_path', type=click.Path(exists=True))
 @click.argument('protons_path', type=click.Path(exists=True))
 @click.argument('electrons_path', type=click.Path(exists=True))
 @click.option('-o', '--output', type=click.Path(exists=False))
 @click.option('-j', '--n_jobs', default=4)
 def main(gammas_path, protons_path, electrons_path, output, n_jobs):
+    import astropy.units as u
+    import matplotlib.offsetbox as offsetbox
+    import matplotlib.pyplot as plt
+    from cta_plots import load_signal_events, load_background_events
+    from cta_plots.sensitivity.optimize import find_best_cuts
 
     t_obs = 1 * u.min
 
@@ -30,9 +34,10 @@ def main(gammas_path, protons_path, electrons_path, output, n_jobs):
     # prediction_cuts = np.arange(0.0, 1, 0.25)
     # multiplicities = [2]
 
-    best_sensitivity, best_prediction_cut, best_theta_cut, best_significance, best_mult = find_best_cuts(
-        theta_cuts, prediction_cuts, multiplicities, gammas, background, alpha=1, criterion='significance', n_jobs=n_jobs
-    )
+    with stage('optimize', n_events=len(gammas) + len(background)):
+        best_sensitivity, best_prediction_cut, best_theta_cut, best_significance, best_mult = find_best_cuts(
+            theta_cuts, prediction_cuts, multiplicities, gammas, background, alpha=1, criterion='significance', n_jobs=n_jobs
+        )
 
     gammas_gammalike = gammas.query(f'gamma_prediction_mean > {best_prediction_cut}').copy()
     background_gammalike = background.query(f'gamma_prediction_mean > {best_prediction_cut}').copy()
@@ -40,8 +45,10 @@ def main(gammas_path, protons_path, electrons_path, output, n_jobs):
     off = background_gammalike
 
     bins = np.arange(0, 0.5, 0.01)
-    h_off, _ = np.histogram(off['theta'] ** 2, bins=bins, weights=off.weight)
-    h_on, _ = np.histogram(on['theta'] ** 2, bins=bins, weights=on.weight)
+    # binning theta with the square root of the theta^2 edges gives the theta^2 histogram
+    theta_bins = np.sqrt(bins)
+    h_off = histogram(off, 'theta', theta_bins, weights='weight').sum_w
+    h_on = histogram(on, 'theta', theta_bins, weights='weight').sum_w
 
     fig = plt.figure()
     ax = fig.add_subplot(111)
@@ -52,9 +59,7 @@ def main(gammas_path, protons_path, electrons_path, output, n_jobs):
 
 
     off_electrons = off.query(f'type == {ELECTRON_TYPE}')
-    h_off_electrons, _ = np.histogram(
-        off_electrons['theta'] ** 2, bins=bins, weights=off_electrons.weight
-    )
+    h_off_electrons = histogram(off_electrons, 'theta', theta_bins, weights='weight').sum_w
     ax.step(bins[:-1], h_off_electrons, where='post', label='off events electrons', color='gray')
 
     ax.set_ylim([0, max(h_on + h_off) * 1.18])
@@ -0,0 +1,126 @@
+'''
+On disk cache of loaded (and cut) event tables which is shared between invocations.
+
+Each table is stored as one .npy file per column in a directory named after a hash of the
+input files (absolute path, size and modification time) and the loading options.
+Later invocations memory map the columns instead of reading and cutting the hdf5 file again.
+Since the files are mapped read only, all processes using the same session share the
+pages in the OS page cache.
+
+The cache is opt-in. It is used when a cache directory is given explicitly or
+through the CTA_PLOTS_CACHE environment variable.
+'''
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+CACHE_ENV = 'CTA_PLOTS_CACHE'
+
+
+def _fingerprint(path):
+    if path is None:
+        return None
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+
+def session_key(path, cuts_path=None, **options):
+    '''
+    Hash identifying a table loaded from `path` with the cuts in `cuts_path`.
+    Modifying any of the files or passing different options results in a new key.
+    '''
+    description = {'path': _fingerprint(path), 'cuts': _fingerprint(cuts_path), 'options': options}
+    return hashlib.sha1(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+
+def cache_directory(cache_dir=None):
+    '''
+    The directory given or the one from the CTA_PLOTS_CACHE environment variable. None if neither is set.
+    '''
+    return cache_dir or os.environ.get(CACHE_ENV) or None
+
+
+def read_session(cache_dir, key):
+    '''
+    Attach to a stored table. Returns a DataFrame or None if there is no session for this key.
+    '''
+    import pandas as pd
+
+    session_dir = os.path.join(cache_dir, key)
+    try:
+        with open(os.path.join(session_dir, 'meta.json')) as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        return None
+
+    columns = {c: np.load(os.path.join(session_dir, f'{i}.npy'), mmap_mode='r') for i, c in enumerate(meta['columns'])}
+    return pd.DataFrame(columns, index=pd.RangeIndex(meta['n_rows']), copy=False)
+
+
+def write_session(cache_dir, key, df, source=None):
+    '''
+    Store the table under the given key. The session is written to a temporary directory
+    which is renamed when complete, so concurrent readers never see partial sessions.
+    `source` is the list of input files (None entries allowed). Sessions of the same source files
+    stored before they were modified (size or modification time changed) are removed,
+    sessions of the same files loaded with other options are kept.
+    '''
+    signature = [_fingerprint(p) for p in source] if source is not None else None
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=cache_dir, prefix='.tmp-')
+    try:
+        for i, c in enumerate(df.columns):
+            np.save(os.path.join(tmp, f'{i}.npy'), np.ascontiguousarray(df[c].values))
+        meta = {'columns': list(df.columns), 'n_rows': len(df), 'source': source, 'signature': signature}
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        os.rename(tmp, os.path.join(cache_dir, key))
+    except OSError:
+        # another process stored the same session in the meantime
+        shutil.rmtree(tmp, ignore_errors=True)
+        return
+
+    if source is not None:
+        for other, meta in list_sessions(cache_dir):
+            if other != key and meta.get('source') == source and meta.get('signature') != signature:
+                shutil.rmtree(os.path.join(cache_dir, other), ignore_errors=True)
+
+
+def list_sessions(cache_dir):
+    '''
+    Yield (key, meta) for all complete sessions in the cache directory.
+    '''
+    if not os.path.isdir(cache_dir):
+        return
+    for key in sorted(os.listdir(cache_dir)):
+        try:
+            with open(os.path.join(cache_dir, key, 'meta.json')) as f:
+                yield key, json.load(f)
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+
+
+def clear_sessions(cache_dir):
+    for key, _ in list(list_sessions(cache_dir)):
+        shutil.rmtree(os.path.join(cache_dir, key), ignore_errors=True)
+
+
+def cached(loader, path, cuts_path=None, cache_dir=None, **options):
+    '''
+    Call `loader(path, cuts_path=cuts_path, **options)` unless a session for these inputs
+    exists in the cache directory. Without a cache directory this just calls the loader.
+    '''
+    cache_dir = cache_directory(cache_dir)
+    if cache_dir is None:
+        return loader(path, cuts_path=cuts_path, **options)
+
+    key = session_key(path, cuts_path, loader=f'{loader.__module__}.{loader.__name__}', **options)
+    df = read_session(cache_dir, key)
+    if df is None:
+        df = loader(path, cuts_path=cuts_path, **options)
+        write_session(cache_dir, key, df, source=[os.path.abspath(path), cuts_path and os.path.abspath(cuts_path)])
+    return df
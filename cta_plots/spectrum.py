@@ -270,7 +270,7 @@ class CrabLogParabolaMagic(Spectrum):
     https://arxiv.org/pdf/1406.6892.pdf
     '''
 
-    def __init__(self, index=-2.47, normalization_constant=3.23E-8 * u.Unit('cm-2 s-1 GeV-1'), beta=-0.24):
+    def __init__(self, index=-2.47, normalization_constant=3.23E-11 * u.Unit('cm-2 s-1 TeV-1'), beta=-0.24):
         self.index = index
         self.normalization_constant = normalization_constant
         self.beta = beta
@@ -294,6 +294,34 @@ class CrabLogParabolaMagic(Spectrum):
 
 
 
+SIGNAL_SPECTRA = {
+    'crab': CrabLogParabola,
+    'crab_hegra': CrabSpectrum,
+    'crab_veritas': CrabLogParabolaVeritas,
+    'crab_magic': CrabLogParabolaMagic,
+}
+
+
+def signal_spectrum(name):
+    '''
+    Get an assumed source spectrum by name. Either one of the keys of `SIGNAL_SPECTRA` or
+    `powerlaw:<index>` for a power law with the given index and the flux of the
+    Crab Nebula (`CrabLogParabola`) at 1 TeV, e.g. `powerlaw:-2.0`.
+    '''
+    if name in SIGNAL_SPECTRA:
+        return SIGNAL_SPECTRA[name]()
+
+    kind, _, index = name.partition(':')
+    if kind == 'powerlaw':
+        try:
+            index = float(index)
+        except ValueError:
+            raise ValueError(f'Invalid power law index in {name}')
+        return Spectrum(index, CrabLogParabola().normalization_constant)
+
+    raise ValueError(f'Unknown spectrum {name}. Use one of {", ".join(SIGNAL_SPECTRA)} or powerlaw:<index>')
+
+
 class CTAElectronSpectrum(Spectrum):
     '''
     See the IRF ASWG report page 22 and 23
@@ -521,6 +549,32 @@ class MCSpectrum(Spectrum):
         assert w.si.unit.is_unity() is True
         return w.value
 
+    @u.quantity_input(event_energies=u.TeV, t_assumed_obs=u.h,)
+    def reweigh_to_other_spectra(
+            self,
+            other_spectra,
+            event_energies,
+            t_assumed_obs,
+    ):
+        '''
+        Weights of the given events for several spectra at once.
+        Returns an array of shape (n_events, n_spectra), column i holds the weights
+        `reweigh_to_other_spectrum` returns for `other_spectra[i]`.
+        '''
+        for other_spectrum in other_spectra:
+            if self.extended_source != other_spectrum.extended_source:
+                raise ValueError('Both spectra must either be extended sources or not. No mixing. ')
+
+        event_energies = event_energies.to('TeV')
+        # the generator flux is the same for all spectra
+        scale = t_assumed_obs.to_value('s') / self.flux(event_energies)
+        weights = np.empty((len(event_energies), len(other_spectra)))
+        for i, other_spectrum in enumerate(other_spectra):
+            w = scale * other_spectrum.flux(event_energies)
+            assert w.si.unit.is_unity() is True
+            weights[:, i] = w.si.value
+        return weights
+
     def equivalent_obstime(self, other_spectrum):   
         n_events = self.total_showers_simulated
         integral_flux = other_spectrum._integral(self.e_min, self.e_max)
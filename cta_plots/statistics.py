@@ -0,0 +1,68 @@
+'''
+Significance of an excess of on events over the scaled off events after Li & Ma (1983), eq. 17.
+
+    significance = li_ma_significance(n_on, n_off, alpha=0.2)
+
+All inputs broadcast against each other, so a whole grid of cuts or a batch of bootstrap replicas
+is evaluated in one call.
+'''
+import numpy as np
+
+
+def li_ma_significance(n_on, n_off, alpha=0.2, dtype=np.float64, use_numexpr=False):
+    '''
+    Li & Ma significance for arrays of on and off counts (weighted or not).
+
+    Same results as fact.analysis.li_ma_significance: negative excesses (n_on <= alpha * n_off),
+    empty on or off regions and NaN inputs give 0, but no floating point warnings are emitted.
+    An empty off region means there is no background estimate (e.g. too few simulated events),
+    so no significance is claimed even though the limit of the formula is finite.
+
+    Parameters
+    ----------
+    n_on : float or array like
+        number of events in the on region
+    n_off : float or array like
+        number of events in the off region(s)
+    alpha : float or array like, optional
+        ratio of the exposure of on and off regions, for wobble observations 1 / number of off regions
+    dtype : numpy dtype, optional
+        precision of the computation. np.float32 halves the memory traffic for large grids.
+        The two logarithm terms cancel, at 5 sigma the relative error in float32 is about 2e-4
+        for counts of order 1e4 but 2e-2 for counts of order 1e6.
+    use_numexpr : bool, optional
+        evaluate the logarithms with numexpr in a single multi threaded pass
+
+    Returns
+    -------
+    float or array
+        significance in units of sigma, same shape as the broadcast inputs
+    '''
+    scalar = np.ndim(n_on) == 0 and np.ndim(n_off) == 0 and np.ndim(alpha) == 0
+
+    n_on, n_off, alpha = np.broadcast_arrays(
+        np.asarray(n_on, dtype=dtype), np.asarray(n_off, dtype=dtype), np.asarray(alpha, dtype=dtype)
+    )
+    total = n_on + n_off
+
+    # cells without on or off events are set to 0 below, evaluate the logarithms at 1 there
+    positive = (n_on > 0) & (n_off > 0)
+    safe_on = np.where(positive, n_on, 1)
+    safe_off = np.where(positive, n_off, 1)
+    safe_total = np.where(positive, total, 1)
+
+    if use_numexpr:
+        import numexpr as ne
+        ts = ne.evaluate(
+            'n_on * log((1 + alpha) / alpha * safe_on / safe_total) + n_off * log((1 + alpha) * safe_off / safe_total)'
+        )
+    else:
+        ts = n_on * np.log((1 + alpha) / alpha * safe_on / safe_total)
+        ts += n_off * np.log((1 + alpha) * safe_off / safe_total)
+
+    significance = np.sqrt(2 * np.maximum(ts, 0))
+    significance = np.where(positive & (n_on > alpha * n_off), significance, 0).astype(dtype, copy=False)
+
+    if scalar:
+        return significance[()]
+    return significance
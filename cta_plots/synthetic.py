@@ -0,0 +1,366 @@
+'''
+Generate synthetic DL2 files with the layout of the CTA prod3b files.
+
+The files contain a `runs` and an `array_events` group with one dataset per column
+in the same format as written by the cta preprocessing (readable by `fact.io.read_data`).
+Showers are thrown according to the MC settings in `PRODUCTIONS` with the power law
+inverse CDF of `Spectrum.draw_energy_distribution`. A simple parametrized model decides which
+showers trigger the array and how well they are reconstructed.
+The runs table contains the number of thrown showers, so that the usual reweighting
+with `MCSpectrum.from_cta_runs` works on the generated files.
+
+    python -m cta_plots.synthetic gamma gammas.h5 -n 1000000 --pointlike
+    python -m cta_plots.synthetic proton protons.h5 -n 100000000 --seed 1
+'''
+import os
+
+import click
+import numpy as np
+
+# pandas, h5py and astropy are imported where they are used to keep `--help` fast
+
+
+# Monte Carlo settings similar to the prod3b La Palma/Paranal productions
+PRODUCTIONS = {
+    'gamma': dict(primary_id=0, e_min=0.003, e_max=330, index=-2.0, scatter=2500, viewcone=10),
+    'electron': dict(primary_id=1, e_min=0.003, e_max=330, index=-2.0, scatter=2000, viewcone=10),
+    'proton': dict(primary_id=101, e_min=0.004, e_max=600, index=-2.0, scatter=3000, viewcone=10),
+}
+
+
+# Parameters of the trigger and reconstruction model. Energies in TeV, angles in degree.
+DEFAULT_MODEL = dict(
+    # trigger probability is a logistic function in log10(E) with this threshold and width
+    threshold=0.03,
+    threshold_width=0.25,
+    # radius (m) around the array center within which showers at the threshold trigger, grows with energy
+    trigger_radius=500,
+    trigger_radius_slope=0.2,
+    # showers further away from the pointing position (degree) do not trigger
+    fov=4.0,
+    # hadrons produce less light than gammas of the same energy
+    hadron_light_fraction=0.35,
+    # relative energy resolution sigma(E) = a + b / sqrt(E)
+    energy_resolution=(0.06, 0.05),
+    energy_bias=0.0,
+    # 68% containment of the psf at 1 TeV and its energy dependence, psf = r68 * E**slope
+    psf_68=0.08,
+    psf_slope=-0.45,
+    psf_min=0.02,
+    # mean number of triggered telescopes at the threshold, grows with energy
+    multiplicity=3.0,
+    multiplicity_slope=0.6,
+    n_lst=4,
+    n_mst=25,
+    n_sst=70,
+    # separation power of the classifier at 1 TeV
+    separation=2.5,
+    # pointing position
+    pointing_alt=70.0,
+    pointing_az=0.0,
+)
+
+
+def _energy_probability(energy, model):
+    x = (np.log10(energy) - np.log10(model['threshold'])) / model['threshold_width']
+    with np.errstate(over='ignore'):
+        return 1 / (1 + np.exp(-x))
+
+
+def _trigger_radius(energy, model):
+    return model['trigger_radius'] * np.clip(energy / model['threshold'], 1, None)**model['trigger_radius_slope']
+
+
+def trigger_probability(energy, impact, model):
+    '''
+    Probability that a shower with the given (gamma equivalent) energy and impact distance triggers the array.
+    Low energy showers only trigger close to the array, high energy ones out to larger distances.
+    '''
+    radius = _trigger_radius(energy, model)
+    with np.errstate(over='ignore'):
+        return _energy_probability(energy, model) / (1 + np.exp((impact - radius) / (0.1 * radius)))
+
+
+def acceptance(offset, model):
+    '''
+    Probability that a shower at the given angular distance to the pointing position is seen by the cameras.
+    '''
+    with np.errstate(over='ignore'):
+        return 1 / (1 + np.exp((offset - model['fov']) / 0.3))
+
+
+def _sample_directions(rng, size, pointing_alt, pointing_az, max_offset):
+    '''
+    Directions distributed uniformly in solid angle within a cone of `max_offset` around the pointing.
+    Returns alt, az and the offset to the pointing position.
+    '''
+    cos_max = np.cos(np.deg2rad(max_offset))
+    offset = np.rad2deg(np.arccos(rng.uniform(cos_max, 1, size)))
+    phi = rng.uniform(0, 2 * np.pi, size)
+    return (*_offset_direction(pointing_alt, pointing_az, offset, phi), offset)
+
+
+def _offset_direction(alt, az, offset, phi):
+    '''
+    Move the direction (alt, az) by `offset` degree in the direction `phi` (radian, 0 is towards zenith).
+    '''
+    alt, az, offset = np.deg2rad(alt), np.deg2rad(az), np.deg2rad(offset)
+    sin_alt = np.sin(alt) * np.cos(offset) + np.cos(alt) * np.sin(offset) * np.cos(phi)
+    new_alt = np.arcsin(np.clip(sin_alt, -1, 1))
+    new_az = az + np.arctan2(np.sin(phi) * np.sin(offset) * np.cos(alt), np.cos(offset) - np.sin(alt) * sin_alt)
+    return np.rad2deg(new_alt), np.rad2deg(new_az) % 360
+
+
+def reconstruct(rng, particle, mc_energy, mc_alt, mc_az, mc_core_x, mc_core_y, model):
+    '''
+    Apply the resolution model to the true shower parameters of triggered events.
+    Returns a dictionary of array_events columns.
+    '''
+    energy, core_x, core_y = mc_energy, mc_core_x, mc_core_y
+    n = len(energy)
+    is_gamma_like = particle in ('gamma', 'electron')
+    light = energy if is_gamma_like else energy * model['hadron_light_fraction']
+
+    a, b = model['energy_resolution']
+    sigma_e = a + b / np.sqrt(light)
+    e_reco = light * (1 + model['energy_bias']) * rng.lognormal(0, sigma_e)
+
+    # the psf is given as 68% containment, for a 2d gaussian r68 = 1.51 sigma
+    r68 = np.maximum(model['psf_68'] * light**model['psf_slope'], model['psf_min'])
+    if not is_gamma_like:
+        r68 = r68 * 3
+    offset = (r68 / 1.51) * np.sqrt(-2 * np.log(rng.uniform(size=n)))
+    alt, az = _offset_direction(mc_alt, mc_az, offset, rng.uniform(0, 2 * np.pi, n))
+
+    mean_multiplicity = model['multiplicity'] * (light / model['threshold'])**model['multiplicity_slope']
+    n_tel = model['n_lst'] + model['n_mst'] + model['n_sst']
+    multiplicity = np.clip(2 + rng.poisson(np.maximum(mean_multiplicity - 2, 0)), 2, n_tel)
+    # large telescopes trigger at low energies, small ones at high energies
+    weights = np.stack([
+        model['n_lst'] * np.exp(-light / 1.0),
+        model['n_mst'] * np.ones(n),
+        model['n_sst'] * (1 - np.exp(-light / 3.0)),
+    ], axis=1)
+    weights /= weights.sum(axis=1, keepdims=True)
+    num_lst = np.minimum(rng.binomial(multiplicity, weights[:, 0]), model['n_lst'])
+    num_sst = np.minimum(rng.binomial(multiplicity - num_lst, weights[:, 2] / (weights[:, 1] + weights[:, 2])), model['n_sst'])
+    num_mst = multiplicity - num_lst - num_sst
+
+    # classifier output, separation improves with energy and multiplicity
+    separation = model['separation'] * np.clip(np.log10(light / model['threshold']) / np.log10(1 / model['threshold']), 0.2, 1.5)
+    score = rng.normal(separation / 2 if is_gamma_like else -separation / 2, 1)
+    gamma_prediction = 1 / (1 + np.exp(-score))
+
+    # depth of the shower maximum in g/cm^2 and its height for a simple exponential atmosphere
+    x_max = 300 + 85 * np.log10(energy) + rng.normal(0, 30 if is_gamma_like else 60, n)
+    x_max = np.clip(x_max, 50, 900)
+    cos_zenith = np.sin(np.deg2rad(mc_alt))
+    h_max = 8400 * np.log(1030 * cos_zenith / x_max)
+
+    core_resolution = 10 + 40 / np.sqrt(multiplicity)
+
+    return {
+        'gamma_energy_prediction_mean': e_reco,
+        'gamma_prediction_mean': gamma_prediction,
+        'alt': alt,
+        'az': az,
+        'num_triggered_telescopes': multiplicity,
+        'num_triggered_lst': num_lst,
+        'num_triggered_mst': num_mst,
+        'num_triggered_sst': num_sst,
+        'total_intensity': 800 * light * rng.lognormal(0, 0.3, n),
+        'mc_x_max': x_max,
+        'h_max': h_max + rng.normal(0, 300, n),
+        'core_x': core_x + rng.normal(0, core_resolution),
+        'core_y': core_y + rng.normal(0, core_resolution),
+    }
+
+
+def throw_showers(rng, size, production, model, light_fraction=1, viewcone=0, n_bins=500):
+    '''
+    Throw `size` showers according to the production settings and return
+    a dictionary with the true parameters of the ones that trigger the array.
+
+    Instead of drawing every thrown shower, the thrown showers are distributed over fine energy bins.
+    In each bin only candidates below an upper bound of the trigger probability are drawn
+    (with the inverse CDF of the power law within the bin) and accepted with the ratio of the trigger
+    probability to the bound. This is equivalent to drawing all showers, but the cost scales
+    with the number of triggered showers, which can be less than a permille of the thrown ones.
+    '''
+    index, scatter = production['index'], production['scatter']
+    edges = np.logspace(np.log10(production['e_min']), np.log10(production['e_max']), n_bins + 1)
+    integral = edges**(index + 1)
+    n_thrown = rng.multinomial(size, np.diff(integral) / (integral[-1] - integral[0]))
+
+    # both parts of the trigger probability grow with energy, so the upper edge of each bin gives the bound.
+    # Beyond three trigger radii the probability is below 1e-8 and showers are not drawn at all.
+    e_hi = edges[1:] * light_fraction
+    max_impact = np.minimum(3 * _trigger_radius(e_hi, model), scatter)
+    bound = _energy_probability(e_hi, model) * (max_impact / scatter)**2
+    n_candidates = rng.binomial(n_thrown, bound)
+
+    # same as Spectrum.draw_energy_distribution within each bin, but drawn from rng
+    bin_idx = np.repeat(np.arange(n_bins), n_candidates)
+    lo, hi = integral[:-1][bin_idx], integral[1:][bin_idx]
+    energy = (lo + (hi - lo) * rng.uniform(size=len(bin_idx)))**(1 / (index + 1))
+    impact = max_impact[bin_idx] * np.sqrt(rng.uniform(size=len(energy)))
+
+    ratio = trigger_probability(energy * light_fraction, impact, model) / _energy_probability(e_hi[bin_idx], model)
+    triggered = rng.uniform(size=len(energy)) < ratio
+    energy, impact = energy[triggered], impact[triggered]
+
+    n = len(energy)
+    if viewcone > 0:
+        mc_alt, mc_az, offset = _sample_directions(rng, n, model['pointing_alt'], model['pointing_az'], viewcone)
+        seen = rng.uniform(size=n) < acceptance(offset, model)
+        energy, impact, mc_alt, mc_az = energy[seen], impact[seen], mc_alt[seen], mc_az[seen]
+    else:
+        mc_alt, mc_az = np.full(n, model['pointing_alt']), np.full(n, model['pointing_az'])
+
+    # showers come sorted by energy bin
+    order = rng.permutation(len(energy))
+    phi = rng.uniform(0, 2 * np.pi, len(energy))
+    return {
+        'mc_energy': energy[order],
+        'mc_alt': mc_alt[order],
+        'mc_az': mc_az[order],
+        'mc_core_x': impact[order] * np.cos(phi),
+        'mc_core_y': impact[order] * np.sin(phi),
+    }
+
+
+def _append(group, columns):
+    for name, values in columns.items():
+        if name not in group:
+            group.create_dataset(name, data=values, maxshape=(None,), chunks=True)
+        else:
+            dataset = group[name]
+            n = dataset.shape[0]
+            dataset.resize((n + len(values),))
+            dataset[n:] = values
+
+
+def generate_events(
+        output_path, particle='gamma', n_events=1000000, pointlike=False, n_runs=10,
+        chunksize=1000000, model=None, seed=0, progress=False
+):
+    '''
+    Write a synthetic DL2 file with `n_events` triggered array events of the given particle type.
+
+    Showers are thrown in chunks so that about `chunksize` array events are held in memory at a time.
+    The runs table contains the number of showers thrown per run. The last run is shorter than the others.
+
+    Returns
+    -------
+    pandas.DataFrame
+        the runs table written to the file
+    '''
+    import h5py
+    import pandas as pd
+    from tqdm import tqdm
+
+    model = {**DEFAULT_MODEL, **(model or {})}
+    production = PRODUCTIONS[particle]
+    diffuse = not (pointlike and particle == 'gamma')
+    viewcone = production['viewcone'] if diffuse else 0
+
+    rng = np.random.default_rng(seed)
+
+    light_fraction = 1 if particle in ('gamma', 'electron') else model['hadron_light_fraction']
+    args = (production, model, light_fraction, viewcone)
+
+    # estimate the trigger efficiency to split the runs into chunks of about `chunksize` events
+    pilot_size = max(100 * n_events, 10**6)
+    efficiency = max(len(throw_showers(rng, pilot_size, *args)['mc_energy']) / pilot_size, 1e-9)
+    showers_per_run = int(np.ceil(n_events / efficiency / n_runs))
+    chunks_per_run = int(np.ceil(showers_per_run * efficiency / chunksize))
+    showers_per_chunk = int(np.ceil(showers_per_run / chunks_per_run))
+
+    if os.path.exists(output_path):
+        os.remove(output_path)
+
+    n_written = 0
+    num_showers = {}
+    with h5py.File(output_path, 'w') as f, tqdm(total=n_events, disable=not progress) as bar:
+        events = f.create_group('array_events')
+        chunk = 0
+        while n_written < n_events:
+            run_id = 1 + chunk // chunks_per_run
+            chunk += 1
+            showers = throw_showers(rng, showers_per_chunk, *args)
+            n = len(showers['mc_energy'])
+            thrown = showers_per_chunk
+
+            # Stop exactly after the requested number of events. The showers are in random order,
+            # so keeping the first ones is equivalent to throwing a smaller number of showers.
+            if n_written + n > n_events:
+                thrown = int(round(showers_per_chunk * (n_events - n_written) / n))
+                n = n_events - n_written
+                showers = {k: v[:n] for k, v in showers.items()}
+            num_showers[run_id] = num_showers.get(run_id, 0) + thrown
+
+            columns = {
+                'run_id': np.full(n, run_id),
+                'array_event_id': n_written + np.arange(n),
+                **showers,
+                'mc_shower_primary_id': np.full(n, production['primary_id']),
+                **reconstruct(rng, particle, model=model, **showers),
+            }
+            _append(events, columns)
+            n_written += n
+            bar.update(n)
+
+        # the last run can be shorter than the others
+        runs = pd.DataFrame({
+            'run_id': list(num_showers.keys()),
+            'mc_num_showers': list(num_showers.values()),
+            'mc_shower_reuse': 1,
+            'mc_spectral_index': production['index'],
+            'mc_energy_range_min': production['e_min'],
+            'mc_energy_range_max': production['e_max'],
+            'mc_min_scatter_range': 0.0,
+            'mc_max_scatter_range': float(production['scatter']),
+            'mc_min_viewcone_radius': 0.0,
+            'mc_max_viewcone_radius': float(viewcone),
+            'mc_diffuse': int(diffuse),
+            'mc_shower_primary_id': production['primary_id'],
+            'pointing_alt': model['pointing_alt'],
+            'pointing_az': model['pointing_az'],
+        })
+        runs_group = f.create_group('runs')
+        for c in runs.columns:
+            runs_group.create_dataset(c, data=runs[c].values)
+
+    return runs
+
+
+@click.command()
+@click.argument('particle', type=click.Choice(list(PRODUCTIONS)))
+@click.argument('output', type=click.Path(dir_okay=False))
+@click.option('-n', '--n_events', default=1000000, help='Number of (triggered) array events to write, up to 1e8')
+@click.option('--pointlike/--diffuse', default=False, help='Point-like or diffuse gammas. Background is always diffuse.')
+@click.option('--n_runs', default=10)
+@click.option('--chunksize', default=1000000, help='Number of events generated and written at once')
+@click.option('--seed', default=0)
+@click.option(
+    '-m', '--model', 'model_options', multiple=True, nargs=2, type=(str, float),
+    help='Override a parameter of the resolution model, e.g. -m psf_68 0.05. Can be given multiple times.'
+)
+def main(particle, output, n_events, pointlike, n_runs, chunksize, seed, model_options):
+    '''
+    Write a synthetic DL2 file with N_EVENTS array events of type PARTICLE to OUTPUT.
+    '''
+    for name, _ in model_options:
+        if name not in DEFAULT_MODEL or isinstance(DEFAULT_MODEL[name], tuple):
+            raise click.BadParameter(f'Unknown model parameter {name}', param_hint='--model')
+
+    runs = generate_events(
+        output, particle=particle, n_events=int(n_events), pointlike=pointlike, n_runs=n_runs,
+        chunksize=chunksize, model=dict(model_options), seed=seed, progress=True,
+    )
+    click.echo(f'Wrote {n_events} events from {runs.mc_num_showers.sum()} thrown showers to {output}')
+
+
+if __name__ == '__main__':
+    # pylint: disable=no-value-for-parameter
+    main()
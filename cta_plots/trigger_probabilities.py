@@ -1,6 +1,5 @@
 import click
 import matplotlib.pyplot as plt
-import numpy as np
 import pandas as pd
 from astropy.stats import binom_conf_interval
 import astropy.units as u
@@ -8,6 +7,7 @@ import astropy.units as u
 from cta_plots import make_energy_bins, load_effective_area_requirement
 from cta_plots.mc.spectrum import MCSpectrum
 from cta_plots.colors import color_cycle
+from cta_plots.histogram import histogram
 from itertools import zip_longest
 
 from fact.io import read_data
@@ -36,10 +36,8 @@ def main(input_files, labels, output, n_bins, threshold, reference):
         if threshold > 0:
             events = events.loc[events.gamma_prediction_mean >= threshold]
 
-        energies = events.gamma_energy_prediction_mean.values
-
         hist_all = mc_production.expected_events_for_bins(energy_bins=bins)
-        hist_selected, _ = np.histogram(energies, bins=bins)
+        hist_selected = histogram(events, 'gamma_energy_prediction_mean', bins).counts
 
         invalid = hist_selected > hist_all
         hist_selected[invalid] = hist_all[invalid]
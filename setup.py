@@ -16,6 +16,7 @@ setup(
     install_requires=[
         'click',
         'h5py',
+        'joblib>=1.4',
         'matplotlib>=2.1',
         'numexpr',
         'numpy',
@@ -30,17 +31,25 @@ setup(
         'seaborn',
         'colorama',
     ],
+    extras_require={
+        'yaml': ['pyyaml'],
+        'parquet': ['pyarrow'],
+    },
     zip_safe=False,
     entry_points={
         'console_scripts': [
             'cta_plot_effective_area = cta_plots.sensitivity.effective_area:main',
             'cta_plot_sensitivity = cta_plots.sensitivity.sensitivity:main',
+            'cta_plot_sensitivity_grid = cta_plots.sensitivity.grid:main',
+            'cta_plot_sensitivity_offset = cta_plots.sensitivity.offset:main',
             'cta_plot_theta_square = cta_plots.sensitivity.theta_squared:main',
             'cta_plot_theta_square_grid = cta_plots.sensitivity.theta_square_grid:main',
             'cta_plot_importance = cta_plots.ml.importances:main',
             'cta_plot_classifier = cta_plots.ml.classifier_cli:cli',
             'cta_plot_reco = cta_plots.reconstruction.reco_cli:cli',
             'cta_plot_irf = cta_plots.irf.irf_cli:cli',
+            'cta_plot_report = cta_plots.report:main',
+            'cta_plot_to_parquet = cta_plots.columnar:main',
         ],
     }
 )
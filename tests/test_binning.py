@@ -0,0 +1,26 @@
+import numpy as np
+import pandas as pd
+
+from cta_plots.binning import Binning
+
+
+def test_split_matches_pd_cut():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'energy': 10**rng.uniform(-2.5, 2.5, 1000), 'i': np.arange(1000)})
+    df.loc[::50, 'energy'] = np.nan
+    binning = Binning.from_edges(np.logspace(-2, 2, 9))
+
+    groups = df.groupby(pd.cut(df.energy, bins=binning.edges.value), observed=False)
+    for (i, events), (_, expected) in zip(binning.split(df, 'energy'), groups):
+        # same events in the same order
+        assert np.array_equal(events.i.values, expected.i.values)
+
+
+def test_split_edges_closed_left():
+    edges = np.array([1.0, 2.0, 3.0])
+    df = pd.DataFrame({'energy': [1.0, 2.0, 2.5, 3.0, 0.5, 3.5]})
+    binning = Binning.from_edges(edges)
+
+    bins = {i: events.energy.tolist() for i, events in binning.split(df, 'energy')}
+    # pd.cut would give (1, 2] and (2, 3]: [2.0] and [2.5, 3.0]
+    assert bins == {0: [1.0], 1: [2.0, 2.5, 3.0]}
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+
+from cta_plots.sensitivity.checkpoint import Checkpoint
+from cta_plots.sensitivity.sensitivity import optimize_event_selection
+
+
+def events(n, signal, seed):
+    rng = np.random.default_rng(seed)
+    prediction = rng.beta(5, 2, n) if signal else rng.beta(2, 5, n)
+    theta = np.abs(rng.normal(0, 0.1, n)) if signal else np.sqrt(rng.uniform(0, 1, n))
+    return pd.DataFrame({
+        'gamma_energy_prediction_mean': 10**rng.uniform(-1, 2, n),
+        'gamma_prediction_mean': prediction,
+        'num_triggered_telescopes': rng.integers(2, 12, n),
+        'theta': theta,
+        'weight': np.full(n, 0.01 if signal else 1.0),
+    })
+
+
+def test_resume_truncated_checkpoint(tmp_path):
+    gammas, background = events(5000, True, 0), events(20000, False, 1)
+    bin_edges = np.logspace(-1, 2, 5)
+    fresh = optimize_event_selection(gammas, background, bin_edges, n_jobs=1)
+
+    path = str(tmp_path / 'checkpoint.jsonl')
+    optimize_event_selection(gammas, background, bin_edges, n_jobs=1, checkpoint=Checkpoint(path, 'key'))
+
+    # header, two finished bins and a line cut off by a crash
+    with open(path) as f:
+        lines = f.read().splitlines()
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines[:3]) + '\n' + lines[3][:15])
+
+    checkpoint = Checkpoint(path, 'key')
+    assert sorted(checkpoint.results) == [0, 1]
+    resumed = optimize_event_selection(gammas, background, bin_edges, n_jobs=1, checkpoint=checkpoint)
+    pd.testing.assert_frame_equal(resumed, fresh, check_dtype=False)
+
+    with open(path) as f:
+        assert len(f.read().splitlines()) == len(bin_edges)
@@ -0,0 +1,24 @@
+import numpy as np
+import pandas as pd
+
+from cta_plots.histogram import bin_indices, histogram
+
+
+def test_partial_in_place_update():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'x': rng.random(1000)})
+    edges = np.linspace(0, 1, 11)
+
+    counts, _ = np.histogram(df.x, edges)
+    assert np.array_equal(histogram(df, 'x', edges).counts, counts)
+
+    df.loc[10:20, 'x'] = 0.999
+    counts, _ = np.histogram(df.x, edges)
+    assert np.array_equal(histogram(df, 'x', edges).counts, counts)
+
+
+def test_cached_indices_read_only():
+    df = pd.DataFrame({'x': np.linspace(0, 1, 100)})
+    idx = bin_indices(df, 'x', np.linspace(0, 1, 11))
+    assert not idx.flags.writeable
+    assert bin_indices(df, 'x', np.linspace(0, 1, 11)) is idx
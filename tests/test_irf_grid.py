@@ -0,0 +1,71 @@
+import astropy.units as u
+import numpy as np
+import pytest
+from pkg_resources import resource_filename
+
+from cta_plots.irf.grid import background_grid, background_map, effective_area_grid, energy_dispersion_grid, psf_grid
+
+IRF_FILE = resource_filename('cta_plots', 'resources/irf_file.fits')
+
+energy = np.logspace(-2, 2, 5) * u.TeV
+offset = np.linspace(0, 6, 4) * u.deg
+
+
+def test_effective_area_grid():
+    a_eff = effective_area_grid(IRF_FILE, energy, offset)
+    assert a_eff.shape == (4, 5)
+    assert a_eff.unit.is_equivalent(u.m**2)
+    assert np.all(a_eff >= 0)
+
+
+def test_energy_dispersion_grid():
+    resolution = energy_dispersion_grid(IRF_FILE, energy, offset)
+    assert resolution.shape == (4, 5)
+    assert np.any(np.isfinite(resolution))
+
+
+def test_background_grid():
+    background = background_grid(IRF_FILE, energy, offset)
+    assert background.shape == (4, 5)
+    assert np.all(background.value >= 0)
+
+
+def test_background_map():
+    detx, dety, data = background_map(IRF_FILE)
+    assert data.shape == (len(dety), len(detx))
+
+
+def test_psf_grid_parametrized_psf():
+    with pytest.raises(ValueError, match='RPSF'):
+        psf_grid(IRF_FILE, energy, offset, hdu='POINT SPREAD FUNCTION')
+
+
+def test_psf_grid_missing_hdu():
+    with pytest.raises(ValueError, match='No HDU'):
+        psf_grid(IRF_FILE, energy, offset)
+
+
+def test_grid_cli(tmp_path):
+    from click.testing import CliRunner
+    from cta_plots.irf.irf_cli import cli
+
+    output = tmp_path / 'grids.npz'
+    result = CliRunner().invoke(cli, ['grid', IRF_FILE, str(output), '--n_energy', '5', '--n_offset', '4'])
+    assert result.exit_code == 0, result.output
+
+    grids = np.load(output)
+    assert grids['effective_area'].shape == (4, 5)
+    assert np.isnan(grids['psf_radius']).all()
+    assert np.isfinite(grids['background']).all()
+
+
+def test_all_cli_skips_psf(tmp_path):
+    import matplotlib
+    matplotlib.use('Agg')
+    from click.testing import CliRunner
+    from cta_plots.irf.irf_cli import cli
+
+    result = CliRunner().invoke(cli, ['all', IRF_FILE, '-o', str(tmp_path / 'irf.png'), '--n_jobs', '1'])
+    assert result.exit_code == 0, result.output
+    assert 'Skipping psf' in result.output
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['irf_background.png', 'irf_effective_area.png', 'irf_energy_dispersion.png']
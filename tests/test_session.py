@@ -0,0 +1,26 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from cta_plots.session import cached, list_sessions
+
+
+def load(path, cuts_path=None, fraction=1.0):
+    return pd.DataFrame({'x': np.arange(10) * fraction})
+
+
+def test_sessions_with_other_options_are_kept(tmp_path):
+    path = tmp_path / 'events.h5'
+    path.write_bytes(b'events')
+    cache_dir = str(tmp_path / 'cache')
+
+    cached(load, str(path), cache_dir=cache_dir, fraction=0.1)
+    cached(load, str(path), cache_dir=cache_dir)
+    assert len(list(list_sessions(cache_dir))) == 2
+
+    # a modified input file makes both sessions stale
+    path.write_bytes(b'new events')
+    os.utime(path, ns=(0, 0))
+    cached(load, str(path), cache_dir=cache_dir)
+    assert len(list(list_sessions(cache_dir))) == 1
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from cta_plots.statistics import li_ma_significance
+
+
+def random_counts(seed=0, size=2000):
+    rng = np.random.default_rng(seed)
+    n_on = rng.poisson(rng.uniform(0, 200, size)).astype(float)
+    n_off = rng.poisson(rng.uniform(0, 500, size)).astype(float)
+    n_on[:50] = 0
+    n_off[50:100] = 0
+    n_on[100:110] = np.nan
+    n_off[110:120] = np.nan
+    return n_on, n_off
+
+
+@pytest.mark.filterwarnings('ignore::RuntimeWarning')
+@pytest.mark.parametrize('alpha', [0.2, 1.0])
+def test_fact(alpha):
+    from fact.analysis import li_ma_significance as fact_li_ma_significance
+
+    n_on, n_off = random_counts()
+    expected = fact_li_ma_significance(n_on, n_off, alpha=alpha)
+    np.testing.assert_allclose(li_ma_significance(n_on, n_off, alpha=alpha), expected, rtol=1e-9, atol=1e-9)
+
+
+def test_zero_and_nan_cells():
+    n_on, n_off = random_counts()
+    s = li_ma_significance(n_on, n_off)
+    assert (s[:120] == 0).all()
+    assert np.isfinite(s).all()
+
+
+def test_no_warnings():
+    n_on, n_off = random_counts()
+    with np.errstate(all='raise'):
+        li_ma_significance(n_on, n_off)
+
+
+def test_float32():
+    n_on, n_off = random_counts()
+    s = li_ma_significance(n_on, n_off, dtype=np.float32)
+    assert s.dtype == np.float32
+    np.testing.assert_allclose(s, li_ma_significance(n_on, n_off), rtol=1e-3, atol=1e-3)
+
+
+def test_numexpr():
+    pytest.importorskip('numexpr')
+    n_on, n_off = random_counts()
+    np.testing.assert_allclose(li_ma_significance(n_on, n_off, use_numexpr=True), li_ma_significance(n_on, n_off), rtol=1e-12)
+
+
+def test_scalar():
+    s = li_ma_significance(30, 50, alpha=0.2)
+    assert np.ndim(s) == 0
+    assert isinstance(s, np.floating)
+    assert s > 0
+
+
+def test_broadcast():
+    s = li_ma_significance(np.arange(10)[:, np.newaxis], np.arange(5), alpha=np.full(5, 0.2))
+    assert s.shape == (10, 5)